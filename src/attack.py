@@ -1,41 +1,42 @@
-import database as db
+from typing import List
+from catalog import NodeCatalog
 import pseudo as ps
-from random import choices, choice, randint
-from main import resultLog, get_visible_watermark_ids
+import config
+from watermark import RELATIONS, detect_many, get_visible_watermark_ids
 import logging
 import numpy as np
-import json
+import time
 
-def deletion_attack(session, step, verify):
+def deletion_attack(backend, step, verify, seed: int = None):
     """
     Perform a deletion attack on the database
 
+    :param backend: the graph backend holding the database
     :param step: the amount of documents that need to be deleted
-    :param verify: the function used for verification of the watermark
+    :param verify: the IncrementalVerifier used for verification of the watermark, notified of every deleted or modified document
+    :param seed: Optional. The seed for the random generator
     """
     logging.debug("Deletion attack started with step {step}".format(step=step))
-    nodes_before = session.execute_read(db.all_ids_count)
-    nodes_watermarked = session.execute_read(get_visible_watermark_ids)
+    rng = np.random.default_rng(seed)
+    nodes_before = backend.all_ids_count()
+    nodes_watermarked = len(verify.watermarked)
     iteration = 0
-    all_ids = session.execute_read(db.get_all_ids)
+    all_ids = NodeCatalog(backend.get_all_ids())
     while True:
-        if not verify(session):
+        if not verify(backend) or len(all_ids) == 0:
             break
         try:
-            ids_to_delete = []
-            for s in range(step):
-                id_to_delete = choice(range(len(all_ids)))
-                ids_to_delete.append(all_ids.pop(id_to_delete))
-            result = session.execute_write(db.delete_documents, ids=ids_to_delete)
+            ids_to_delete = all_ids.pop_random(step, rng).tolist()
+            result = backend.delete_documents(ids=ids_to_delete)
+            verify.update(backend, ids_to_delete)
             iteration += 1
             if iteration % 20 == 0:
-                logging.info("Deleted {num}/{total} nodes ({result})".format(num=iteration*step, total=len(all_ids), result=result.single()))
+                logging.info("Deleted {num}/{total} nodes ({result})".format(num=iteration*step, total=len(all_ids), result=result))
         except Exception as err:
             iteration += 1
             logging.error("Error: {err} encountered after modification attack".format(err=err))
-            error = True
             break
-    nodes_after = session.execute_read(db.all_ids_count)
+    nodes_after = backend.all_ids_count()
     attack_summary = {
         "action": "deletion_attack",
         "iteration": iteration,
@@ -43,10 +44,9 @@ def deletion_attack(session, step, verify):
         "nodes_before": nodes_before,
         "nodes_after": nodes_after,
         "nodes_deleted": nodes_before - nodes_after,
-        "num_watermarked_nodes": len(nodes_watermarked[0])
+        "num_watermarked_nodes": nodes_watermarked
     }
-    resultLog.write(json.dumps(attack_summary) + "\n")
-    resultLog.flush()
+    config.get_result_log().write(attack_summary)
     logging.info("The {action} attack concluded with {deleted_nodes} nodes deleted and {nodes_after} remaining".format(
         action=attack_summary["action"],
         deleted_nodes=attack_summary["nodes_deleted"],
@@ -54,127 +54,286 @@ def deletion_attack(session, step, verify):
     ))
     return iteration
 
-def modification_attack(session, step, verify):
+def perturb_value(value, rng: np.random.Generator):
+    """
+    Return a slightly different value of the same type
+
+    :param value: the value to be perturbed
+    :param rng: the random generator used for the perturbation
+    """
+    if isinstance(value, bool):
+        return not value
+    if isinstance(value, int):
+        return value + int(rng.choice([-1, 1])) * int(rng.integers(1, 10))
+    if isinstance(value, float):
+        return value + float(rng.choice([-1, 1])) * max(abs(value), 1.0) * float(rng.uniform(0.01, 0.1))
+    if isinstance(value, str) and len(value) > 0:
+        position = int(rng.integers(len(value)))
+        letters = [letter for letter in "abcdefghijklmnopqrstuvwxyz" if letter != value[position]]
+        return value[:position] + str(rng.choice(letters)) + value[position + 1:]
+    if isinstance(value, list):
+        return value[:-1] if len(value) > 0 else [""]
+    return str(value) + "*"
+
+
+def modification_attack(backend, step, verify, mode: str = "delete", seed: int = None):
     """
-    Perform a modification attack on the database
+    Perform a modification attack on the database. Each batch picks step fields of random nodes,
+    fetches the fields of all picked nodes in one query and modifies them in one grouped write.
 
+    :param backend: the graph backend holding the database
     :param step: the amount of fields that need to be modified
-    :param verify: the function used for verification of the watermark
+    :param verify: the IncrementalVerifier used for verification of the watermark, notified of every deleted or modified document
+    :param mode: "delete" removes the picked fields, "perturb" replaces their values with slightly different ones
+    :param seed: Optional. The seed for the random generator
     """
     logging.debug("Modification attack started with step {step}".format(step=step))
-    nodes_before = session.execute_read(db.all_ids_count)
-    nodes_watermarked = session.execute_read(get_visible_watermark_ids)
+    rng = np.random.default_rng(seed)
+    nodes_before = backend.all_ids_count()
+    nodes_watermarked = len(verify.watermarked)
     iteration = 0
+    batches = 0
     error = False
-    all_ids = np.array(session.execute_read(db.get_all_ids_with_fields))
+    # The nodes with at least one field left, with their number of fields
+    ids_with_fields = np.array(backend.get_all_ids_with_fields(), dtype=np.int64).reshape(-1, 2)
+    all_ids = NodeCatalog(ids_with_fields[:, 0], values=ids_with_fields[:, 1])
+    all_ids.remove(ids_with_fields[ids_with_fields[:, 1] <= 0, 0])
     while True:
-        if not verify(session):
+        if not verify(backend):
             break
         try:
-            all_choices = np.where(all_ids[:, 1] > 0)[0]
-            if len(all_choices) == 0:
+            if len(all_ids) == 0:
                 break
-            ids_to_modify = choices(all_choices, k=step)
-            for id in ids_to_modify:
-                try:
-                    fields = session.execute_read(db.get_fields, id=id.item())
-                    if len(fields) == 0:
-                        continue
-                    field_to_delete = choice(fields)
-                    result = session.execute_write(db.delete_field, id=id.item(), field=field_to_delete)
-                    iteration += 1
-                    all_ids[np.where(all_ids[:,0]==id)[0][0]][1] -= 1
-                except Exception as err:
-                    logging.error("Error: {err} encountered after modification attack(inner loop)".format(err=err))
-            if iteration % 100 == 0:
-                logging.info("Deleted {num} fields".format(num=iteration))
+            # Pick step fields (with replacement of the nodes), a node picked k times loses k distinct fields
+            ids_to_modify, counts = np.unique(all_ids.sample(step, rng, replace=True), return_counts=True)
+            ids_to_modify = ids_to_modify.tolist()
+            if mode == "perturb":
+                documents = dict(backend.get_documents_with_ids(ids=ids_to_modify))
+                fields = {id: list(document.keys()) for id, document in documents.items()}
+            else:
+                fields = backend.get_fields_many(ids=ids_to_modify)
+            modifications = []
+            for id, count in zip(ids_to_modify, counts.tolist()):
+                node_fields = fields.get(id, [])
+                for index in rng.permutation(len(node_fields))[:count].tolist():
+                    modifications.append([id, node_fields[index]])
+            if len(modifications) == 0:
+                continue
+            if mode == "perturb":
+                backend.set_fields(values=[[id, field, perturb_value(documents[id][field], rng)]
+                                           for (id, field) in modifications])
+            else:
+                backend.delete_fields(fields=modifications)
+                all_ids.add_values([id for (id, _) in modifications], -1)
+                # Nodes without fields left can no longer be picked
+                modified = np.unique([id for (id, _) in modifications])
+                all_ids.remove(modified[all_ids.values[all_ids.positions(modified)] <= 0])
+            verify.update(backend, ids_to_modify)
+            iteration += len(modifications)
+            batches += 1
+            if batches % 20 == 0:
+                logging.info("Modified {num} fields".format(num=iteration))
         except Exception as err:
             logging.error("Error: {err} encountered after modification attack".format(err=err))
             error = True
             break
-    nodes_after = session.execute_read(db.all_ids_count)
+    nodes_after = backend.all_ids_count()
     attack_summary = {
         "action": "modification_attack",
         "iteration": iteration,
         "step": step,
+        "mode": mode,
         "nodes_before": nodes_before,
         "nodes_after": nodes_after,
-        "fields_deleted": iteration,
-        "num_watermarked_nodes": len(nodes_watermarked[0]),
+        "num_watermarked_nodes": nodes_watermarked,
         "ended_with_error": error
     }
-    resultLog.write(json.dumps(attack_summary) + "\n")
-    resultLog.flush()
-    logging.info("The {action} attack concluded with {fields_nodes} nodes deleted and {nodes_after} remaining".format(
+    # Delete runs keep the key of the original summaries, perturb runs report their own
+    attack_summary["fields_deleted" if mode == "delete" else "fields_modified"] = iteration
+    config.get_result_log().write(attack_summary)
+    logging.info("The {action} attack concluded with {fields_nodes} fields modified and {nodes_after} nodes remaining".format(
         action=attack_summary["action"],
-        fields_nodes=attack_summary["fields_deleted"],
+        fields_nodes=iteration,
         nodes_after=attack_summary["nodes_after"]
     ))
     return iteration
 
 
-def insertion_attack(session, step, connections_min=0, connections_max=20):
+def insertion_attack(backend, step, verify, max_documents: int = None, connections_min: int = 0, connections_max: int = 20, document_type: str = "Company", fields: List[str] = None, optional_fields: List[str] = [], check_interval: int = 1, seed: int = None):
     """
-    Perform an insertion attack
+    Perform an insertion attack: fake documents are inserted, connected to random nodes the way pseudo documents
+    are (see watermark.RELATIONS), in batches of step documents, one transaction per batch. The documents are created
+    in bulk from the cached field domains and the connections are sampled from a catalog of the ids, which grows
+    with the inserted documents. The watermark is checked every check_interval batches, the attack stops once it
+    is no longer detected or max_documents were inserted.
+    At every check, the curve records [inserted documents, the fraction of the candidate documents (the documents
+    of the type and the pseudo documents) which are detected pseudo documents, the fraction of the inserted
+    documents which carry the watermark by chance].
 
-    :param step: the amount of documents, which should be added
+    :param backend: the graph backend holding the database
+    :param step: the amount of documents inserted per batch
+    :param verify: the IncrementalVerifier used for verification of the watermark
+    :param max_documents: Optional. The number of documents to insert at most, as many as there are nodes by default
     :param connections_min: the minimum amount of connections per document
     :param connections_max: the maximum amount of connections per document
+    :param document_type: the type of the inserted documents
+    :param fields: Optional. The fields of the inserted documents, the watermark fields and the cover field of the verifier by default
+    :param optional_fields: the fields, which the inserted documents might have
+    :param check_interval: the number of batches between two checks of the watermark
+    :param seed: Optional. The seed for the random generator
     """
-    node_type = "Company"
-    fields = []
-    opt_fields = []
-
-    for s in step:
-        all_ids = session.execute_read(db.get_all_ids)
-        doc = session.execute_read(ps.create_pseudo_document,
-            type=node_type,
-            fields=fields,
-            optional_fields=opt_fields
-        )
-        doc_id = session.execute_write(db.create_node,
-            document=doc,
-            node_type=node_type
-        )
-        connections = list(set(choices(all_ids, k=randint(connections_min, connections_max))))
-        for connection in connections:
-            # skip if connection is to itself
-            if connection == doc_id:
-                continue
-            # Create a connection 
-            session.execute_write(db.create_relation, source_id=doc_id, dest_id=connection, type="Connection")
+    logging.debug("Insertion attack started with step {step}".format(step=step))
+    start_time = time.time()
+    rng = np.random.default_rng(seed)
+    all_ids = NodeCatalog.from_backend(backend)
+    nodes_before = len(all_ids)
+    if max_documents is None:
+        max_documents = nodes_before
+    if fields is None:
+        # The inserted documents look like the pseudo documents
+        fields = list(dict.fromkeys(verify.fields + [verify.cover_field]))
+    # The pseudo documents without the label of the type (visible ones) are candidates as well
+    positions = all_ids.positions(list(verify.watermarked))
+    candidates = all_ids.count(document_type) + sum(
+        1 for label in all_ids.labels(positions[positions >= 0]) if label != document_type)
+    inserted = 0
+    false_matches = 0
+    relations = 0
+    batches = 0
+    error = False
+    verified = verify(backend)
+    curve = [[0, len(verify.verified) / max(candidates, 1), 0.0]]
+    while verified and inserted < max_documents and len(all_ids) > 0:
+        try:
+            n = min(step, max_documents - inserted)
+            documents = ps.create_pseudo_documents(backend, n=n, type=document_type, fields=fields,
+                                                   optional_fields=optional_fields, rng=rng)
+            # Connections of all documents at once, a node picked twice by a document is connected once
+            counts = rng.integers(connections_min, connections_max + 1, size=n)
+            positions = all_ids.positions(all_ids.sample(int(counts.sum()), rng, replace=True))
+            dest_ids = all_ids.ids[positions].tolist()
+            labels = all_ids.labels(positions)
+            connections = []
+            offset = 0
+            for count in counts.tolist():
+                document_connections = {}
+                for dest_id, label in zip(dest_ids[offset:offset + count], labels[offset:offset + count]):
+                    relation = RELATIONS.get(label, {"type": "Connection", "dir": "out"})
+                    document_connections[dest_id] = (dest_id, relation["type"], relation["dir"] == "in")
+                connections.append(list(document_connections.values()))
+                offset += count
+            new_ids = backend.add_documents(documents=documents, connections=connections, document_type=document_type)
+            all_ids.add(new_ids, document_type)
+            false_matches += int(detect_many(documents, key=verify.key, identity=verify.identity,
+                                             field=verify.cover_field, fields=verify.fields,
+                                             scheme=verify.scheme).sum())
+            inserted += n
+            candidates += n
+            relations += sum(len(document_connections) for document_connections in connections)
+            batches += 1
+            if batches % check_interval == 0 or inserted >= max_documents:
+                verified = verify(backend)
+                curve.append([inserted, len(verify.verified) / candidates, false_matches / inserted])
+            if batches % 20 == 0:
+                logging.info("Inserted {num}/{total} documents".format(num=inserted, total=max_documents))
+        except Exception as err:
+            logging.error("Error: {err} encountered during insertion attack".format(err=err))
+            error = True
+            break
+    nodes_after = backend.all_ids_count()
+    attack_summary = {
+        "action": "insertion_attack",
+        "timestamp": time.time(),
+        "duration": time.time() - start_time,
+        "iteration": batches,
+        "step": step,
+        "nodes_before": nodes_before,
+        "nodes_after": nodes_after,
+        "documents_inserted": inserted,
+        "false_matches": false_matches,
+        "relations_inserted": relations,
+        "num_watermarked_nodes": len(verify.watermarked),
+        "check_interval": check_interval,
+        "verification": curve,
+        "verified": verified,
+        "ended_with_error": error
+    }
+    config.get_result_log().write(attack_summary)
+    logging.info("The {action} attack concluded with {inserted} documents inserted, watermark verified: {verified}".format(
+        action=attack_summary["action"],
+        inserted=inserted,
+        verified=verified
+    ))
+    return inserted
 
-def intersection(lst1, lst2):
-    lst3 = [value for value in lst1 if value in lst2]
-    return lst3
 
-# percentages = [0.1, 0.3, 0.5, 0.6, 0.75, 0.8, 0.9, 0.95, 0.98]
-# iterations = 5
-def deletion_attack_short(session, percentages, iterations):
+# Quantiles of the surviving pseudo documents reported by the deletion simulation
+SIMULATION_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+def simulate_deletion(watermarked_mask: np.ndarray, percentages, trials: int, rng: np.random.Generator = None, method: str = "hypergeometric"):
     """
-    Perform a fast deletion attack on the database (without deleting anything from the database)
+    Simulate random deletion attacks and return, for each percentage, the number of surviving pseudo documents per trial
 
+    :param watermarked_mask: boolean array over all nodes, True for the pseudo documents
     :param percentages: the percentages of nodes to be deleted
+    :param trials: the number of deletion trials per percentage
+    :param rng: Optional. The random generator used for sampling
+    :param method: "hypergeometric" draws the number of deleted pseudo documents of each trial directly, which is
+        the exact distribution of deleting nodes without replacement. "sample" deletes actual node indices per trial,
+        which is slower but can be used to cross-check.
     """
-    logging.debug("Short deletion attack started")
-    nodes_all_ids = session.execute_read(db.get_all_ids)
-    nodes_watermarked = session.execute_read(get_visible_watermark_ids)
-    percentage_nodes = [len(nodes_all_ids)*p for p in percentages]
-    results = {}
-    for s in range(iterations):
-        for index, deletions in enumerate(percentage_nodes):
-            deleted_nodes = choices(nodes_all_ids, k=deletions)
-            nodes_deleted = intersection(deleted_nodes, nodes_watermarked[0])
-            percentage_str = str(percentages[index])
-            results[percentage_str] = len(nodes_deleted)
-
-        attack_summary = {
-               "action": "deletion_attack_fast",
-               "results": results,
-                "nodes_before": len(nodes_all_ids),
-                "num_watermarked_nodes": len(nodes_watermarked[0])
-            }
-        resultLog.write(json.dumps(attack_summary) + "\n")
-        resultLog.flush()
-    logging.info("Short deletion attack ended")
-    return results
+    if rng is None:
+        rng = np.random.default_rng()
+    node_count = len(watermarked_mask)
+    watermarked_count = int(np.count_nonzero(watermarked_mask))
+    deletions = np.rint(np.asarray(percentages) * node_count).astype(np.int64)
+    survivors = np.empty((len(deletions), trials), dtype=np.int64)
+    for index, deleted in enumerate(deletions):
+        if method == "hypergeometric":
+            deleted_watermarked = rng.hypergeometric(watermarked_count, node_count - watermarked_count, deleted, size=trials)
+        elif method == "sample":
+            deleted_watermarked = np.fromiter((np.count_nonzero(watermarked_mask[rng.choice(node_count, deleted, replace=False)])
+                                               for _ in range(trials)), dtype=np.int64, count=trials)
+        else:
+            raise ValueError("Unknown simulation method {method}".format(method=method))
+        survivors[index] = watermarked_count - deleted_watermarked
+    return survivors
+
+
+def deletion_simulation(backend, percentages, trials: int = 1000, seed: int = None, method: str = "hypergeometric", watermarked_ids: List[int] = None):
+    """
+    Perform a simulated deletion attack on the database (without deleting anything from the database)
+
+    :param backend: the graph backend holding the database
+    :param percentages: the percentages of nodes to be deleted
+    :param trials: the number of deletion trials per percentage
+    :param seed: Optional. The seed for the random generator
+    :param method: the sampling method, see simulate_deletion
+    :param watermarked_ids: Optional. The ids of the pseudo documents, by default the visible pseudo documents
+    """
+    logging.debug("Deletion simulation started")
+    all_ids = NodeCatalog(backend.get_all_ids())
+    if watermarked_ids is None:
+        watermarked_ids = get_visible_watermark_ids(backend)[0]
+    all_ids.mark(watermarked_ids)
+    watermarked_mask = all_ids.marked_mask()
+    survivors = simulate_deletion(watermarked_mask, percentages, trials,
+                                  rng=np.random.default_rng(seed), method=method)
+    quantiles = np.quantile(survivors, SIMULATION_QUANTILES, axis=1)
+    attack_summary = {
+        "action": "deletion_simulation",
+        "timestamp": time.time(),
+        "method": method,
+        "trials": trials,
+        "nodes_before": len(all_ids),
+        "num_watermarked_nodes": int(np.count_nonzero(watermarked_mask)),
+        "percentages": list(percentages),
+        "survivors_mean": survivors.mean(axis=1).tolist(),
+        "survivors_std": survivors.std(axis=1).tolist(),
+        "survivors_quantiles": {str(q): values.tolist() for q, values in zip(SIMULATION_QUANTILES, quantiles)},
+        "survival_probability": (survivors > 0).mean(axis=1).tolist()
+    }
+    config.get_result_log().write(attack_summary)
+    logging.info("Deletion simulation ended, survival probabilities: {probabilities}".format(
+        probabilities=attack_summary["survival_probability"]))
+    return attack_summary
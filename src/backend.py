@@ -0,0 +1,452 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, List, Tuple
+import database as db
+import instrumentation
+
+
+class GraphBackend(ABC):
+    """
+    The graph operations used by the watermarking, verification and attacks.
+    Every implementation returns plain python values, so the same code runs against any of them.
+    Implementations must provide every abstract method, otherwise they cannot be created.
+    """
+
+    @abstractmethod
+    def create_node(self, document: dict, node_type: str, visible: bool = False) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_relation(self, source_id: int, dest_id: int, edge_type: str, visible: bool = False, reversed: bool = False) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_documents(self, documents: List[dict], connections: List[List[Tuple[int, str, bool]]], document_type: str, visible: bool = False) -> List[int]:
+        raise NotImplementedError
+
+    @contextmanager
+    def pool(self, workers: int):
+        """
+        Open backends on separate connections, so writes can run concurrently (one thread per backend).
+        Backends which cannot be written concurrently only provide themselves.
+
+        :param int workers: the number of backends wanted
+        """
+        yield [self]
+
+    @abstractmethod
+    def all_ids_count(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_all_ids(self) -> List[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_all_ids_with_fields(self) -> List[List[int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_ids_with_labels(self, label: str = None, exclude_label: str = None) -> List[List[Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_label_ids(self, label: str) -> List[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_documents(self, ids: List[int]) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_documents_with_ids(self, ids: List[int]) -> List[List[Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_id_range(self, label: str) -> List[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_field_values_in_range(self, label: str, fields: List[str], start: int, end: int) -> List[List[Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_fields(self, id: int) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_fields_many(self, ids: List[int]) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_field(self, id: int, field: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_fields(self, fields: List[List[Any]]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_fields(self, values: List[List[Any]]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_documents(self, ids: List[int]) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_everything(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_documents_detach(self, ids: List[int]) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_label(self, label: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def import_graph(self, nodes: List[List[Any]], relations: List[List[Any]], batch_size: int = 10000) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_distinct_values(self, label: str, field: str) -> List[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_all_nodes(self) -> List[List[Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_all_relations(self) -> List[List[Any]]:
+        raise NotImplementedError
+
+
+class Neo4jBackend(GraphBackend):
+    """
+    Backend running every operation as a managed transaction on a Neo4j session
+
+    :param session: the session for connection to the database
+    :param int batch_size: the number of nodes or relations per transaction for bulk deletes and imports
+    :param driver: Optional. The driver of the session, needed to open a pool of sessions
+    :param str database: Optional. The name of the database of the session
+    """
+
+    def __init__(self, session, batch_size: int = 10000, driver=None, database: str = None):
+        self.session = instrumentation.instrument(session)
+        self.batch_size = batch_size
+        self.driver = driver
+        self.database = database
+
+    @contextmanager
+    def pool(self, workers):
+        if self.driver is None or workers <= 1:
+            yield [self]
+            return
+        sessions = [self.driver.session(database=self.database) for _ in range(workers)]
+        try:
+            yield [Neo4jBackend(session, self.batch_size, self.driver, self.database) for session in sessions]
+        finally:
+            for session in sessions:
+                session.close()
+
+    def create_node(self, document, node_type, visible=False):
+        return self.session.execute_write(db.create_node, document=document, node_type=node_type, visible=visible)
+
+    def create_relation(self, source_id, dest_id, edge_type, visible=False, reversed=False):
+        return self.session.execute_write(db.create_relation, source_id=source_id, dest_id=dest_id,
+                                          edge_type=edge_type, visible=visible, reversed=reversed)
+
+    def add_documents(self, documents, connections, document_type, visible=False):
+        return self.session.execute_write(db.add_documents, documents=documents, connections=connections,
+                                          document_type=document_type, visible=visible, batch_size=self.batch_size)
+
+    def all_ids_count(self):
+        return self.session.execute_read(db.all_ids_count)
+
+    def get_all_ids(self):
+        return self.session.execute_read(db.get_all_ids)
+
+    def get_all_ids_with_fields(self):
+        return self.session.execute_read(db.get_all_ids_with_fields)
+
+    def get_ids_with_labels(self, label=None, exclude_label=None):
+        return self.session.execute_read(db.get_ids_with_labels, label=label, exclude_label=exclude_label)
+
+    def get_label_ids(self, label):
+        return self.session.execute_read(db.get_label_ids, label=label)
+
+    def get_documents(self, ids):
+        return self.session.execute_read(db.get_documents, ids=ids)
+
+    def get_documents_with_ids(self, ids):
+        return self.session.execute_read(db.get_documents_with_ids, ids=ids)
+
+    def get_id_range(self, label):
+        return self.session.execute_read(db.get_id_range, label=label)
+
+    def get_field_values_in_range(self, label, fields, start, end):
+        return self.session.execute_read(db.get_field_values_in_range, label=label, fields=fields, start=start, end=end)
+
+    def get_fields(self, id):
+        return self.session.execute_read(db.get_fields, id=id)
+
+    def get_fields_many(self, ids):
+        return self.session.execute_read(db.get_fields_many, ids=ids)
+
+    def delete_field(self, id, field):
+        self.session.execute_write(db.delete_field, id=id, field=field)
+
+    def delete_fields(self, fields):
+        self.session.execute_write(db.delete_fields, fields=fields, batch_size=self.batch_size)
+
+    def set_fields(self, values):
+        self.session.execute_write(db.set_fields, values=values, batch_size=self.batch_size)
+
+    def delete_documents(self, ids):
+        return self.delete_documents_detach(ids)
+
+    def delete_everything(self):
+        db.delete_chunked(self.session, batch_size=self.batch_size)
+
+    def delete_documents_detach(self, ids):
+        deleted = 0
+        for start in range(0, len(ids), self.batch_size):
+            deleted += self.session.execute_write(db.delete_documents_detach, ids=ids[start:start + self.batch_size])
+        return deleted
+
+    def delete_label(self, label):
+        return db.delete_chunked(self.session, batch_size=self.batch_size, label=label)
+
+    def import_graph(self, nodes, relations, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        # Nodes of the same label and relations of the same type share a query
+        new_ids = {}
+        nodes_by_label = {}
+        for (id, label, properties) in nodes:
+            nodes_by_label.setdefault(label, []).append((id, properties))
+        for label, label_nodes in nodes_by_label.items():
+            for start in range(0, len(label_nodes), batch_size):
+                batch = label_nodes[start:start + batch_size]
+                created = self.session.execute_write(db.create_nodes, documents=[properties for (_, properties) in batch],
+                                                     node_type=label)
+                new_ids.update(zip((id for (id, _) in batch), created))
+        relations_by_type = {}
+        for (source_id, dest_id, edge_type, properties) in relations:
+            if source_id in new_ids and dest_id in new_ids:
+                relations_by_type.setdefault(edge_type, []).append([new_ids[source_id], new_ids[dest_id], properties])
+        for edge_type, type_relations in relations_by_type.items():
+            for start in range(0, len(type_relations), batch_size):
+                self.session.execute_write(db.import_relations, relations=type_relations[start:start + batch_size],
+                                           edge_type=edge_type)
+        return new_ids
+
+    def get_distinct_values(self, label, field):
+        return self.session.execute_read(db.get_distinct_values, label=label, field=field)
+
+    def get_all_nodes(self):
+        return self.session.execute_read(db.get_all_nodes)
+
+    def get_all_relations(self):
+        return self.session.execute_read(db.get_all_relations)
+
+
+class MemoryBackend(GraphBackend):
+    """
+    In-process graph store. Nodes are property dicts indexed by id, with a per-label index
+    and per-node sets of incoming and outgoing relation ids as adjacency.
+    Node and relation ids are assigned incrementally, like Neo4j does on an empty database.
+    """
+
+    def __init__(self):
+        self.properties = {}
+        self.labels = {}
+        self.label_index = {}
+        self.relations = {}
+        self.outgoing = {}
+        self.incoming = {}
+        self.next_node_id = 0
+        self.next_relation_id = 0
+
+    @classmethod
+    def from_backend(cls, backend: GraphBackend):
+        """
+        Create an in-memory copy of the graph stored in another backend
+
+        :param GraphBackend backend: the backend to copy the nodes and relations from
+        """
+        graph = cls()
+        graph.load(backend.get_all_nodes(), backend.get_all_relations())
+        return graph
+
+    def load(self, nodes: List[List[Any]], relations: List[List[Any]]):
+        """
+        Insert nodes and relations while keeping their ids
+
+        :param nodes: the [id, label, properties] of each node
+        :param relations: the [source id, destination id, type, properties] of each relation
+        """
+        for (id, label, properties) in nodes:
+            self._insert_node(id, label, dict(properties))
+        for (source_id, dest_id, edge_type, properties) in relations:
+            self._insert_relation(source_id, dest_id, edge_type, dict(properties))
+
+    def copy(self):
+        """
+        Return an independent copy of the graph, e.g. to restore it between experiments
+        """
+        graph = MemoryBackend()
+        graph.properties = {id: dict(properties) for id, properties in self.properties.items()}
+        graph.labels = dict(self.labels)
+        graph.label_index = {label: dict(ids) for label, ids in self.label_index.items()}
+        graph.relations = {id: [source_id, dest_id, edge_type, dict(properties)]
+                           for id, (source_id, dest_id, edge_type, properties) in self.relations.items()}
+        graph.outgoing = {id: set(relations) for id, relations in self.outgoing.items()}
+        graph.incoming = {id: set(relations) for id, relations in self.incoming.items()}
+        graph.next_node_id = self.next_node_id
+        graph.next_relation_id = self.next_relation_id
+        return graph
+
+    def _insert_node(self, id, label, properties):
+        self.properties[id] = properties
+        self.labels[id] = label
+        # dicts are used as insertion ordered sets
+        self.label_index.setdefault(label, {})[id] = None
+        self.outgoing[id] = set()
+        self.incoming[id] = set()
+        self.next_node_id = max(self.next_node_id, id + 1)
+        return id
+
+    def _insert_relation(self, source_id, dest_id, edge_type, properties):
+        if source_id not in self.properties or dest_id not in self.properties:
+            return None
+        id = self.next_relation_id
+        self.relations[id] = [source_id, dest_id, edge_type, properties]
+        self.outgoing[source_id].add(id)
+        self.incoming[dest_id].add(id)
+        self.next_relation_id += 1
+        return id
+
+    def _remove_node(self, id):
+        for relation in self.outgoing[id] | self.incoming[id]:
+            source_id, dest_id, _, _ = self.relations.pop(relation)
+            self.outgoing[source_id].discard(relation)
+            self.incoming[dest_id].discard(relation)
+        del self.label_index[self.labels.pop(id)][id]
+        del self.properties[id]
+        del self.outgoing[id]
+        del self.incoming[id]
+
+    def create_node(self, document, node_type, visible=False):
+        if visible:
+            node_type += "W"
+        return self._insert_node(self.next_node_id, node_type, dict(document))
+
+    def create_relation(self, source_id, dest_id, edge_type, visible=False, reversed=False):
+        if visible:
+            edge_type += "W"
+        if reversed:
+            source_id, dest_id = dest_id, source_id
+        return self._insert_relation(source_id, dest_id, edge_type, {})
+
+    def add_documents(self, documents, connections, document_type, visible=False):
+        source_ids = []
+        for document, document_connections in zip(documents, connections):
+            source_id = self.create_node(document, document_type, visible=visible)
+            for (dest_id, edge_type, reversed) in document_connections:
+                self.create_relation(source_id, dest_id, edge_type, visible=visible, reversed=reversed)
+            source_ids.append(source_id)
+        return source_ids
+
+    def all_ids_count(self):
+        return len(self.properties)
+
+    def get_all_ids(self):
+        return list(self.properties.keys())
+
+    def get_all_ids_with_fields(self):
+        return [[id, len(properties)] for id, properties in self.properties.items()]
+
+    def get_ids_with_labels(self, label=None, exclude_label=None):
+        ids = self.label_index.get(label, {}) if label is not None else self.labels
+        return [[id, self.labels[id]] for id in ids if self.labels[id] != exclude_label]
+
+    def get_label_ids(self, label):
+        return list(self.label_index.get(label, {}).keys())
+
+    def get_documents(self, ids):
+        return [dict(self.properties[id]) for id in ids if id in self.properties]
+
+    def get_documents_with_ids(self, ids):
+        return [[id, dict(self.properties[id])] for id in ids if id in self.properties]
+
+    def get_id_range(self, label):
+        ids = self.label_index.get(label, {})
+        return [min(ids), max(ids)] if ids else None
+
+    def get_field_values_in_range(self, label, fields, start, end):
+        return [[id, [self.properties[id].get(field) for field in fields]]
+                for id in self.label_index.get(label, {}) if start <= id < end]
+
+    def get_fields(self, id):
+        return list(self.properties[id].keys())
+
+    def get_fields_many(self, ids):
+        return {id: list(self.properties[id].keys()) for id in ids if id in self.properties}
+
+    def delete_field(self, id, field):
+        if id in self.properties:
+            self.properties[id].pop(field, None)
+
+    def delete_fields(self, fields):
+        for (id, field) in fields:
+            self.delete_field(id, field)
+
+    def set_fields(self, values):
+        for (id, field, value) in values:
+            if id in self.properties:
+                self.properties[id][field] = value
+
+    def delete_documents(self, ids):
+        return self.delete_documents_detach(ids)
+
+    def delete_everything(self):
+        self.__init__()
+
+    def delete_documents_detach(self, ids):
+        deleted = 0
+        for id in set(ids):
+            if id in self.properties:
+                self._remove_node(id)
+                deleted += 1
+        return deleted
+
+    def delete_label(self, label):
+        return self.delete_documents_detach(list(self.label_index.get(label, {}).keys()))
+
+    def import_graph(self, nodes, relations, batch_size=None):
+        # Ids are kept, unless they are already taken
+        new_ids = {}
+        for (id, label, properties) in nodes:
+            new_id = id if id not in self.properties else self.next_node_id
+            new_ids[id] = self._insert_node(new_id, label, dict(properties))
+        for (source_id, dest_id, edge_type, properties) in relations:
+            if source_id in new_ids and dest_id in new_ids:
+                self._insert_relation(new_ids[source_id], new_ids[dest_id], edge_type, dict(properties))
+        return new_ids
+
+    def get_distinct_values(self, label, field):
+        values = {}
+        for id in self.label_index.get(label, {}):
+            value = self.properties[id].get(field)
+            if value is not None:
+                values[value] = None
+        return list(values.keys())
+
+    def get_all_nodes(self):
+        return [[id, self.labels[id], dict(properties)] for id, properties in self.properties.items()]
+
+    def get_all_relations(self):
+        return [[source_id, dest_id, edge_type, dict(properties)]
+                for (source_id, dest_id, edge_type, properties) in self.relations.values()]
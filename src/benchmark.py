@@ -0,0 +1,298 @@
+from typing import List
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+from backend import MemoryBackend
+from verification import IncrementalVerifier
+import attack
+import config
+import fake
+import partition
+import pseudo as ps
+import watermark as wk
+
+# The sizes (number of nodes or documents) every benchmark runs at, up to its own maximum
+SIZES = [10**3, 10**4, 10**5, 10**6, 10**7]
+# The watermark parameters of the benchmarks, those of the UK companies watermark
+KEY = 1
+IDENTITY = "benchmark"
+FIELDS = ["countryOfOrigin", "name", "status"]
+OPTIONAL_FIELDS = ["mortgagesOutstanding", "SIC", "category"]
+COVER_FIELD = "companyNumber"
+MIN_GROUP_SIZE = 10
+MAX_GROUP_SIZE = 100
+# A run is a regression if it is slower than the baseline by more than this fraction
+TOLERANCE = 0.25
+
+# Synthetic graphs (and their watermarked versions) by size, generated once per process
+_graphs = {}
+_watermarked = {}
+
+
+def get_graph(size: int, seed: int = 0) -> MemoryBackend:
+    """
+    A synthetic UK companies graph of about size nodes (see fake.generate_uk_companies), generated once
+
+    :param int size: the number of nodes
+    :param int seed: the seed of the generator
+    """
+    if (size, seed) not in _graphs:
+        # Every company comes with one person and half a property on average
+        _graphs[(size, seed)] = MemoryBackend()
+        fake.generate_uk_companies(_graphs[(size, seed)], max(size * 2 // 5, MAX_GROUP_SIZE), seed=seed)
+    return _graphs[(size, seed)]
+
+
+def get_watermarked_graph(size: int, seed: int = 0):
+    """
+    The graph of get_graph with a visible watermark, returns the graph and the ids of the pseudo documents
+
+    :param int size: the number of nodes
+    :param int seed: the seed of the generator
+    """
+    if (size, seed) not in _watermarked:
+        graph = get_graph(size, seed).copy()
+        ps.domain_cache.invalidate()
+        ids = wk.watermark_database(graph, graph.get_ids_with_labels(label="Company"), MIN_GROUP_SIZE, MAX_GROUP_SIZE,
+                                    "Company", COVER_FIELD, FIELDS, KEY,
+                                    watermarked_document_optional_fields=OPTIONAL_FIELDS,
+                                    watermark_identity=IDENTITY, watermark_visibility=True,
+                                    watermark_batch_size=10000)
+        _watermarked[(size, seed)] = (graph, ids)
+    return _watermarked[(size, seed)]
+
+
+def _copy(state):
+    graph, ids = state
+    return graph.copy(), ids
+
+
+def _documents(size: int, seed: int) -> list:
+    documents = fake.company_documents(0, size, np.random.default_rng(seed))
+    wk.embed_many(documents, key=KEY, identity=IDENTITY, field=COVER_FIELD, fields=FIELDS)
+    return documents
+
+
+def _verifier(graph, ids) -> IncrementalVerifier:
+    return IncrementalVerifier(graph, ids, key=KEY, identity=IDENTITY, fields=FIELDS, cover_field=COVER_FIELD)
+
+
+def _embed_watermark(documents):
+    for document in documents:
+        wk.embed_watermark(document, key=KEY, identity=IDENTITY, field=COVER_FIELD, fields=FIELDS)
+    return len(documents)
+
+
+def _detect_watermark(documents):
+    for document in documents:
+        wk.detect_watermark(document, key=KEY, identity=IDENTITY, field=COVER_FIELD, fields=FIELDS)
+    return len(documents)
+
+
+def _embed_many(documents):
+    wk.embed_many(documents, key=KEY, identity=IDENTITY, field=COVER_FIELD, fields=FIELDS)
+    return len(documents)
+
+
+def _detect_many(documents):
+    wk.detect_many(documents, key=KEY, identity=IDENTITY, field=COVER_FIELD, fields=FIELDS)
+    return len(documents)
+
+
+def _partition(size):
+    partition.partition_indices(size, MIN_GROUP_SIZE, MAX_GROUP_SIZE, np.random.default_rng(0))
+    return size
+
+
+def _pseudo_documents(state):
+    graph, size = state
+    # Domains are loaded once, as during a watermark
+    ps.create_pseudo_documents(graph, n=size, type="Company", fields=FIELDS, optional_fields=OPTIONAL_FIELDS,
+                               cache=ps.DomainCache(), rng=np.random.default_rng(0))
+    return size
+
+
+def _watermark_graph(graph: MemoryBackend) -> MemoryBackend:
+    # The cached value domains belong to the graph of the previous run
+    ps.domain_cache.invalidate()
+    return graph.copy()
+
+
+def _watermark_database(graph):
+    wk.watermark_database(graph, graph.get_ids_with_labels(label="Company"), MIN_GROUP_SIZE, MAX_GROUP_SIZE,
+                          "Company", COVER_FIELD, FIELDS, KEY,
+                          watermarked_document_optional_fields=OPTIONAL_FIELDS,
+                          watermark_identity=IDENTITY, watermark_visibility=True,
+                          watermark_batch_size=10000)
+    return graph.all_ids_count()
+
+
+def _verification(state):
+    graph, ids = state
+    _verifier(graph, ids)()
+    return len(ids)
+
+
+def _deletion_attack(state):
+    graph, ids = state
+    nodes = graph.all_ids_count()
+    attack.deletion_attack(graph, max(150, nodes // 200), _verifier(graph, ids))
+    return nodes - graph.all_ids_count()
+
+
+def _modification_attack(state):
+    graph, ids = state
+    # Returns the number of modified fields
+    return attack.modification_attack(graph, max(150, graph.all_ids_count() // 200), _verifier(graph, ids), seed=0)
+
+
+def _deletion_simulation(state):
+    graph, ids = state
+    attack.deletion_simulation(graph, [0.1, 0.3, 0.5, 0.6, 0.75, 0.8, 0.9, 0.95, 0.98], trials=1000, seed=0)
+    return graph.all_ids_count()
+
+
+def _insertion_attack(state):
+    graph, ids = state
+    # Returns the number of inserted documents
+    step = max(150, graph.all_ids_count() // 200)
+    return attack.insertion_attack(graph, step, _verifier(graph, ids), max_documents=step * 20,
+                                   optional_fields=OPTIONAL_FIELDS, check_interval=5, seed=0)
+
+
+# name: (setup(size, seed) -> state, fresh(state) -> state or None, run(state) -> number of items processed, largest size)
+# The setup runs once per size. The runs of destructive benchmarks receive a fresh copy of its state.
+# Benchmarks on documents (one dict per document) stop at 10^6, 10^7 documents do not fit in memory.
+BENCHMARKS = {
+    "embed_watermark": (_documents, None, _embed_watermark, 10**6),
+    "detect_watermark": (_documents, None, _detect_watermark, 10**6),
+    "embed_many": (_documents, None, _embed_many, 10**6),
+    "detect_many": (_documents, None, _detect_many, 10**6),
+    "partition": (lambda size, seed: size, None, _partition, 10**7),
+    "pseudo_documents": (lambda size, seed: (get_graph(10**4, seed), size), None, _pseudo_documents, 10**6),
+    "watermark_database": (get_graph, _watermark_graph, _watermark_database, 10**6),
+    "verification": (get_watermarked_graph, None, _verification, 10**6),
+    "deletion_attack": (get_watermarked_graph, _copy, _deletion_attack, 10**5),
+    "modification_attack": (get_watermarked_graph, _copy, _modification_attack, 10**5),
+    "deletion_simulation": (get_watermarked_graph, None, _deletion_simulation, 10**6),
+    "insertion_attack": (get_watermarked_graph, _copy, _insertion_attack, 10**5)
+}
+
+
+def run_benchmark(name: str, size: int, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Run a benchmark at a size, returns the fastest of the repeated runs. Only the run
+    is timed, not the setup (e.g. generating the graph), which is done once for all runs.
+
+    :param str name: the name of the benchmark, one of BENCHMARKS
+    :param int size: the number of nodes or documents
+    :param int repeat: the number of runs
+    :param int seed: the seed of the generated data
+    """
+    setup, fresh, run, _ = BENCHMARKS[name]
+    prepared = setup(size, seed)
+    durations = []
+    items = 0
+    for _ in range(repeat):
+        state = fresh(prepared) if fresh is not None else prepared
+        start_time = time.perf_counter()
+        items = run(state)
+        durations.append(time.perf_counter() - start_time)
+    seconds = min(durations)
+    return {
+        "seconds": seconds,
+        "items": items,
+        "items_per_second": items / seconds if seconds > 0 else None
+    }
+
+
+def run_suite(names: List[str] = None, sizes: List[int] = SIZES, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Run the benchmarks at every size up to their largest one. The records of the attacks are written
+    into a temporary results log and INFO logging is disabled while benchmarking.
+    Returns the results, keyed by "name@size", together with a description of the machine.
+
+    :param List[str] names: Optional. The benchmarks to run, all by default
+    :param List[int] sizes: the sizes to run the benchmarks at
+    :param int repeat: the number of runs per benchmark and size
+    :param int seed: the seed of the generated data
+    """
+    if names is None:
+        names = list(BENCHMARKS.keys())
+    config.LOG_DIR = tempfile.mkdtemp(prefix="benchmark-")
+    results = {}
+    logging.disable(logging.INFO)
+    try:
+        for name in names:
+            for size in sizes:
+                if size > BENCHMARKS[name][3]:
+                    continue
+                try:
+                    result = run_benchmark(name, size, repeat=repeat, seed=seed)
+                except Exception as err:
+                    result = {"error": "{type}: {err}".format(type=type(err).__name__, err=err)}
+                results["{name}@{size}".format(name=name, size=size)] = result
+                print("{name}@{size}: {result}".format(name=name, size=size, result=json.dumps(result)))
+    finally:
+        logging.disable(logging.NOTSET)
+    return {
+        "timestamp": time.time(),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__
+        },
+        "results": results
+    }
+
+
+def save_results(results: dict, path: str):
+    """
+    Save the results of a suite as JSON (e.g. as the baseline)
+
+    :param dict results: the results, as returned by run_suite
+    :param str path: the path of the JSON file
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(path: str) -> dict:
+    """
+    Load the results of a suite saved by save_results
+
+    :param str path: the path of the JSON file
+    """
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> List[dict]:
+    """
+    Compare the results of a suite with a baseline, returns the regressions: the benchmarks
+    which got slower by more than the tolerance or which failed while the baseline did not
+
+    :param dict results: the results, as returned by run_suite
+    :param dict baseline: the baseline results
+    :param float tolerance: the allowed slowdown, as a fraction of the baseline
+    """
+    regressions = []
+    for key, result in results["results"].items():
+        base = baseline["results"].get(key)
+        if base is None or "error" in base:
+            continue
+        if "error" in result:
+            regressions.append({"benchmark": key, "error": result["error"]})
+        elif result["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append({"benchmark": key, "seconds": result["seconds"], "baseline": base["seconds"],
+                                "slowdown": result["seconds"] / base["seconds"]})
+    return regressions
@@ -0,0 +1,275 @@
+from typing import Any, List
+import numpy as np
+import partition
+
+
+def _id_dtype(max_id: int):
+    return np.int32 if max_id < 2**31 else np.int64
+
+
+class NodeCatalog:
+    """
+    The ids of nodes, with their label and an optional integer value (e.g. the number of fields), kept in
+    NumPy arrays: a few bytes per node instead of a Python int (or an [id, label] list) per node.
+    Nodes are removed by swapping them with the last node, so removal is O(1) per node and the live
+    nodes always fill the start of the arrays. A position index over the ids (one entry per id up to the
+    largest one) finds a node, and a bitmap over the ids marks nodes (e.g. the pseudo documents).
+
+    :param ids: the ids of the nodes
+    :param labels: Optional. The label of every node, or a single label for all of them
+    :param values: Optional. An integer value of every node
+    """
+
+    def __init__(self, ids, labels=None, values=None):
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        max_id = int(ids.max()) if len(ids) > 0 else 0
+        self.label_names = []
+        self._label_codes = {}
+        self._ids = ids.astype(_id_dtype(max_id))
+        if labels is None or isinstance(labels, str):
+            self._labels = np.full(len(ids), self._label_code(labels), dtype=np.uint16)
+        else:
+            self._labels = np.fromiter((self._label_code(label) for label in labels), dtype=np.uint16, count=len(ids))
+        self._values = np.asarray(values, dtype=np.int64).reshape(-1).copy() if values is not None else None
+        self.size = len(ids)
+        self._positions = np.full(max_id + 1, -1, dtype=_id_dtype(len(ids)))
+        self._positions[self._ids] = np.arange(len(ids))
+        self._marked = np.zeros(max_id // 8 + 1, dtype=np.uint8)
+
+    @classmethod
+    def from_pairs(cls, pairs: List[List[Any]]):
+        """
+        Create a catalog from [id, label] pairs (as returned by get_ids_with_labels)
+
+        :param pairs: the [id, label] of every node
+        """
+        return cls([id for (id, _) in pairs], labels=[label for (_, label) in pairs])
+
+    @classmethod
+    def from_backend(cls, backend, label: str = None):
+        """
+        Create a catalog of the nodes of a database, with their labels
+
+        :param backend: the graph backend holding the database
+        :param str label: Optional. Only the nodes with this label
+        """
+        return cls.from_pairs(backend.get_ids_with_labels(label=label))
+
+    def _label_code(self, label: str) -> int:
+        if label not in self._label_codes:
+            self._label_codes[label] = len(self.label_names)
+            self.label_names.append(label)
+        return self._label_codes[label]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, id: int) -> bool:
+        return 0 <= id < len(self._positions) and self._positions[id] >= 0
+
+    @property
+    def ids(self) -> np.ndarray:
+        """
+        The ids of the nodes (a view, changed by removals)
+        """
+        return self._ids[:self.size]
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        The values of the nodes, in the order of ids (a view, changed by removals)
+        """
+        return self._values[:self.size]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The memory used by the arrays of the catalog
+        """
+        arrays = [self._ids, self._labels, self._positions, self._marked]
+        if self._values is not None:
+            arrays.append(self._values)
+        return sum(array.nbytes for array in arrays)
+
+    def positions(self, ids) -> np.ndarray:
+        """
+        The positions of nodes in ids, -1 for ids which are not in the catalog
+
+        :param ids: the ids of the nodes
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        positions = np.full(len(ids), -1, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self._positions))
+        positions[known] = self._positions[ids[known]]
+        return positions
+
+    def labels(self, positions=None) -> List[str]:
+        """
+        The labels of the nodes at the given positions, of all nodes by default
+
+        :param positions: Optional. The positions of the nodes
+        """
+        codes = self._labels[:self.size] if positions is None else self._labels[np.asarray(positions, dtype=np.int64)]
+        return [self.label_names[code] for code in codes.tolist()]
+
+    def count(self, label: str) -> int:
+        """
+        The number of nodes with a label
+
+        :param str label: the label
+        """
+        if label not in self._label_codes:
+            return 0
+        return int(np.count_nonzero(self._labels[:self.size] == self._label_codes[label]))
+
+    def partition(self, label: str):
+        """
+        A new catalog of the nodes with a label (with their values)
+
+        :param str label: the label
+        """
+        selected = self._labels[:self.size] == self._label_codes.get(label, -1)
+        values = self._values[:self.size][selected] if self._values is not None else None
+        return NodeCatalog(self._ids[:self.size][selected], labels=label, values=values)
+
+    def groups(self, min_size: int, max_size: int, rng: np.random.Generator = None) -> List[List[tuple]]:
+        """
+        Divide the nodes into random groups of min_size to max_size nodes (see partition.partition_indices),
+        returns the groups as lists of (id, label) pairs
+
+        :param int min_size: the minimum size of a group (inclusive)
+        :param int max_size: the maximum size of a group (inclusive)
+        :param rng: Optional. The random generator used
+        """
+        order, offsets = partition.partition_indices(self.size, min_size, max_size, rng)
+        pairs = list(zip(self._ids[order].tolist(), self.labels(order)))
+        return [pairs[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+    def add(self, ids, label: str = None, values=None):
+        """
+        Add nodes to the catalog, the arrays grow by doubling
+
+        :param ids: the ids of the new nodes
+        :param str label: Optional. The label of the new nodes
+        :param values: Optional. The values of the new nodes
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if len(ids) == 0:
+            return
+        end = self.size + len(ids)
+        max_id = int(ids.max())
+        if end > len(self._ids) or _id_dtype(max_id) != self._ids.dtype:
+            capacity = max(end, 2 * len(self._ids))
+            self._ids = self._grow(self._ids, capacity, _id_dtype(max(max_id, len(self._positions) - 1)))
+            self._labels = self._grow(self._labels, capacity, self._labels.dtype)
+            if self._values is not None:
+                self._values = self._grow(self._values, capacity, self._values.dtype)
+        if max_id >= len(self._positions):
+            length = max(max_id + 1, 2 * len(self._positions))
+            positions = np.full(length, -1, dtype=_id_dtype(max(length, end)))
+            positions[:len(self._positions)] = self._positions
+            self._positions = positions
+            marked = np.zeros(length // 8 + 1, dtype=np.uint8)
+            marked[:len(self._marked)] = self._marked
+            self._marked = marked
+        elif _id_dtype(end) != self._positions.dtype:
+            self._positions = self._positions.astype(_id_dtype(end))
+        self._ids[self.size:end] = ids
+        self._labels[self.size:end] = self._label_code(label)
+        if self._values is not None:
+            self._values[self.size:end] = values if values is not None else 0
+        self._positions[ids] = np.arange(self.size, end)
+        self.size = end
+
+    def _grow(self, array: np.ndarray, capacity: int, dtype) -> np.ndarray:
+        grown = np.zeros(capacity, dtype=dtype)
+        grown[:self.size] = array[:self.size]
+        return grown
+
+    def remove(self, ids) -> np.ndarray:
+        """
+        Remove nodes, each one is swapped with the last node. Returns the ids which were removed
+        (ids which are not in the catalog are ignored).
+
+        :param ids: the ids of the nodes
+        """
+        positions = self.positions(ids)
+        return self._remove_positions(np.unique(positions[positions >= 0]))
+
+    def _remove_positions(self, positions: np.ndarray) -> np.ndarray:
+        # positions are sorted and distinct. The nodes of the last len(positions) slots, which are not removed
+        # themselves, fill the removed slots before them.
+        removed = self._ids[positions].astype(np.int64)
+        end = self.size - len(positions)
+        holes = positions[positions < end]
+        fillers = np.setdiff1d(np.arange(end, self.size), positions, assume_unique=True)
+        self._ids[holes] = self._ids[fillers]
+        self._labels[holes] = self._labels[fillers]
+        if self._values is not None:
+            self._values[holes] = self._values[fillers]
+        self._positions[removed] = -1
+        self._positions[self._ids[holes]] = holes
+        self.size = end
+        return removed
+
+    def sample(self, k: int, rng: np.random.Generator = None, replace: bool = False) -> np.ndarray:
+        """
+        Random ids of the catalog
+
+        :param int k: the number of ids
+        :param rng: Optional. The random generator used
+        :param bool replace: whether an id can be picked more than once
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        return self._ids[rng.choice(self.size, size=k, replace=replace)].astype(np.int64)
+
+    def pop_random(self, k: int, rng: np.random.Generator = None) -> np.ndarray:
+        """
+        Remove k random nodes (at most all of them) and return their ids
+
+        :param int k: the number of nodes
+        :param rng: Optional. The random generator used
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        positions = np.sort(rng.choice(self.size, size=min(k, self.size), replace=False))
+        return self._remove_positions(positions)
+
+    def add_values(self, ids, delta: int):
+        """
+        Add delta to the values of nodes, once per occurrence of their id
+
+        :param ids: the ids of the nodes
+        :param int delta: the change of the value
+        """
+        positions = self.positions(ids)
+        np.add.at(self._values, positions[positions >= 0], delta)
+
+    def mark(self, ids):
+        """
+        Mark nodes in the bitmap (e.g. the pseudo documents), marks stay after removals
+
+        :param ids: the ids of the nodes
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        ids = ids[(ids >= 0) & (ids < len(self._positions))]
+        np.bitwise_or.at(self._marked, ids >> 3, (1 << (ids & 7)).astype(np.uint8))
+
+    def is_marked(self, ids) -> np.ndarray:
+        """
+        A boolean mask telling which of the ids are marked
+
+        :param ids: the ids of the nodes
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        mask = np.zeros(len(ids), dtype=bool)
+        known = (ids >= 0) & (ids < len(self._positions))
+        mask[known] = (self._marked[ids[known] >> 3] >> (ids[known] & 7)) & 1 == 1
+        return mask
+
+    def marked_mask(self) -> np.ndarray:
+        """
+        A boolean mask over the ids of the catalog, True for the marked nodes
+        """
+        return self.is_marked(self.ids)
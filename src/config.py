@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+
+# The directory of the logs and the results log
+LOG_DIR = "/log/rp"
+# The settings of the experiments
+SETTINGS_PATH = "settings.json"
+# The manifest of the last watermark (the ids of its pseudo documents), written by the watermark command
+MANIFEST_PATH = "watermark_manifest.npz"
+
+_settings = None
+_result_log = None
+_environment_loaded = False
+
+
+def get_settings() -> dict:
+    """
+    The settings, loaded from settings.json the first time they are needed
+    """
+    global _settings
+    if _settings is None:
+        with open(SETTINGS_PATH) as settingsFile:
+            _settings = json.load(settingsFile)
+        logging.debug("Settings loaded: {settings}".format(
+            settings=json.dumps(_settings)))
+    return _settings
+
+
+def get_result_log():
+    """
+    The writer of the results log, created (together with the log directory) the first time it is needed
+    """
+    global _result_log
+    if _result_log is None:
+        import results
+        if not os.path.exists(LOG_DIR):
+            os.makedirs(LOG_DIR)
+        _result_log = results.ResultWriter(os.path.join(LOG_DIR, "results.json"))
+    return _result_log
+
+
+def setup_logging(level: int = logging.INFO):
+    """
+    Log to the console and to basic.log in the log directory
+
+    :param int level: the logging level
+    """
+    if not os.path.exists(LOG_DIR):
+        os.makedirs(LOG_DIR)
+    logging.basicConfig(
+        handlers=[
+            logging.FileHandler(
+                os.path.join(LOG_DIR, "basic.log")),
+            logging.StreamHandler()
+        ],
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        encoding='utf-8',
+        level=level)
+
+
+def _load_environment():
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _environment_loaded = True
+
+
+def get_database_uri() -> str:
+    """
+    The URI of the Neo4j database (DB_URL)
+    """
+    _load_environment()
+    return os.getenv("DB_URL")
+
+
+def get_database_auth() -> tuple:
+    """
+    The credentials of the Neo4j database (DB_USER and DB_PASSWORD)
+    """
+    _load_environment()
+    return (os.getenv("DB_USER"), os.getenv("DB_PASSWORD"))
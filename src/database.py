@@ -1,7 +1,22 @@
-from typing import List
+from typing import Any, List, Tuple
 from random import choice
 
 
+# The number of rows sent with one UNWIND query by the bulk functions. The text of a query only depends
+# on its label, edge type or field, never on the rows, so Neo4j plans it once and reuses the plan.
+BATCH_SIZE = 10000
+
+
+def _name(name: str) -> str:
+    # Labels, edge types and field names can not be parameters, they are quoted into the query instead
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _batches(rows: List[Any], batch_size: int):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
 def add_document(link, document: dict, connections: List[int], document_type: str, reversed_direction: bool = False, randomized_directions: bool = False, visible: bool = False):
     """
     Add a document to the database
@@ -13,19 +28,10 @@ def add_document(link, document: dict, connections: List[int], document_type: st
     :param bool randomized_directions: whether or not the edge directions should be randomized (mutually excludable with reversed_direction)
     :param bool visible: If selected, the letter W will be added on  the back of the type of the watermark document and edges, indicating that it is watermarked.
     """
-
-    # Create the node
-    source_id = create_node(link, document=document,
-                            visible=visible, node_type=document_type)
-    # Create all the edges from the newly created node to the connection nodes
-    for connection in connections:
-        if randomized_directions:
-            result = create_relation(link, source_id, connection, edge_type="Watermark",
-                                     visible=visible, reversed=choice([True, False]))
-        else:
-            result = create_relation(
-                link, source_id, connection, edge_type="Watermark", visible=visible, reversed=reversed_direction)
-    return source_id
+    # The edges go from the newly created node to the connection nodes
+    document_connections = [(connection, "Watermark", choice([True, False]) if randomized_directions else reversed_direction)
+                            for connection in connections]
+    return add_documents(link, [document], [document_connections], document_type, visible=visible)[0]
 
 
 def create_node(link, document: dict, node_type: str, visible: bool = False):
@@ -37,16 +43,7 @@ def create_node(link, document: dict, node_type: str, visible: bool = False):
     :param str node_type: the type of the newly created node
     :param bool visible: If selected, the letter W will be added on  the back of the type of the watermark document, indicating that it is watermarked.
     """
-    # Check if the node should be pseudo
-    if visible:
-        node_type += "W"
-    # Insert the node inside the database
-    fields = ["{name}: $document.{field}".format(
-        name=key, field=key) for key in document.keys()]
-    query = "create (n:" + node_type + \
-        " {" + ', '.join(fields) + "}) return id(n)"
-    result = link.run(query, document=document)
-    return result.single()[0]
+    return create_nodes(link, [document], node_type, visible=visible)[0]
 
 
 def create_relation(link, source_id: int, dest_id: int, edge_type: str, visible: bool = False, reversed: bool = False) -> int:
@@ -59,22 +56,88 @@ def create_relation(link, source_id: int, dest_id: int, edge_type: str, visible:
     :param bool visible: If selected, the letter W will be added on  the back of the type of the watermark edge, indicating that it is watermarked.
     :param bool reversed: whether the relation is reversed or not
     """
-    # If the relation is of a pseudo document, the suffix of W is added
-    if visible:
-        edge_type += "W"
-    # If reverse is True, swap the IDs of source and dest
-    if reversed:
-        temp = source_id
-        source_id = dest_id
-        dest_id = temp
-
-    # Create the relation
-    result = link.run("match (dest), (source) "
-                      "where id(source) = $source_id and id(dest) = $dest_id "
-                      "create (source)-[r:{type}]->(dest) "
-                      "return id(r)".format(type=edge_type),
-                      source_id=source_id, dest_id=dest_id)
-    return result.single()[0]
+    return create_relations(link, [[source_id, dest_id]], edge_type, visible=visible, reversed=reversed)[0]
+
+
+def add_documents(link, documents: List[dict], connections: List[List[Tuple[int, str, bool]]], document_type: str, visible: bool = False, batch_size: int = BATCH_SIZE) -> List[int]:
+    """
+    Add a batch of documents to the database, using one query template per node type and edge type
+
+    :param link: the database session
+    :param List[dict] documents: the documents to be added to the database
+    :param connections: for each document, the (destination id, edge type, reversed) triplets of its edges
+    :param str document_type: the type of the newly created nodes
+    :param bool visible: If selected, the letter W will be added on  the back of the type of the documents and edges, indicating that they are watermarked.
+    :param int batch_size: the number of rows per query
+    """
+    # Create all nodes at once
+    source_ids = create_nodes(link, documents=documents, node_type=document_type,
+                              visible=visible, batch_size=batch_size)
+    # Reversed edges go from the connection node to the new node
+    relations = [[dest_id, source_id, edge_type] if reversed else [source_id, dest_id, edge_type]
+                 for source_id, document_connections in zip(source_ids, connections)
+                 for (dest_id, edge_type, reversed) in document_connections]
+    create_relations(link, relations=relations, visible=visible, batch_size=batch_size)
+    return source_ids
+
+
+def create_nodes(link, documents: List[dict], node_type, visible: bool = False, batch_size: int = BATCH_SIZE) -> List[int]:
+    """
+    Creates multiple nodes inside the database and returns their IDs (in the same order).
+    The nodes are grouped by type, every type is created with one query template in batches.
+
+    :param link the database session
+    :param List[dict] documents: the documents to be addeed to the database
+    :param node_type: the type of the newly created nodes, or a list with the type of every node
+    :param bool visible: If selected, the letter W will be added on  the back of the type of the watermark documents, indicating that they are watermarked.
+    :param int batch_size: the number of nodes per query
+    """
+    if isinstance(node_type, str):
+        node_type = [node_type] * len(documents)
+    rows_by_type = {}
+    for index, (document, type) in enumerate(zip(documents, node_type)):
+        rows_by_type.setdefault(type + "W" if visible else type, []).append([index, document])
+    ids = [None] * len(documents)
+    for type, rows in rows_by_type.items():
+        query = ("unwind $rows as row "
+                 "create (n:{type}) "
+                 "set n = row[1] "
+                 "return row[0], id(n)".format(type=_name(type)))
+        for batch in _batches(rows, batch_size):
+            for (index, id) in link.run(query, rows=batch).values():
+                ids[index] = id
+    return ids
+
+
+def create_relations(link, relations: List[List[Any]], edge_type: str = None, visible: bool = False, reversed: bool = False, batch_size: int = BATCH_SIZE) -> List[int]:
+    """
+    Create multiple relations inside the database and returns their IDs (in the same order).
+    The relations are grouped by type, every type is created with one query template in batches.
+
+    :param relations: the [source id, destination id] pairs of the relations, or [source id, destination id, type] triplets
+    :param str edge_type: the type of the relations given as pairs
+    :param bool visible: If selected, the letter W will be added on  the back of the type of the watermark edges, indicating that they are watermarked.
+    :param bool reversed: whether the relations are reversed or not
+    :param int batch_size: the number of relations per query
+    """
+    rows_by_type = {}
+    for index, relation in enumerate(relations):
+        type = relation[2] if len(relation) > 2 else edge_type
+        # If reverse is True, swap the IDs of source and dest
+        source_id, dest_id = (relation[1], relation[0]) if reversed else (relation[0], relation[1])
+        rows_by_type.setdefault(type + "W" if visible else type, []).append([index, source_id, dest_id])
+    ids = [None] * len(relations)
+    for type, rows in rows_by_type.items():
+        query = ("unwind $rows as row "
+                 "match (source) where id(source) = row[1] "
+                 "match (dest) where id(dest) = row[2] "
+                 "create (source)-[r:{type}]->(dest) "
+                 "return row[0], id(r)".format(type=_name(type)))
+        for batch in _batches(rows, batch_size):
+            for (index, id) in link.run(query, rows=batch).values():
+                ids[index] = id
+    return ids
+
 
 def all_ids_count(link):
     result = link.run("match (n) return count(n)")
@@ -95,6 +158,46 @@ def get_all_ids_with_labels(link):
     return result.value()
 
 
+def get_ids_with_labels(link, label: str = None, exclude_label: str = None):
+    """
+    Retrieve the [id, label] pairs of all nodes with (or without) a given label
+
+    :param str label: Optional. Only return nodes with this label
+    :param str exclude_label: Optional. Only return nodes without this label
+    """
+    if label is not None:
+        query = "match (n:{label}) ".format(label=_name(label))
+    else:
+        query = "match (n) "
+    if exclude_label is not None:
+        query += "where not $exclude_label in labels(n) "
+    result = link.run(query + "return id(n), labels(n)[0]",
+                      exclude_label=exclude_label)
+    return result.values()
+
+
+def get_label_ids(link, label: str):
+    result = link.run("match (n:{label}) "
+                      "return id(n)".format(label=_name(label)))
+    return result.value()
+
+
+def get_distinct_values(link, label: str, field: str):
+    return link.run("match (n:{label}) "
+                    "return collect(distinct n.{field})".format(label=_name(label), field=_name(field))
+                    ).value()[0]
+
+
+def get_all_nodes(link):
+    result = link.run("match (n) return id(n), labels(n)[0], properties(n)")
+    return result.values()
+
+
+def get_all_relations(link):
+    result = link.run("match (m)-[r]->(n) return id(m), id(n), type(r), properties(r)")
+    return result.values()
+
+
 def get_document(link, id):
     return link.run("match (m) "
                     "where id(m) = $id "
@@ -108,6 +211,41 @@ def get_documents(link, ids):
                     "return m", ids=ids
                     ).value()
 
+def get_documents_with_ids(link, ids):
+    return link.run("match (m) "
+                    "where id(m) in $ids "
+                    "return id(m), m", ids=ids
+                    ).values()
+
+def get_id_range(link, label: str):
+    """
+    The smallest and the largest id of the nodes with a label, None if there are none
+
+    :param str label: the label of the nodes
+    """
+    result = link.run("match (n:{label}) "
+                      "return min(id(n)), max(id(n))".format(label=_name(label))).single()
+    return None if result[0] is None else [result[0], result[1]]
+
+
+def get_field_values_in_range(link, label: str, fields: List[str], start: int, end: int):
+    """
+    The [id, [values of the fields]] of the nodes with a label and an id in [start, end),
+    missing fields are None
+
+    :param str label: the label of the nodes
+    :param List[str] fields: the fields to return
+    :param int start: the smallest id
+    :param int end: the id after the largest id
+    """
+    # Every id of the page is looked up on its own (a node by id seek), a range filter on id(n) scans the label
+    return link.run("unwind range($start, $end - 1) as i "
+                    "match (n) where id(n) = i and n:{label} "
+                    "return id(n), [field in $fields | n[field]]".format(label=_name(label)),
+                    fields=fields, start=start, end=end
+                    ).values()
+
+
 def get_fields(link, id):
     return link.run("match (m) "
                     "where id(m) = $id "
@@ -115,6 +253,49 @@ def get_fields(link, id):
                     ).value()[0]
 
 
+def get_fields_many(link, ids):
+    return dict(link.run("match (m) "
+                         "where id(m) in $ids "
+                         "return id(m), keys(m)", ids=ids
+                         ).values())
+
+
+def delete_fields(link, fields: List[List[Any]], batch_size: int = BATCH_SIZE):
+    """
+    Remove fields from documents, using one query template per distinct field name
+
+    :param fields: the [id, field] pairs to be removed
+    :param int batch_size: the number of documents per query
+    """
+    ids_by_field = {}
+    for (id, field) in fields:
+        ids_by_field.setdefault(field, []).append(id)
+    for field, ids in ids_by_field.items():
+        query = ("unwind $ids as id "
+                 "match (m) where id(m) = id "
+                 "remove m.{field}".format(field=_name(field)))
+        for batch in _batches(ids, batch_size):
+            link.run(query, ids=batch)
+
+
+def set_fields(link, values: List[List[Any]], batch_size: int = BATCH_SIZE):
+    """
+    Set fields of documents, using one query template per distinct field name
+
+    :param values: the [id, field, value] triplets to be set
+    :param int batch_size: the number of documents per query
+    """
+    rows_by_field = {}
+    for (id, field, value) in values:
+        rows_by_field.setdefault(field, []).append([id, value])
+    for field, rows in rows_by_field.items():
+        query = ("unwind $rows as row "
+                 "match (m) where id(m) = row[0] "
+                 "set m.{field} = row[1]".format(field=_name(field)))
+        for batch in _batches(rows, batch_size):
+            link.run(query, rows=batch)
+
+
 def dublicate_documents(link, ids):
     return link.run("match (n)"
                     "where id(n) in $ids"
@@ -126,29 +307,81 @@ def dublicate_documents(link, ids):
 
 
 def delete_document(link, id):
-    result = link.run("match (m)-[r]-() "
-                      "where id(m) = $id "
-                      "delete r, m", id=id
-                      )
+    return delete_documents_detach(link, [id])
 
 
 def delete_documents(link, ids):
-    result = link.run("match (m)-[r]-() "
-                      "where id(m) in $ids "
-                      "delete r, m", ids=ids
-                      )
-    return result
+    return delete_documents_detach(link, ids)
 
 def delete_field(link, id, field):
-    result = link.run("match (m) "
-                      "where id(m) = $id "
-                      "remove m.{field} ".format(field=field), id=id
-                      )
-    return result
+    delete_fields(link, [[id, field]])
 
-def delete_everythong(link):
-    link.run("match (m)-[r]-(n) delete r, m, n")
-    link.run("match (m) delete m")
+
+def delete_batch(link, batch_size: int, label: str = None) -> int:
+    """
+    Delete (with their relations) at most batch_size nodes and return how many were deleted
+
+    :param int batch_size: the maximum number of nodes to delete
+    :param str label: Optional. Only delete nodes with this label
+    """
+    query = "match (n:{label}) ".format(label=_name(label)) if label is not None else "match (n) "
+    result = link.run(query +
+                      "with n limit $batch_size "
+                      "detach delete n "
+                      "return count(*)", batch_size=batch_size)
+    return result.single()[0]
+
+
+def delete_chunked(session, batch_size: int = 10000, label: str = None) -> int:
+    """
+    Delete all nodes (or all nodes with a label) in bounded transactions, returns the number of deleted nodes
+
+    :param session: the session for connection to the database
+    :param int batch_size: the number of nodes deleted per transaction
+    :param str label: Optional. Only delete nodes with this label
+    """
+    deleted = 0
+    while True:
+        batch = session.execute_write(delete_batch, batch_size=batch_size, label=label)
+        deleted += batch
+        if batch < batch_size:
+            return deleted
+
+
+def delete_documents_detach(link, ids: List[int], batch_size: int = BATCH_SIZE) -> int:
+    """
+    Delete documents together with their relations, returns the number of deleted documents
+
+    :param List[int] ids: the ids of the documents
+    :param int batch_size: the number of documents per query
+    """
+    deleted = 0
+    for batch in _batches(ids, batch_size):
+        result = link.run("unwind $ids as id "
+                          "match (m) where id(m) = id "
+                          "detach delete m", ids=batch)
+        deleted += result.consume().counters.nodes_deleted
+    return deleted
+
+
+def import_relations(link, relations: List[List[Any]], edge_type: str, batch_size: int = BATCH_SIZE) -> List[int]:
+    """
+    Create relations of the same type, together with their properties, with one query template in batches
+
+    :param relations: the [source id, destination id, properties] of each relation
+    :param str edge_type: the type of the relations
+    :param int batch_size: the number of relations per query
+    """
+    query = ("unwind $relations as relation "
+             "match (source) where id(source) = relation[0] "
+             "match (dest) where id(dest) = relation[1] "
+             "create (source)-[r:{type}]->(dest) "
+             "set r = relation[2] "
+             "return id(r)".format(type=_name(edge_type)))
+    ids = []
+    for batch in _batches(relations, batch_size):
+        ids += link.run(query, relations=batch).value()
+    return ids
 
 def populate_uk_companies(session):
     session.execute_write(uk_companies_contraints)
@@ -156,8 +389,8 @@ def populate_uk_companies(session):
     session.execute_write(uk_companies_index)
 
 def uk_companies_contraints(link):
-    link.run("CREATE CONSTRAINT FOR (c:Company) REQUIRE c.companyNumber IS UNIQUE")
-    link.run("CREATE CONSTRAINT FOR (p:Property) REQUIRE p.titleNumber IS UNIQUE")
+    link.run("CREATE CONSTRAINT IF NOT EXISTS FOR (c:Company) REQUIRE c.companyNumber IS UNIQUE")
+    link.run("CREATE CONSTRAINT IF NOT EXISTS FOR (p:Property) REQUIRE p.titleNumber IS UNIQUE")
 
 def load_uk_companies(link):
     link.run("LOAD CSV WITH HEADERS FROM \"https://guides.neo4j.com/ukcompanies/data/PSCAmericans.csv\" AS row1 MERGE (c:Company {companyNumber: row1.company_number})")
@@ -169,4 +402,61 @@ def load_uk_companies(link):
 
 
 def uk_companies_index(link):
-    link.run("CREATE INDEX CompanyIndex FOR (n:Company) ON (n.incorporationDate)")
\ No newline at end of file
+    link.run("CREATE INDEX CompanyIndex IF NOT EXISTS FOR (n:Company) ON (n.incorporationDate)")
+
+# Batched writes of the UK companies loader (see loader.py), every function merges a batch of rows
+
+def merge_companies(link, rows: List[dict]):
+    link.run("unwind $rows as row "
+             "merge (c:Company {companyNumber: row.companyNumber})",
+             rows=rows)
+
+def merge_persons(link, rows: List[dict]):
+    link.run("unwind $rows as row "
+             "merge (p:Person {name: row.name, birthYear: row.birthYear, birthMonth: row.birthMonth}) "
+             "on create set p.nationality = row.nationality, p.countryOfResidence = row.countryOfResidence",
+             rows=rows)
+
+def merge_control_relations(link, rows: List[dict]):
+    link.run("unwind $rows as row "
+             "match (c:Company {companyNumber: row.companyNumber}) "
+             "match (p:Person {name: row.name, birthYear: row.birthYear, birthMonth: row.birthMonth}) "
+             "merge (p)-[r:HAS_CONTROL]->(c) "
+             "set r.nature = row.nature",
+             rows=rows)
+
+def set_company_data(link, rows: List[dict]):
+    link.run("unwind $rows as row "
+             "match (c:Company {companyNumber: row.companyNumber}) "
+             "set c += row.properties",
+             rows=rows)
+
+def merge_recipients(link, rows: List[dict]):
+    link.run("unwind $rows as row "
+             "match (c:Company {companyNumber: row.companyNumber}) "
+             "merge (p:Recipient {name: row.name}) "
+             "set p.entityType = row.entityType",
+             rows=rows)
+
+def merge_donations(link, rows: List[dict]):
+    link.run("unwind $rows as row "
+             "match (c:Company {companyNumber: row.companyNumber}) "
+             "match (p:Recipient {name: row.name}) "
+             "merge (c)-[r:DONATED {ref: row.ref}]->(p) "
+             "set r.date = row.date, r.value = row.value",
+             rows=rows)
+
+def merge_properties(link, rows: List[dict]):
+    link.run("unwind $rows as row "
+             "match (c:Company {companyNumber: row.companyNumber}) "
+             "merge (p:Property {titleNumber: row.titleNumber}) "
+             "set p += row.properties",
+             rows=rows)
+
+def merge_ownerships(link, rows: List[dict]):
+    link.run("unwind $rows as row "
+             "match (c:Company {companyNumber: row.companyNumber}) "
+             "match (p:Property {titleNumber: row.titleNumber}) "
+             "merge (c)-[r:OWNS]->(p) "
+             "set r.date = coalesce(row.date, r.date)",
+             rows=rows)
@@ -1,18 +1,20 @@
 import names
 from random import randrange, choices
-import database as db
+import logging
+import time
+import numpy as np
 import pseudo as ps
 import watermark as wk
 
 
-def populate_fake_data(session, records: int = 25, relations:int = randrange(10)):
+def populate_fake_data(backend, records: int = 25, relations: int = None):
     """
     Populate the dataset with fake data
-    
+
     :param int records the number of records to be added to the database
-    :param int relations the number of random relations per record
+    :param int relations the number of random relations per record, random (below 10) for every record if not given
     """
-    arr = []
+    docs = []
     for s in range(records):
         # create an array of pseudo documents
         doc = {
@@ -20,23 +22,225 @@ def populate_fake_data(session, records: int = 25, relations:int = randrange(10)
             "Last_Name": names.get_last_name(),
             "Age": randrange(85)
         }
-        arr.append(session.execute_write(db.create_node, document=doc, node_type="Person"))
+        docs.append(doc)
+    arr = backend.add_documents(documents=docs, connections=[[] for _ in docs], document_type="Person")
     for s in arr:
         # generate a random array of nodes, to which the pseudo document will be connected
-        connections = list(set(choices(range(records), k=relations)))
+        connections = list(set(choices(range(records), k=relations if relations is not None else randrange(10))))
         for connection in connections:
             # skip if connection is to itself
             if arr[connection] == s:
                 continue
-            # Create a connection 
-            session.execute_write(db.create_relation, source_id=s, dest_id=arr[connection], type="Friends")
+            # Create a connection
+            backend.create_relation(source_id=s, dest_id=arr[connection], edge_type="Friends")
 
-def watermark_fake_database(session):
+def watermark_fake_database(backend):
     """
     Watermark a database populated with fake information
 
-    :param session the session for connection to the database
+    :param backend the graph backend holding the database
     """
     # Create groups
-    all_ids = session.execute_read(db.get_all_ids)
-    wk.watermark_database(session, all_ids, 3, 12, "Person", "Salary", ["First_Name", "Last_Name", "Age"], 1, watermark_visibility=True)
\ No newline at end of file
+    all_ids = backend.get_all_ids()
+    wk.watermark_database(backend, all_ids, 3, 12, "Person", "Salary", ["First_Name", "Last_Name", "Age"], 1, watermark_visibility=True)
+
+
+# Value pools of the synthetic UK companies graph, roughly matching the cardinalities of the dataset
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+               "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+               "Daniel", "Nancy", "Matthew", "Lisa", "Anthony", "Betty", "Mark", "Margaret", "Donald", "Sandra"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+              "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson"]
+COUNTRIES = ["United Kingdom", "United States", "England", "Delaware", "Wales", "Scotland", "Ireland", "Canada"]
+STATUSES = ["Active", "Active - Proposal to Strike off", "Liquidation", "In Administration", "Live but Receiver Manager on at least one charge"]
+CATEGORIES = ["Private Limited Company", "Public Limited Company", "Limited Partnership", "Overseas Entity", "Private Unlimited Company"]
+NATIONALITIES = ["American", "British", "Canadian", "Irish", "German"]
+ENTITY_TYPES = ["Political Party", "Regulated Donee", "Third Party"]
+# The number of distinct SIC codes, counties and districts
+SIC_CODES = 700
+COUNTIES = 100
+DISTRICTS = 350
+# The degree distributions of the synthetic graph, see sample_degrees
+DEFAULT_DEGREES = {
+    # The companies controlled by a person
+    "controls": {"distribution": "geometric", "mean": 1.3},
+    # The companies controlling a company
+    "company_controls": {"distribution": "poisson", "mean": 0.1},
+    # The properties owned by a company
+    "properties": {"distribution": "poisson", "mean": 0.5},
+    # The recipients a company donated to
+    "donations": {"distribution": "poisson", "mean": 0.05}
+}
+
+
+def sample_degrees(spec: dict, size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Sample node degrees from a distribution: "poisson" and "geometric" (at least 1) take a "mean",
+    "zipf" (at least 1, heavy tailed) takes an exponent "a" and "fixed" a "value".
+    The degrees are clipped to the optional "min" and "max" of the spec.
+
+    :param dict spec: the distribution and its parameters
+    :param int size: the number of degrees
+    :param rng: the random generator
+    """
+    match spec["distribution"]:
+        case "poisson":
+            degrees = rng.poisson(spec["mean"], size=size)
+        case "geometric":
+            degrees = rng.geometric(1 / max(spec["mean"], 1), size=size)
+        case "zipf":
+            degrees = rng.zipf(spec["a"], size=size)
+        case "fixed":
+            degrees = np.full(size, spec["value"])
+        case _:
+            raise ValueError("Unknown degree distribution {distribution}".format(distribution=spec["distribution"]))
+    return np.clip(degrees, spec.get("min", 0), spec.get("max", None))
+
+
+def _zipf_choice(size: int, cardinality: int, rng: np.random.Generator) -> np.ndarray:
+    # Pick values 0 .. cardinality - 1, the first values being the most common ones
+    return (rng.zipf(1.5, size=size) - 1) % cardinality
+
+
+def _documents(columns: dict) -> list:
+    # Turn NumPy columns into documents, leaving out missing (None) values
+    fields = list(columns.keys())
+    values = [column.tolist() if isinstance(column, np.ndarray) else column for column in columns.values()]
+    return [{field: value for field, value in zip(fields, row) if value is not None} for row in zip(*values)]
+
+
+def company_documents(first: int, size: int, rng: np.random.Generator) -> list:
+    """
+    Generate synthetic Company documents
+
+    :param int first: the number of the first company, company numbers are unique
+    :param int size: the number of documents
+    :param rng: the random generator
+    """
+    numbers = np.arange(first, first + size)
+    mortgages = rng.geometric(0.6, size=size) - 1
+    return _documents({
+        "companyNumber": ["{:08d}".format(number) for number in numbers.tolist()],
+        "name": ["{first} {last} {number} LIMITED".format(first=FIRST_NAMES[a], last=LAST_NAMES[b], number=number).upper()
+                 for a, b, number in zip(rng.integers(len(FIRST_NAMES), size=size).tolist(),
+                                         rng.integers(len(LAST_NAMES), size=size).tolist(), numbers.tolist())],
+        "mortgagesOutstanding": np.where(rng.random(size) < 0.7, mortgages, None),
+        "incorporationDate": (np.datetime64("1950-01-01") + rng.integers(0, 26000, size=size)).astype("datetime64[D]"),
+        "SIC": np.char.add("SIC ", _zipf_choice(size, SIC_CODES, rng).astype(str)),
+        "countryOfOrigin": np.array(COUNTRIES, dtype=object)[_zipf_choice(size, len(COUNTRIES), rng)],
+        "status": np.array(STATUSES, dtype=object)[_zipf_choice(size, len(STATUSES), rng)],
+        "category": np.array(CATEGORIES, dtype=object)[_zipf_choice(size, len(CATEGORIES), rng)]
+    })
+
+
+def person_documents(size: int, rng: np.random.Generator) -> list:
+    """
+    Generate synthetic Person documents
+
+    :param int size: the number of documents
+    :param rng: the random generator
+    """
+    return _documents({
+        "name": np.char.add(np.char.add(np.array(FIRST_NAMES)[rng.integers(len(FIRST_NAMES), size=size)], " "),
+                            np.array(LAST_NAMES)[rng.integers(len(LAST_NAMES), size=size)]),
+        "birthYear": rng.integers(1930, 2000, size=size).astype(str),
+        "birthMonth": rng.integers(1, 13, size=size).astype(str),
+        "nationality": np.array(NATIONALITIES, dtype=object)[_zipf_choice(size, len(NATIONALITIES), rng)],
+        "countryOfResidence": np.array(COUNTRIES, dtype=object)[_zipf_choice(size, len(COUNTRIES), rng)]
+    })
+
+
+def property_documents(first: int, size: int, rng: np.random.Generator) -> list:
+    """
+    Generate synthetic Property documents
+
+    :param int first: the number of the first property, title numbers are unique
+    :param int size: the number of documents
+    :param rng: the random generator
+    """
+    return _documents({
+        "titleNumber": ["TN{:09d}".format(number) for number in range(first, first + size)],
+        "address": ["{number} {street} Road".format(number=number, street=LAST_NAMES[street])
+                    for number, street in zip(rng.integers(1, 300, size=size).tolist(),
+                                              rng.integers(len(LAST_NAMES), size=size).tolist())],
+        "county": np.char.add("County ", _zipf_choice(size, COUNTIES, rng).astype(str)),
+        "price": np.where(rng.random(size) < 0.8, rng.lognormal(12.5, 1.0, size=size).astype(np.int64), None),
+        "district": np.char.add("District ", _zipf_choice(size, DISTRICTS, rng).astype(str))
+    })
+
+
+def recipient_documents(size: int, rng: np.random.Generator) -> list:
+    """
+    Generate synthetic Recipient documents
+
+    :param int size: the number of documents
+    :param rng: the random generator
+    """
+    return _documents({
+        "name": ["Recipient {number}".format(number=number) for number in range(size)],
+        "entityType": np.array(ENTITY_TYPES, dtype=object)[_zipf_choice(size, len(ENTITY_TYPES), rng)]
+    })
+
+
+def _pick(ids: np.ndarray, degrees: np.ndarray, rng: np.random.Generator) -> list:
+    # Pick degrees[i] distinct-ish random ids for every document i
+    if len(ids) == 0:
+        return [[] for _ in degrees]
+    picks = ids[rng.integers(len(ids), size=int(degrees.sum()))].tolist()
+    offsets = np.concatenate([[0], np.cumsum(degrees)]).tolist()
+    return [list(set(picks[start:end])) for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def generate_uk_companies(backend, companies: int, seed: int = None, persons_per_company: float = 1.0, recipients: int = 200, degrees: dict = None, chunk_size: int = 10000) -> dict:
+    """
+    Populate the database with a synthetic graph following the schema of the UK companies dataset:
+    Persons controlling Companies, Companies controlling Companies, owning Properties and donating to
+    Recipients (the edges of watermark.RELATIONS). The graph is generated and written in chunks of
+    companies, each chunk with a few bulk inserts per node type. Returns the number of nodes per label.
+
+    :param backend: the graph backend holding the database
+    :param int companies: the number of companies
+    :param int seed: Optional. The seed of the random generator, the same seed generates the same graph
+    :param float persons_per_company: the number of persons per company
+    :param int recipients: the number of donation recipients
+    :param dict degrees: Optional. The degree distributions (see DEFAULT_DEGREES and sample_degrees) overriding the defaults
+    :param int chunk_size: the number of companies generated and written at once
+    """
+    start_time = time.time()
+    rng = np.random.default_rng(seed)
+    degrees = {**DEFAULT_DEGREES, **(degrees or {})}
+    counts = {"Company": 0, "Person": 0, "Property": 0, "Recipient": recipients}
+    recipient_ids = np.array(backend.add_documents(documents=recipient_documents(recipients, rng),
+                                                   connections=[[] for _ in range(recipients)],
+                                                   document_type="Recipient"), dtype=np.int64)
+    company_ids = np.zeros(0, dtype=np.int64)
+    for first in range(0, companies, chunk_size):
+        size = min(chunk_size, companies - first)
+        # Companies donate to recipients and are controlled by companies of the previous chunks
+        donations = _pick(recipient_ids, sample_degrees(degrees["donations"], size, rng), rng)
+        parents = _pick(company_ids, sample_degrees(degrees["company_controls"], size, rng), rng)
+        chunk_ids = np.array(backend.add_documents(
+            documents=company_documents(first, size, rng),
+            connections=[[(id, "DONATED", False) for id in donated] + [(id, "HAS_CONTROL", True) for id in parent]
+                         for donated, parent in zip(donations, parents)],
+            document_type="Company"), dtype=np.int64)
+        company_ids = np.concatenate([company_ids, chunk_ids])
+        # Persons control companies of the chunk
+        persons = int(round(size * persons_per_company))
+        controlled = _pick(chunk_ids, np.maximum(sample_degrees(degrees["controls"], persons, rng), 1), rng)
+        backend.add_documents(documents=person_documents(persons, rng),
+                              connections=[[(id, "HAS_CONTROL", False) for id in ids] for ids in controlled],
+                              document_type="Person")
+        # Properties are owned by a single company each
+        owners = np.repeat(chunk_ids, sample_degrees(degrees["properties"], size, rng))
+        backend.add_documents(documents=property_documents(counts["Property"], len(owners), rng),
+                              connections=[[(id, "OWNS", True)] for id in owners.tolist()],
+                              document_type="Property")
+        counts["Company"] += size
+        counts["Person"] += persons
+        counts["Property"] += len(owners)
+        logging.info("Generated {done}/{total} companies".format(done=first + size, total=companies))
+    logging.info("Synthetic graph generated in {duration} seconds: {counts}".format(
+        duration=time.time() - start_time, counts=counts))
+    return counts
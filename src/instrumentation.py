@@ -0,0 +1,201 @@
+from bisect import bisect_left
+import functools
+import threading
+import time
+
+# Set to True to record every query. Sessions are only wrapped while enabled, so disabled
+# instrumentation costs nothing.
+enabled = False
+# The upper bounds (in seconds) of the buckets of the latency histograms, the last bucket is unbounded
+LATENCY_BUCKETS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+
+_lock = threading.Lock()
+_templates = {}
+_transactions = {}
+
+
+def reset():
+    """
+    Drop everything recorded so far
+    """
+    global _templates, _transactions
+    with _lock:
+        _templates = {}
+        _transactions = {}
+
+
+def _template(query: str) -> str:
+    # Queries are built from templates with parameters, so the query text identifies its template
+    return " ".join(query.split())
+
+
+def _record_query(query: str, seconds: float, rows: int, fetch: bool):
+    with _lock:
+        stats = _templates.get(query)
+        if stats is None:
+            stats = _templates[query] = {"calls": 0, "rows": 0, "seconds": 0.0, "fetch_seconds": 0.0,
+                                         "histogram": [0] * (len(LATENCY_BUCKETS) + 1)}
+        if fetch:
+            stats["rows"] += rows
+            stats["fetch_seconds"] += seconds
+        else:
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["histogram"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+
+def _record_transaction(name: str, seconds: float, attempts: int):
+    with _lock:
+        stats = _transactions.setdefault(name, {"calls": 0, "retries": 0, "seconds": 0.0})
+        stats["calls"] += 1
+        stats["retries"] += attempts - 1
+        stats["seconds"] += seconds
+
+
+class InstrumentedResult:
+    """
+    Wraps a query result, recording the rows fetched and the time spent fetching them
+    """
+
+    def __init__(self, result, query: str):
+        self._result = result
+        self._query = query
+
+    def _fetch(self, method, count):
+        start_time = time.perf_counter()
+        value = method()
+        _record_query(self._query, time.perf_counter() - start_time, count(value), fetch=True)
+        return value
+
+    def value(self, *args, **kwargs):
+        return self._fetch(lambda: self._result.value(*args, **kwargs), len)
+
+    def values(self, *args, **kwargs):
+        return self._fetch(lambda: self._result.values(*args, **kwargs), len)
+
+    def data(self, *args, **kwargs):
+        return self._fetch(lambda: self._result.data(*args, **kwargs), len)
+
+    def single(self, *args, **kwargs):
+        return self._fetch(lambda: self._result.single(*args, **kwargs), lambda record: 0 if record is None else 1)
+
+    def consume(self):
+        return self._fetch(self._result.consume, lambda summary: 0)
+
+    def __iter__(self):
+        return iter(self._fetch(lambda: list(self._result), len))
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+
+class InstrumentedTransaction:
+    """
+    Wraps a transaction, recording the latency of every query it runs
+    """
+
+    def __init__(self, transaction):
+        self._transaction = transaction
+
+    def run(self, query, parameters=None, **kwargs):
+        template = _template(query)
+        start_time = time.perf_counter()
+        result = self._transaction.run(query, parameters, **kwargs)
+        _record_query(template, time.perf_counter() - start_time, 0, fetch=False)
+        return InstrumentedResult(result, template)
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+
+class InstrumentedSession:
+    """
+    Wraps a session, recording every transaction function (with its retries) and every query.
+    Transaction functions receive an InstrumentedTransaction as their link.
+    """
+
+    def __init__(self, session):
+        self._session = session
+
+    def _execute(self, execute, transaction_function, *args, **kwargs):
+        attempts = 0
+
+        @functools.wraps(transaction_function)
+        def attempt(transaction, *args, **kwargs):
+            nonlocal attempts
+            attempts += 1
+            return transaction_function(InstrumentedTransaction(transaction), *args, **kwargs)
+
+        start_time = time.perf_counter()
+        try:
+            return execute(attempt, *args, **kwargs)
+        finally:
+            _record_transaction(transaction_function.__name__, time.perf_counter() - start_time, max(attempts, 1))
+
+    def execute_read(self, transaction_function, *args, **kwargs):
+        return self._execute(self._session.execute_read, transaction_function, *args, **kwargs)
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        return self._execute(self._session.execute_write, transaction_function, *args, **kwargs)
+
+    def run(self, query, parameters=None, **kwargs):
+        return InstrumentedTransaction(self._session).run(query, parameters, **kwargs)
+
+    def __enter__(self):
+        self._session.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._session.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+def instrument(session):
+    """
+    Wrap a session, if the instrumentation is enabled, otherwise return it as it is
+
+    :param session: the session for connection to the database
+    """
+    if enabled and not isinstance(session, InstrumentedSession):
+        return InstrumentedSession(session)
+    return session
+
+
+def _summarize(templates: dict, transactions: dict) -> dict:
+    templates = {query: dict(stats) for query, stats in templates.items()}
+    transactions = {name: dict(stats) for name, stats in transactions.items()}
+    for stats in templates.values():
+        # Only the non-empty buckets, by their upper bound
+        stats["histogram"] = {str(bound): count for bound, count in zip(LATENCY_BUCKETS + ["inf"], stats["histogram"]) if count > 0}
+    return {
+        "round_trips": sum(stats["calls"] for stats in templates.values()),
+        "rows": sum(stats["rows"] for stats in templates.values()),
+        "query_seconds": sum(stats["seconds"] + stats["fetch_seconds"] for stats in templates.values()),
+        "transactions": sum(stats["calls"] for stats in transactions.values()),
+        "retries": sum(stats["retries"] for stats in transactions.values()),
+        "templates": templates,
+        "transaction_functions": transactions
+    }
+
+
+def summary() -> dict:
+    """
+    Summarize what was recorded: the totals, and per query template and per transaction function
+    the calls, rows, seconds (spent in run and fetching), retries and latency histogram
+    """
+    with _lock:
+        return _summarize(_templates, _transactions)
+
+
+def take_summary() -> dict:
+    """
+    Summarize what was recorded since the last call (see summary) and start recording anew
+    """
+    global _templates, _transactions
+    with _lock:
+        templates, transactions = _templates, _transactions
+        _templates = {}
+        _transactions = {}
+    return _summarize(templates, transactions)
@@ -0,0 +1,299 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Iterator, List
+import csv
+import logging
+import os
+import time
+import database as db
+import instrumentation
+
+# The files of the UK companies dataset, as published on https://guides.neo4j.com/ukcompanies/data/
+UK_COMPANIES_FILES = {
+    "psc": "PSCAmericans.csv",
+    "companies": "CompanyDataAmericans.csv",
+    "donations": "ElectionDonationsAmericans.csv",
+    "land": "LandOwnershipAmericans.csv"
+}
+
+
+def _parse_date(value: str, format: str):
+    try:
+        return datetime.strptime(value, format).date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_int(value: str):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_float(value: str):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def psc_row(row: dict) -> dict:
+    """
+    Convert a row of PSCAmericans.csv (a person with significant control over a company)
+    """
+    nature = row["data.natures_of_control"]
+    if nature is not None:
+        nature = nature.replace("[", "").replace("]", "").replace('"', "").split(",")
+    return {
+        "companyNumber": row["company_number"],
+        "name": row["data.name"],
+        "birthYear": row["data.date_of_birth.year"],
+        "birthMonth": row["data.date_of_birth.month"],
+        "nationality": row["data.nationality"],
+        "countryOfResidence": row["data.country_of_residence"],
+        "nature": nature
+    }
+
+
+def company_data_row(row: dict) -> dict:
+    """
+    Convert a row of CompanyDataAmericans.csv (the details of a company)
+    """
+    return {
+        "companyNumber": row[" CompanyNumber"],
+        "properties": {
+            "name": row["CompanyName"],
+            "mortgagesOutstanding": _parse_int(row["Mortgages.NumMortOutstanding"]),
+            "incorporationDate": _parse_date(row["IncorporationDate"], "%d/%m/%Y"),
+            "SIC": row["SICCode.SicText_1"],
+            "countryOfOrigin": row["CountryOfOrigin"],
+            "status": row["CompanyStatus"],
+            "category": row["CompanyCategory"]
+        }
+    }
+
+
+def donation_row(row: dict) -> dict:
+    """
+    Convert a row of ElectionDonationsAmericans.csv (a donation of a company to a recipient)
+    """
+    value = row["Value"]
+    if value is not None:
+        value = value.replace("£", "").replace(",", "")
+    return {
+        "companyNumber": row["CompanyRegistrationNumber"],
+        "name": row["RegulatedEntityName"],
+        "entityType": row["RegulatedEntityType"],
+        "ref": row["ECRef"],
+        "date": _parse_date(row["ReceivedDate"], "%d/%m/%Y"),
+        "value": _parse_float(value)
+    }
+
+
+def land_row(row: dict) -> dict:
+    """
+    Convert a row of LandOwnershipAmericans.csv (a property owned by a company)
+    """
+    return {
+        "companyNumber": row["Company Registration No. (1)"],
+        "titleNumber": row["Title Number"],
+        "properties": {
+            "address": row["Property Address"],
+            "county": row["County"],
+            "price": _parse_int(row["Price Paid"]),
+            "district": row["District"]
+        },
+        "date": _parse_date(row["Date Proprietor Added"], "%d-%m-%Y")
+    }
+
+
+# The keys of a row each write needs, rows missing one of them are skipped by that write only
+# (like MERGE on null fails), the other writes of the row still happen
+COMPANY_KEYS = ["companyNumber"]
+PERSON_KEYS = ["name", "birthYear", "birthMonth"]
+WRITE_KEYS = {
+    db.merge_companies: COMPANY_KEYS,
+    db.merge_persons: PERSON_KEYS,
+    db.merge_control_relations: COMPANY_KEYS + PERSON_KEYS,
+    db.set_company_data: COMPANY_KEYS,
+    db.merge_recipients: COMPANY_KEYS + ["name"],
+    db.merge_donations: COMPANY_KEYS + ["name", "ref"],
+    db.merge_properties: COMPANY_KEYS + ["titleNumber"],
+    db.merge_ownerships: COMPANY_KEYS + ["titleNumber"]
+}
+ROW_CONVERTERS = {
+    "psc": psc_row,
+    "companies": company_data_row,
+    "donations": donation_row,
+    "land": land_row
+}
+# The batched writes of each file, in stages. The writes of a stage are independent
+# (different node types), so they run in parallel; the next stage starts once they finished.
+UK_COMPANIES_STAGES = [
+    [("psc", db.merge_companies), ("psc", db.merge_persons)],
+    [("companies", db.set_company_data), ("donations", db.merge_recipients), ("land", db.merge_properties)],
+    [("psc", db.merge_control_relations)],
+    [("donations", db.merge_donations)],
+    [("land", db.merge_ownerships)]
+]
+
+
+def has_keys(row: dict, keys: List[str]) -> bool:
+    """
+    Whether a converted row has a value for all the given keys
+    """
+    return all(row[key] is not None for key in keys)
+
+
+def read_rows(directory: str, file: str, keys: List[str] = []) -> Iterator[dict]:
+    """
+    Stream the converted rows of a file of the UK companies dataset.
+    Empty values are read as None, like LOAD CSV does.
+
+    :param str directory: the directory holding the CSV files
+    :param str file: the file, one of the keys of UK_COMPANIES_FILES
+    :param list keys: the keys a row needs to be streamed (see WRITE_KEYS)
+    """
+    convert = ROW_CONVERTERS[file]
+    with open(os.path.join(directory, UK_COMPANIES_FILES[file]), newline='', encoding='utf-8-sig') as csvFile:
+        for row in csv.DictReader(csvFile):
+            row = convert({name: (value if value != "" else None) for name, value in row.items()})
+            if has_keys(row, keys):
+                yield row
+
+
+def read_batches(directory: str, file: str, batch_size: int, keys: List[str] = []) -> Iterator[List[dict]]:
+    """
+    Stream the converted rows of a file of the UK companies dataset in batches
+
+    :param str directory: the directory holding the CSV files
+    :param str file: the file, one of the keys of UK_COMPANIES_FILES
+    :param int batch_size: the number of rows per batch
+    :param list keys: the keys a row needs to be streamed (see WRITE_KEYS)
+    """
+    batch = []
+    for row in read_rows(directory, file, keys):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def _load_file(driver, database: str, directory: str, file: str, write: Callable, batch_size: int) -> int:
+    # Every batch is committed in its own transaction
+    rows = 0
+    with instrumentation.instrument(driver.session(database=database)) as session:
+        for batch in read_batches(directory, file, batch_size, WRITE_KEYS[write]):
+            session.execute_write(write, rows=batch)
+            rows += len(batch)
+    logging.info("{rows} rows of {file} loaded ({write})".format(
+        rows=rows, file=UK_COMPANIES_FILES[file], write=write.__name__))
+    return rows
+
+
+def load_uk_companies(driver, directory: str, database: str = "neo4j", batch_size: int = 10000, workers: int = 4):
+    """
+    Load the UK companies dataset from local CSV files into Neo4j. The constraints are created first,
+    then the rows are merged in batches (one transaction per batch, independent node types in parallel)
+    and the CompanyIndex is built at the end.
+
+    :param driver: the driver connected to the database
+    :param str directory: the directory holding the CSV files (see UK_COMPANIES_FILES)
+    :param str database: the name of the database
+    :param int batch_size: the number of rows per transaction
+    :param int workers: the number of writes of a stage running in parallel, each with its own session
+    """
+    start_time = time.time()
+    with instrumentation.instrument(driver.session(database=database)) as session:
+        session.execute_write(db.uk_companies_contraints)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for stage in UK_COMPANIES_STAGES:
+            futures = [executor.submit(_load_file, driver, database, directory, file, write, batch_size)
+                       for (file, write) in stage]
+            for future in futures:
+                future.result()
+    with instrumentation.instrument(driver.session(database=database)) as session:
+        session.execute_write(db.uk_companies_index)
+    logging.info("UK companies dataset loaded in {duration} seconds".format(duration=time.time() - start_time))
+
+
+def _set_properties(properties: dict, values: dict):
+    # Like SET n += values, a None value removes the property
+    for name, value in values.items():
+        if value is None:
+            properties.pop(name, None)
+        else:
+            properties[name] = value
+
+
+def read_uk_companies(directory: str) -> List[List[Any]]:
+    """
+    Read the UK companies dataset from local CSV files into nodes and relations, merged the way
+    load_uk_companies merges them. Returns [nodes, relations], with nodes as [id, label, properties]
+    and relations as [source id, destination id, type, properties] (as used by import_graph).
+
+    :param str directory: the directory holding the CSV files (see UK_COMPANIES_FILES)
+    """
+    nodes = {}
+    relations = {}
+
+    def node(label, key, properties):
+        if (label, key) not in nodes:
+            nodes[(label, key)] = [len(nodes), label, properties]
+        return nodes[(label, key)]
+
+    psc = list(read_rows(directory, "psc"))
+    for row in psc:
+        if has_keys(row, WRITE_KEYS[db.merge_companies]):
+            node("Company", row["companyNumber"], {"companyNumber": row["companyNumber"]})
+        if has_keys(row, WRITE_KEYS[db.merge_persons]):
+            node("Person", (row["name"], row["birthYear"], row["birthMonth"]), {
+                name: row[name] for name in ["name", "birthYear", "birthMonth", "nationality", "countryOfResidence"]
+                if row[name] is not None})
+    for row in psc:
+        if not has_keys(row, WRITE_KEYS[db.merge_control_relations]):
+            continue
+        company = nodes[("Company", row["companyNumber"])]
+        person = nodes[("Person", (row["name"], row["birthYear"], row["birthMonth"]))]
+        relation = relations.setdefault((person[0], company[0], "HAS_CONTROL"), {})
+        _set_properties(relation, {"nature": row["nature"]})
+    for row in read_rows(directory, "companies", WRITE_KEYS[db.set_company_data]):
+        if ("Company", row["companyNumber"]) in nodes:
+            _set_properties(nodes[("Company", row["companyNumber"])][2], row["properties"])
+    for row in read_rows(directory, "donations", WRITE_KEYS[db.merge_recipients]):
+        if ("Company", row["companyNumber"]) in nodes:
+            company = nodes[("Company", row["companyNumber"])]
+            recipient = node("Recipient", row["name"], {"name": row["name"]})
+            _set_properties(recipient[2], {"entityType": row["entityType"]})
+            if not has_keys(row, WRITE_KEYS[db.merge_donations]):
+                continue
+            relation = relations.setdefault((company[0], recipient[0], "DONATED", row["ref"]), {"ref": row["ref"]})
+            _set_properties(relation, {"date": row["date"], "value": row["value"]})
+    for row in read_rows(directory, "land", WRITE_KEYS[db.merge_ownerships]):
+        if ("Company", row["companyNumber"]) in nodes:
+            company = nodes[("Company", row["companyNumber"])]
+            property = node("Property", row["titleNumber"], {"titleNumber": row["titleNumber"]})
+            _set_properties(property[2], row["properties"])
+            relation = relations.setdefault((company[0], property[0], "OWNS"), {})
+            if row["date"] is not None:
+                relation["date"] = row["date"]
+    return [list(nodes.values()),
+            [[key[0], key[1], key[2], properties] for key, properties in relations.items()]]
+
+
+def load_uk_companies_memory(backend, directory: str) -> dict:
+    """
+    Fill an in-memory backend with the UK companies dataset from local CSV files,
+    returns the mapping from the ids of read_uk_companies to the ids of the backend
+
+    :param backend: the in-memory backend
+    :param str directory: the directory holding the CSV files (see UK_COMPANIES_FILES)
+    """
+    nodes, relations = read_uk_companies(directory)
+    new_ids = backend.import_graph(nodes, relations)
+    logging.info("UK companies dataset loaded into memory ({nodes} nodes, {relations} relations)".format(
+        nodes=len(nodes), relations=len(relations)))
+    return new_ids
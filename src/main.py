@@ -1,89 +1,40 @@
 import os
 import sys
 from typing import List
-from neo4j import GraphDatabase
-from dotenv import load_dotenv
-import inquirer
-import database as db
-import pseudo as ps
-import watermark as wk
-import attack
+import config
 import time
 import json
-import plots
-import fake
 import argparse
 import logging
 import random
 
-# Configure logger
-log_dir = "/log/rp"
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-resultLog = open(os.path.join(log_dir, "results.json"), 'a')
-logging.basicConfig(
-    handlers=[
-        logging.FileHandler(
-            os.path.join(log_dir, "basic.log")),
-        logging.StreamHandler()
-    ],
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    encoding='utf-8',
-    level=logging.INFO)
-
-
-# Load Environment Variables
-load_dotenv()
-# Load settings
-settings = {}
-with open("settings.json") as settingsFile:
-    settings = json.load(settingsFile)
-logging.debug("Settings loaded: {settings}".format(
-    settings=json.dumps(settings)))
-
-# CONSTANTS
-URI = os.getenv("DB_URL")
-AUTH = (os.getenv("DB_USER"), os.getenv("DB_PASSWORD"))
-
-
-def get_all_non_company_ids(link):
-    result = link.run("match (n)"
-                      "where not \"Company\" in labels(n)"
-                      "return id(n), labels(n)[0]")
-    return result.values()
-
-
-def get_all_company_ids(link):
-    result = link.run("match (n:Company)"
-                      "return id(n), labels(n)[0]")
-    return result.values()
-
-
-def get_visible_watermark_ids(link):
-    result1 = link.run("match (n:CompanyW) "
-                       "return id(n)")
-    result2 = link.run("match (n:PropertyW) "
-                       "return id(n)")
-    return [result1.value(), result2.value()]
-
-
-def watermark_uk_companies(session, watermark_key: int, watermark_identity: str, watermark_visibility: bool = False, min_group_size: int = 10, max_group_size: int = 100):
+# Importing this module has no side effects. The settings, the results log and the heavy
+# dependencies (neo4j, numpy, matplotlib, inquirer) are loaded by the commands which need them.
+
+
+def watermark_uk_companies(backend, watermark_key: int, watermark_identity: str, watermark_visibility: bool = False, min_group_size: int = 10, max_group_size: int = 100, batch_size: int = 0, randomize_group_sizes: bool = True, manifest_path: str = None, rng=None):
     """
     Watermark the UK companies database
 
-    :param session: the session for connection to the database
+    :param backend: the graph backend holding the database
+    :param randomize_group_sizes: if True, the group size bounds are picked at random below min_group_size and max_group_size, otherwise they are used as they are
+    :param manifest_path: Optional. If given, the manifest of the watermark is written to this path (see watermark.watermark_database)
+    :param rng: Optional. The NumPy random generator used for the groups and the pseudo documents
     """
+    import watermark as wk
+    from catalog import NodeCatalog
     # Retrieve all IDs from the database
     logging.info("Watermarking UK Companies dataset")
-    min_group_size = random.randint(5, min_group_size)
-    max_group_size = random.randint(min_group_size+1, max_group_size)
-    id_count = session.execute_read(db.all_ids_count)
-    all_company_ids = session.execute_read(get_all_company_ids)
+    if randomize_group_sizes:
+        min_group_size = random.randint(5, min_group_size)
+        max_group_size = random.randint(min_group_size+1, max_group_size)
+    all_ids = NodeCatalog.from_backend(backend)
+    id_count = len(all_ids)
+    all_company_ids = all_ids.partition("Company")
     number_company_ids = len(all_company_ids)
-    all_non_company_ids = session.execute_read(get_all_non_company_ids)
     logging.debug("{number} ids were fetched".format(number=id_count))
     start_time = time.time()
-    watermarked = wk.watermark_database(session,
+    watermarked = wk.watermark_database(backend,
                                         ids=all_company_ids,
                                         min_group_size=min_group_size,
                                         max_group_size=max_group_size,
@@ -95,7 +46,12 @@ def watermark_uk_companies(session, watermark_key: int, watermark_identity: str,
                                             "mortgagesOutstanding", "SIC", "category"],
                                         watermark_key=watermark_key,
                                         watermark_identity=watermark_identity,
-                                        watermark_visibility=watermark_visibility)
+                                        watermark_visibility=watermark_visibility,
+                                        watermark_batch_size=batch_size,
+                                        watermark_hash_scheme=config.get_settings().get("watermark_hash_scheme", "sha256"),
+                                        watermark_workers=config.get_settings().get("watermark_workers", 1),
+                                        watermark_manifest_path=manifest_path,
+                                        rng=rng)
     end_time = time.time()
     log_result = {
         "action": "watermark",
@@ -104,12 +60,11 @@ def watermark_uk_companies(session, watermark_key: int, watermark_identity: str,
         "min_group_size": min_group_size,
         "max_group_size": max_group_size,
         "number_company_ids": number_company_ids,
-        "number_non_company_ids": len(all_non_company_ids),
+        "number_non_company_ids": id_count - number_company_ids,
         "number_nodes_before": id_count,
         "documents_introduced": len(watermarked)
     }
-    resultLog.write(json.dumps(log_result) + "\n")
-    resultLog.flush()
+    config.get_result_log().write(log_result)
     logging.debug("Database was watermarked in {time} seconds".format(
         time=end_time-start_time))
     logging.info("{number} pseudo nodes introduced".format(
@@ -117,159 +72,539 @@ def watermark_uk_companies(session, watermark_key: int, watermark_identity: str,
     return [watermarked, []]
 
 
-def verify_uk_companies(session, watermarked_ids: tuple[List[int], List[int]], key: int, watermark_identity: str, fast_check: bool = True):
+def verify_uk_companies(backend, watermarked_ids: tuple[List[int], List[int]], key: int, watermark_identity: str, fast_check: bool = True, sequential: bool = None):
+    """
+    Verify the UK companies watermark
+
+    :param backend: the graph backend holding the database
+    :param watermarked_ids: the ids of the pseudo documents (see watermark.get_watermark_ids)
+    :param sequential: Optional. If True, the documents are checked in chunks (see verification.sequential_verify),
+        stopping once the watermark is established, otherwise all of them are fetched at once.
+        By default, "mode" of "verification" in settings.json decides (exhaustive if not set).
+    """
+    settings = config.get_settings()
+    verification_settings = settings.get("verification", {})
+    if sequential is None:
+        sequential = verification_settings.get("mode", "exhaustive") == "sequential"
+    fields = ["countryOfOrigin", "name", "status"]
+    scheme = settings.get("watermark_hash_scheme", "sha256")
     start_time = time.time()
-    result = verify_watermark(
-        session=session,
+    if not sequential:
+        return verify_watermark(
+            backend=backend,
+            watermarked_ids=watermarked_ids[0],
+            key=key,
+            watermark_identity=watermark_identity,
+            watermark_fields=fields,
+            watermark_cover_field="companyNumber",
+            fast_check=fast_check,
+            scheme=scheme
+        )
+    import verification
+    result = verification.sequential_verify(
+        backend,
         watermarked_ids=watermarked_ids[0],
         key=key,
-        watermark_identity=watermark_identity,
-        watermark_fields=[
-            "countryOfOrigin", "name", "status"],
-        watermark_cover_field="companyNumber",
-        fast_check=fast_check
+        identity=watermark_identity,
+        fields=fields,
+        cover_field="companyNumber",
+        scheme=scheme,
+        alpha=verification_settings.get("alpha", verification.SPRT_ALPHA),
+        chunk_size=verification_settings.get("chunk_size", verification.SEQUENTIAL_CHUNK_SIZE)
     )
     end_time = time.time()
-    # logging.info(
-    #     "Watermark verification with result {result} (duration: {duration})".format(result=result, duration=end_time-start_time))
-    return result
+    log_result = {
+        "action": "verification",
+        "timestamp": time.time(),
+        "duration": end_time-start_time
+    }
+    log_result.update(result)
+    config.get_result_log().write(log_result)
+    logging.info("Watermark verification with result {result} (p-value: {p_value}, {checked}/{total} documents checked)".format(
+        result=result["verified"], p_value=result["p_value"], checked=result["documents_checked"], total=result["documents_total"]))
+    return result["verified"]
+
+
+def get_manifest_path(backend):
+    """
+    The path of the watermark manifest of the database of a backend. In-memory graphs have no manifest,
+    theirs would replace the one of the database.
+
+    :param backend: the graph backend holding the database
+    """
+    from backend import MemoryBackend
+    return None if isinstance(backend, MemoryBackend) else config.MANIFEST_PATH
+
+
+def get_uk_companies_watermark_ids(backend):
+    """
+    The ids of the pseudo documents of the UK companies watermark (see watermark.get_watermark_ids),
+    a manifest is only used if it matches the key and identity in settings.json and the database
+
+    :param backend: the graph backend holding the database
+    """
+    import watermark as wk
+    settings = config.get_settings()
+    return wk.get_watermark_ids(backend, get_manifest_path(backend), settings["key"], settings["watermark_identity"])
 
 
-def verify_watermark(session, watermarked_ids: List[int], key: int, watermark_identity: str, watermark_fields: List[str], watermark_cover_field: str, fast_check: bool = True):
-    documents = session.execute_read(db.get_documents, ids=watermarked_ids)
+def uk_companies_verifier(backend, watermarked_ids: tuple[List[int], List[int]], key: int, watermark_identity: str):
+    """
+    Create an incremental verifier for the UK companies watermark, used during attacks
+
+    :param backend: the graph backend holding the database
+    :param watermarked_ids: the ids of the pseudo documents (see watermark.get_watermark_ids)
+    """
+    from verification import IncrementalVerifier
+    return IncrementalVerifier(backend,
+                               watermarked_ids=watermarked_ids[0],
+                               key=key,
+                               identity=watermark_identity,
+                               fields=["countryOfOrigin", "name", "status"],
+                               cover_field="companyNumber",
+                               scheme=config.get_settings().get("watermark_hash_scheme", "sha256"))
+
+
+def verify_watermark(backend, watermarked_ids: List[int], key: int, watermark_identity: str, watermark_fields: List[str], watermark_cover_field: str, fast_check: bool = True, scheme: str = "sha256"):
+    import watermark as wk
+    documents = backend.get_documents(ids=watermarked_ids)
     logging.debug("Verifying {number} documents for watermark".format(
         number=len(documents)))
     for document in documents:
         result = wk.detect_watermark(document, key=key, identity=watermark_identity,
-                                     field=watermark_cover_field, fields=watermark_fields)
+                                     field=watermark_cover_field, fields=watermark_fields, scheme=scheme)
         if result:
             return True
     return False
 
 
-parser = argparse.ArgumentParser(description='Watermark a Neo4j database')
-parser.add_argument("-i", '--interactive', action='store_true',
-                    help='Show the interactive menu')
-parser.add_argument("-w", '--watermark', action='store_true',
-                    help='Watermark UK database without asking')
-parser.add_argument('--verify', action='store_true',
-                    help='Verify the watermark (exit with error if not verified)')
-parser.add_argument('--populate-uk-companies', action='store_true',
-                    help='Populate the database with the UK companies dataset')
-parser.add_argument('--generate-plots', action='store_true',
-                    help='Generate and save the plots')
-parser.add_argument("-d", '--deletion-attack', action='store_true',
-                    help='Perform a deletion attack on a watermarked database')
-parser.add_argument("-d", '--deletion-attack-fast', action='store_true',
-                    help='Perform a fast deletion attack without deleting items from the database')
-parser.add_argument("-m", '--modification-attack', action='store_true',
-                    help='Perform a modification attack on a watermarked database')
-
-# parser.add_argument('--reset', metavar='N', type=int,
-#                     help='Watermark UK database')
-
-args = parser.parse_args()
-logging.debug("Process started with args: {args}".format(args=args))
-# MAIN MENU
-main_menu = [
-    inquirer.List('Main menu',
-                  message="What would you like me to do?",
-                  choices=["Watermark UK database",
-                           "Verify watermark", "Perform deletion attack", "Perform fast deletion attack", "Perform modification attack", "Populate database", "Populate UK Companies", "Reset --hard", "Exit"],
-                  ),
-]
-
-
-def show_menu():
+def show_menu(backend, driver):
+    import inquirer
+    import attack
+    import database as db
+    import fake
+    import instrumentation
+    import pseudo as ps
+    settings = config.get_settings()
+    main_menu = [
+        inquirer.List('Main menu',
+                      message="What would you like me to do?",
+                      choices=["Watermark UK database",
+                               "Verify watermark", "Perform deletion attack", "Perform fast deletion attack", "Perform modification attack", "Perform insertion attack", "Populate database", "Populate UK Companies", "Reset --hard", "Exit"],
+                      ),
+    ]
     # Present the user with the main menu
     answer = inquirer.prompt(main_menu)
     match answer["Main menu"]:
         case "Watermark UK database":
-            with driver.session(database="neo4j") as session:
-                watermark_uk_companies(
-                    session, settings["key"], settings["watermark_identity"], settings["watermark_visible"])
+            watermark_uk_companies(
+                backend, settings["key"], settings["watermark_identity"], settings["watermark_visible"],
+                batch_size=settings.get("watermark_batch_size", 0), manifest_path=get_manifest_path(backend))
         case "Verify watermark":
-            with driver.session(database="neo4j") as session:
-                ids = session.execute_read(get_visible_watermark_ids)
-                res = verify_uk_companies(
-                    session, ids, settings["key"], settings["watermark_identity"])
-                print("Watermark verification: {result}\n".format(result=res))
+            ids = get_uk_companies_watermark_ids(backend)
+            res = verify_uk_companies(
+                backend, ids, settings["key"], settings["watermark_identity"])
+            print("Watermark verification: {result}\n".format(result=res))
         case "Perform fast deletion attack":
-            with driver.session(database="neo4j") as session:
-                percentages = [0.1, 0.3, 0.5, 0.6, 0.75, 0.8, 0.9, 0.95, 0.98]
-                res = attack.deletion_attack_short(session, percentages, 10)
+            percentages = [0.1, 0.3, 0.5, 0.6, 0.75, 0.8, 0.9, 0.95, 0.98]
+            res = attack.deletion_simulation(backend, percentages,
+                                             watermarked_ids=get_uk_companies_watermark_ids(backend)[0])
         case "Perform deletion attack":
-            with driver.session(database="neo4j") as session:
-                ids = session.execute_read(get_visible_watermark_ids)
-                def verification(session): return verify_uk_companies(
-                    session, ids, settings["key"], settings["watermark_identity"])
-                res = attack.deletion_attack(
-                    session, 50, verification)
+            ids = get_uk_companies_watermark_ids(backend)
+            verification = uk_companies_verifier(
+                backend, ids, settings["key"], settings["watermark_identity"])
+            res = attack.deletion_attack(
+                backend, 50, verification)
         case "Perform modification attack":
-            with driver.session(database="neo4j") as session:
-                ids = session.execute_read(get_visible_watermark_ids)
-                def verification(session): return verify_uk_companies(
-                    session, ids, settings["key"], settings["watermark_identity"])
-                res = attack.modification_attack(
-                    session, 50, verification)
+            ids = get_uk_companies_watermark_ids(backend)
+            verification = uk_companies_verifier(
+                backend, ids, settings["key"], settings["watermark_identity"])
+            res = attack.modification_attack(
+                backend, 50, verification, mode=settings.get("modification_mode", "delete"))
+        case "Perform insertion attack":
+            ids = get_uk_companies_watermark_ids(backend)
+            verification = uk_companies_verifier(
+                backend, ids, settings["key"], settings["watermark_identity"])
+            res = attack.insertion_attack(
+                backend, 1000, verification, optional_fields=settings["watermarkFields_optional"])
         case "Populate database":
-            with driver.session(database="neo4j") as session:
-                fake.populate_fake_data(session)
+            fake.populate_fake_data(backend)
         case "Populate UK Companies":
-            with driver.session(database="neo4j") as session:
+            with instrumentation.instrument(driver.session(database="neo4j")) as session:
                 db.populate_uk_companies(session)
+            ps.domain_cache.invalidate()
         case "Reset --hard":
-            with driver.session(database="neo4j") as session:
-                db.delete_everythong(session)
+            backend.delete_everything()
+            ps.domain_cache.invalidate()
         case "Exit":
             sys.exit(0)
 
 
-if __name__ == "__main__":
-    with GraphDatabase.driver(URI, auth=AUTH) as driver:
-        # Verify connection to the database
-        driver.verify_connectivity()
+def command_menu(args, backend, driver):
+    while True:
+        show_menu(backend, driver)
 
-    if args.interactive:
-        while True:
-            show_menu()
-    if args.populate_uk_companies:
-        with driver.session(database="neo4j") as session:
-            db.populate_uk_companies(session)
-    if args.watermark:
-        with driver.session(database="neo4j") as session:
-            watermark_uk_companies(
-                session, settings["key"], settings["watermark_identity"], settings["watermark_visible"])
-    if args.verify:
-        with driver.session(database="neo4j") as session:
-            ids = session.execute_read(get_visible_watermark_ids)
-            res = verify_uk_companies(
-                session, ids, settings["key"], settings["watermark_identity"])
-    if args.deletion_attack:
-        with driver.session(database="neo4j") as session:
-            ids = session.execute_read(get_visible_watermark_ids)
 
-            def verification(session): return verify_uk_companies(
-                session, ids, settings["key"], settings["watermark_identity"])
-            res = attack.deletion_attack(
-                session, 150, verification)
-    if args.deletion_attack_fast:
-        with driver.session(database="neo4j") as session:
+def command_watermark(args, backend, driver):
+    settings = config.get_settings()
+    watermark_uk_companies(
+        backend, settings["key"], settings["watermark_identity"], settings["watermark_visible"],
+        batch_size=settings.get("watermark_batch_size", 0), manifest_path=get_manifest_path(backend))
+
+
+def command_verify(args, backend, driver):
+    settings = config.get_settings()
+    try:
+        ids = get_uk_companies_watermark_ids(backend)
+    except ValueError as err:
+        logging.error("Watermark not verified: {err}".format(err=err))
+        return 1
+    sequential = None if args.mode is None else args.mode == "sequential"
+    res = verify_uk_companies(
+        backend, ids, settings["key"], settings["watermark_identity"], sequential=sequential)
+    print("Watermark verification: {result}".format(result=res))
+    # The exit code tells scripts whether the watermark was found
+    return 0 if res else 1
+
+
+def command_detect(args, backend, driver):
+    import verification
+    settings = config.get_settings()
+    result = verification.blind_detection(
+        backend,
+        label=args.label or settings["watermarkDocumentType"],
+        key=settings["key"],
+        identity=settings["watermark_identity"],
+        fields=settings["watermarkFields"],
+        cover_field=settings["watermarkCoverField"],
+        scheme=settings.get("watermark_hash_scheme", "sha256"),
+        alpha=settings.get("verification", {}).get("alpha", verification.SPRT_ALPHA),
+        page_size=args.page_size,
+        workers=args.workers,
+        hash_workers=args.hash_workers if args.hash_workers is not None else os.cpu_count())
+    matching_ids = result.pop("matching_ids")
+    log_result = {
+        "action": "blind_detection",
+        "timestamp": time.time()
+    }
+    log_result.update(result)
+    config.get_result_log().write(log_result)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(matching_ids, file)
+    print("Blind detection: {result} ({matched}/{scanned} documents, p-value: {p_value}, significance: {significance})".format(
+        result=result["detected"], matched=result["documents_matched"], scanned=result["documents_scanned"],
+        p_value=result["p_value"], significance=result["significance"]))
+    return 0 if result["detected"] else 1
+
+
+def command_trace(args, backend, driver):
+    import verification
+    settings = config.get_settings()
+    result = verification.trace_leak(
+        backend,
+        label=args.label or settings["watermarkDocumentType"],
+        registry=verification.load_registry(args.registry),
+        fields=settings["watermarkFields"],
+        cover_field=settings["watermarkCoverField"],
+        scheme=settings.get("watermark_hash_scheme", "sha256"),
+        alpha=settings.get("verification", {}).get("alpha", verification.SPRT_ALPHA),
+        page_size=args.page_size,
+        workers=args.workers,
+        hash_workers=args.hash_workers if args.hash_workers is not None else os.cpu_count())
+    # Only the recipients with matches are logged, the registry can be large
+    log_result = {
+        "action": "traceback",
+        "timestamp": time.time(),
+        "label": result["label"],
+        "identities": result["identities"],
+        "documents_scanned": result["documents_scanned"],
+        "documents_skipped": result["documents_skipped"],
+        "matches": [{name: value for name, value in match.items() if name != "matching_ids"} for match in result["matches"]],
+        "traced": [match["index"] for match in result["traced"]],
+        "duration": result["duration"]
+    }
+    config.get_result_log().write(log_result)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(result, file)
+    for match in result["traced"]:
+        print("Traced: {identity} (registry entry {index}, {count} documents, p-value: {p_value})".format(
+            identity=match["identity"], index=match["index"], count=match["count"], p_value=match["p_value"]))
+    if len(result["traced"]) == 0:
+        print("No identity traced ({scanned} documents, {identities} identities)".format(
+            scanned=result["documents_scanned"], identities=result["identities"]))
+    return 0 if result["traced"] else 1
+
+
+def command_attack(args, backend, driver):
+    import attack
+    settings = config.get_settings()
+    match args.attack:
+        case "deletion":
+            ids = get_uk_companies_watermark_ids(backend)
+            verification = uk_companies_verifier(
+                backend, ids, settings["key"], settings["watermark_identity"])
+            attack.deletion_attack(
+                backend, args.step, verification)
+        case "simulation":
             percentages = [0.1, 0.3, 0.5, 0.6, 0.75, 0.8, 0.9, 0.95, 0.98]
-            res = attack.deletion_attack_short(session, percentages, 10)
-    if args.modification_attack:
+            attack.deletion_simulation(backend, percentages,
+                                       watermarked_ids=get_uk_companies_watermark_ids(backend)[0])
+        case "modification":
+            ids = get_uk_companies_watermark_ids(backend)
+            verification = uk_companies_verifier(
+                backend, ids, settings["key"], settings["watermark_identity"])
+            attack.modification_attack(
+                backend, args.step, verification, mode=settings.get("modification_mode", "delete"))
+        case "insertion":
+            ids = get_uk_companies_watermark_ids(backend)
+            verification = uk_companies_verifier(
+                backend, ids, settings["key"], settings["watermark_identity"])
+            attack.insertion_attack(
+                backend, args.step, verification, max_documents=args.max_documents,
+                optional_fields=settings["watermarkFields_optional"], check_interval=args.check_interval)
+
+
+def command_populate(args, backend, driver):
+    import pseudo as ps
+    match args.dataset:
+        case "uk-companies" if args.directory is not None:
+            import loader
+            if driver is None:
+                loader.load_uk_companies_memory(backend, args.directory)
+            else:
+                loader.load_uk_companies(driver, args.directory)
+        case "uk-companies":
+            import database as db
+            import instrumentation
+            with instrumentation.instrument(driver.session(database="neo4j")) as session:
+                db.populate_uk_companies(session)
+        case "fake":
+            import fake
+            fake.populate_fake_data(backend, records=args.records)
+        case "synthetic":
+            import fake
+            fake.generate_uk_companies(backend, args.records, seed=args.seed)
+    ps.domain_cache.invalidate()
+
+
+def command_remove_watermark(args, backend, driver):
+    import restore
+    # Without a manifest, the visible pseudo documents are found by their labels
+    manifest_path = get_manifest_path(backend)
+    if manifest_path is None or not os.path.exists(manifest_path):
+        restore.remove_watermark(backend)
+        return 0
+    try:
+        # Without a manifest of the database, these are the visible pseudo documents of both types
+        ids = [id for type_ids in get_uk_companies_watermark_ids(backend) for id in type_ids]
+    except ValueError as err:
+        # The manifest was written with another key or identity, its ids may not be this watermark's
+        logging.error("Nothing removed: {err}".format(err=err))
+        return 1
+    restore.remove_watermark(backend, ids)
+    return 0
+
+
+def command_snapshot(args, backend, driver):
+    import restore
+    match args.operation:
+        case "save":
+            restore.save_snapshot(backend, args.path)
+        case "restore":
+            import pseudo as ps
+            restore.restore_snapshot(backend, args.path)
+            ps.domain_cache.invalidate()
+
+
+def command_sweep(args, backend, driver):
+    import sweep
+    sweep.run_sweep(backend, config.get_settings()["sweep"])
+
+
+def command_plot(args):
+    import plots
+    results_path = args.results or config.get_result_log().name
+    plots.generate_plots(args.plot_dir, results_path=results_path, workers=args.workers)
+
+
+def command_benchmark(args):
+    import benchmark
+    results = benchmark.run_suite(names=args.names, sizes=args.sizes or benchmark.SIZES, repeat=args.repeat)
+    benchmark.save_results(results, args.output)
+    if args.save_baseline:
+        benchmark.save_results(results, args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        logging.warning("No baseline at {path}, run with --save-baseline to create one".format(path=args.baseline))
+        return 0
+    regressions = benchmark.compare(results, benchmark.load_results(args.baseline), tolerance=args.tolerance)
+    for regression in regressions:
+        logging.warning("Regression: {regression}".format(regression=json.dumps(regression)))
+    # The exit code tells scripts whether the benchmarks regressed
+    return 1 if len(regressions) > 0 else 0
+
+
+def run_on_database(args):
+    """
+    Connect to the database (or load the in-memory graph from local files) and run the command of the arguments on it
+
+    :param args: the parsed command line arguments
+    """
+    from backend import Neo4jBackend, MemoryBackend
+    if args.in_memory and (args.uk_companies is not None or args.synthetic is not None):
+        # The graph is read from the local dataset or generated, Neo4j is not needed
+        backend = MemoryBackend()
+        if args.uk_companies is not None:
+            import loader
+            loader.load_uk_companies_memory(backend, args.uk_companies)
+        else:
+            import fake
+            fake.generate_uk_companies(backend, args.synthetic, seed=args.seed)
+        return args.command(args, backend, None)
+    from neo4j import GraphDatabase
+    with GraphDatabase.driver(config.get_database_uri(), auth=config.get_database_auth()) as driver:
+        # Verify connection to the database
+        driver.verify_connectivity()
         with driver.session(database="neo4j") as session:
-            ids = session.execute_read(get_visible_watermark_ids)
+            backend = Neo4jBackend(session, driver=driver, database="neo4j")
+            if args.in_memory:
+                backend = MemoryBackend.from_backend(backend)
+                logging.info("Database copied into memory ({number} nodes)".format(
+                    number=backend.all_ids_count()))
+            return args.command(args, backend, driver)
 
-            def verification(session): return verify_uk_companies(
-                session, ids, settings["key"], settings["watermark_identity"])
-            res = attack.modification_attack(
-                session, 150, verification)
-    if args.generate_plots:
-        plot_dir = "plots/"
-        if not os.path.exists(plot_dir):
-            os.makedirs(plot_dir)
-        plot1 = plots.plot_documents_vs_time()
-        plot1.savefig("plots/time_to_watermark.png")
-        plot2 = plots.plot_robustness()
-        plot2.savefig("plots/robustness.png")
+
+def get_parser() -> argparse.ArgumentParser:
+    """
+    The command line interface, every command runs against the database except "plot"
+    """
+    parser = argparse.ArgumentParser(description='Watermark a Neo4j database')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='Copy the database into an in-memory graph and run the command against the copy')
+    parser.add_argument('--instrument', action='store_true',
+                        help='Record every database query and add a summary of the queries to every results record')
+    parser.add_argument('--uk-companies', metavar='DIR',
+                        help='With --in-memory, load the in-memory graph from the UK companies CSV files in DIR instead of the database')
+    parser.add_argument('--synthetic', metavar='N', type=int,
+                        help='With --in-memory, generate a synthetic UK companies graph of N companies instead of copying the database')
+    parser.add_argument('--seed', type=int,
+                        help='The seed of the synthetic graph')
+    commands = parser.add_subparsers(title="commands", required=True, metavar="COMMAND")
+
+    command = commands.add_parser('menu', help='Show the interactive menu')
+    command.set_defaults(command=command_menu)
+
+    command = commands.add_parser('watermark', help='Watermark UK database without asking')
+    command.set_defaults(command=command_watermark)
+
+    command = commands.add_parser('verify', help='Verify the watermark (exit with error if not verified)')
+    command.add_argument('--mode', choices=["sequential", "exhaustive"],
+                         help='"sequential" stops once the watermark is established, "exhaustive" fetches all pseudo documents at once (default: from settings.json, exhaustive if not set)')
+    command.set_defaults(command=command_verify)
+
+    command = commands.add_parser('detect', help='Detect the watermark without the manifest or visible labels, by scanning every node of a label (exit with error if not detected)')
+    command.add_argument('--label',
+                         help='The label of the nodes to scan (default: watermarkDocumentType from settings.json)')
+    command.add_argument('--page-size', type=int, default=50000,
+                         help='The number of ids fetched per page')
+    command.add_argument('--workers', type=int, default=4,
+                         help='The number of pages fetched concurrently, each on its own session')
+    command.add_argument('--hash-workers', type=int,
+                         help='The number of processes hashing the pages (default: number of CPUs)')
+    command.add_argument('--output', metavar='PATH',
+                         help='Save the ids of the matching nodes as JSON')
+    command.set_defaults(command=command_detect)
+
+    command = commands.add_parser('trace', help='Find out which recipients\' watermarks are present, by scanning every node of a label once (exit with error if none is)')
+    command.add_argument('--registry', metavar='PATH', required=True,
+                         help='A JSON list of the {"identity": ..., "key": ...} of every recipient')
+    command.add_argument('--label',
+                         help='The label of the nodes to scan (default: watermarkDocumentType from settings.json)')
+    command.add_argument('--page-size', type=int, default=50000,
+                         help='The number of ids fetched per page')
+    command.add_argument('--workers', type=int, default=4,
+                         help='The number of pages fetched concurrently, each on its own session')
+    command.add_argument('--hash-workers', type=int,
+                         help='The number of processes hashing the pages (default: number of CPUs)')
+    command.add_argument('--output', metavar='PATH',
+                         help='Save the full result (counts of every identity and matching ids) as JSON')
+    command.set_defaults(command=command_trace)
+
+    command = commands.add_parser('attack', help='Perform an attack on a watermarked database')
+    command.add_argument('attack', choices=["deletion", "simulation", "modification", "insertion"],
+                         help='The attack, "simulation" simulates deletion attacks without deleting items from the database')
+    command.add_argument('--step', type=int, default=150,
+                         help='The number of documents deleted or inserted or fields modified per step')
+    command.add_argument('--max-documents', type=int,
+                         help='The number of documents inserted at most by the insertion attack (default: as many as there are nodes)')
+    command.add_argument('--check-interval', type=int, default=1,
+                         help='The number of steps of the insertion attack between two checks of the watermark')
+    command.set_defaults(command=command_attack)
+
+    command = commands.add_parser('populate', help='Populate the database')
+    command.add_argument('dataset', choices=["uk-companies", "fake", "synthetic"],
+                         help='The UK companies dataset, fake person documents or a synthetic graph with the UK companies schema')
+    command.add_argument('--records', type=int, default=25,
+                         help='The number of fake documents or synthetic companies')
+    command.add_argument('--from', dest='directory', metavar='DIR',
+                         help='Load the UK companies dataset from the CSV files in DIR instead of downloading it')
+    command.set_defaults(command=command_populate)
+
+    command = commands.add_parser('remove-watermark', help='Remove the visible pseudo documents and their edges')
+    command.set_defaults(command=command_remove_watermark)
+
+    command = commands.add_parser('snapshot', help='Save or restore a local snapshot file of all nodes and relations')
+    command.add_argument('operation', choices=["save", "restore"])
+    command.add_argument('path', metavar='PATH')
+    command.set_defaults(command=command_snapshot)
+
+    command = commands.add_parser('sweep', help='Run the experiment sweep described by "sweep" in settings.json')
+    command.set_defaults(command=command_sweep)
+
+    command = commands.add_parser('plot', help='Generate and save the plots')
+    command.add_argument('--plot-dir', default="plots/",
+                         help='The directory the plots are saved to')
+    command.add_argument('--results', metavar='PATH',
+                         help='The results log to plot, the log of this project by default')
+    command.add_argument('--workers', type=int,
+                         help='The number of processes rendering plots')
+    command.set_defaults(command=command_plot, offline=True)
+
+    command = commands.add_parser('benchmark', help='Benchmark the watermarking and the attacks on in-memory graphs')
+    command.add_argument('--names', nargs='+', metavar='NAME',
+                         help='The benchmarks to run, all by default')
+    command.add_argument('--sizes', nargs='+', type=int, metavar='N',
+                         help='The sizes to run the benchmarks at (every benchmark stops at its own largest size)')
+    command.add_argument('--repeat', type=int, default=3,
+                         help='The number of runs per benchmark and size, the fastest one counts')
+    command.add_argument('--output', default="benchmarks/latest.json",
+                         help='The file the results are saved to')
+    command.add_argument('--baseline', default="benchmarks/baseline.json",
+                         help='The baseline the results are compared with')
+    command.add_argument('--save-baseline', action='store_true',
+                         help='Save the results as the new baseline instead of comparing them')
+    command.add_argument('--tolerance', type=float, default=0.25,
+                         help='The allowed slowdown against the baseline, as a fraction')
+    command.set_defaults(command=command_benchmark, offline=True)
+
+    # parser.add_argument('--reset', metavar='N', type=int,
+    #                     help='Watermark UK database')
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = get_parser().parse_args(argv)
+    config.setup_logging()
+    if args.instrument:
+        import instrumentation
+        instrumentation.enabled = True
+    logging.debug("Process started with args: {args}".format(args=args))
+    if getattr(args, "offline", False):
+        return args.command(args)
+    return run_on_database(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
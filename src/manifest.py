@@ -0,0 +1,115 @@
+from typing import Any, List
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+
+
+def key_fingerprint(key: int, identity: str) -> str:
+    """
+    A fingerprint of the key and identity of a watermark, which tells whether a key belongs
+    to a manifest without storing the key itself
+
+    :param key: the key used for the embedding process
+    :param str identity: the identity, which the watermark carries
+    """
+    return hashlib.sha256("manifest:{identity}:{key}".format(identity=identity, key=key).encode('utf-8')).hexdigest()
+
+
+def write_manifest(path: str, pseudo_ids: List[int], groups: List[List[Any]], hashes: List[int], key: int, identity: str, document_type: str, cover_field: str, fields: List[str], scheme: str = "sha256", visible: bool = False):
+    """
+    Write the manifest of a watermark: the ids of the pseudo documents, the ids of the members of their groups
+    (as offsets into one array), the watermark every pseudo document carries and a description of the watermark.
+    Stored as a NumPy .npz file, without pickled objects.
+
+    :param str path: the path of the manifest
+    :param List[int] pseudo_ids: the ids of the pseudo documents
+    :param groups: the groups of [id, label] pairs, one per pseudo document
+    :param List[int] hashes: the watermark in the cover field of every pseudo document
+    :param key: the key used for the embedding process
+    :param str identity: the identity, which the watermark carries
+    :param str document_type: the type of the pseudo documents
+    :param str cover_field: the field, which contains the watermark
+    :param List[str] fields: the fields, which were used to generate the watermark
+    :param str scheme: the hash function used, one of watermark.HASH_SCHEMES
+    :param bool visible: whether the pseudo documents carry the visible W suffix
+    """
+    sizes = np.fromiter((len(group) for group in groups), dtype=np.int64, count=len(groups))
+    offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    members = np.fromiter((id for group in groups for (id, _) in group), dtype=np.int64, count=int(offsets[-1]))
+    metadata = {
+        "identity": identity,
+        "key_fingerprint": key_fingerprint(key, identity),
+        "document_type": document_type,
+        "cover_field": cover_field,
+        "fields": list(fields),
+        "scheme": scheme,
+        "visible": visible
+    }
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    # np.savez appends .npz to other names, the file is written under the exact path instead
+    with open(path, 'wb') as file:
+        np.savez_compressed(file,
+                            pseudo_ids=np.asarray(pseudo_ids, dtype=np.int64),
+                            group_offsets=offsets,
+                            group_members=members,
+                            hashes=np.asarray(hashes, dtype=np.int64),
+                            metadata=np.array(json.dumps(metadata)))
+    logging.debug("Manifest of {number} pseudo documents written to {path}".format(number=len(pseudo_ids), path=path))
+
+
+def read_manifest(path: str) -> dict:
+    """
+    Read a manifest written by write_manifest. Returns the description of the watermark,
+    together with the arrays "pseudo_ids", "group_offsets", "group_members" and "hashes".
+    The members of the group of the i-th pseudo document are group_members[group_offsets[i]:group_offsets[i + 1]].
+
+    :param str path: the path of the manifest
+    """
+    with np.load(path, allow_pickle=False) as data:
+        manifest = json.loads(str(data["metadata"]))
+        for name in ["pseudo_ids", "group_offsets", "group_members", "hashes"]:
+            manifest[name] = data[name]
+    return manifest
+
+
+def check_key(manifest: dict, key: int, identity: str) -> bool:
+    """
+    Return whether the key and identity are those the watermark of the manifest was embedded with
+
+    :param dict manifest: the manifest, as returned by read_manifest
+    :param key: the key used for the embedding process
+    :param str identity: the identity, which the watermark carries
+    """
+    return manifest["identity"] == identity and manifest["key_fingerprint"] == key_fingerprint(key, identity)
+
+
+def check_documents(manifest: dict, backend, chunk_size: int = 1000) -> bool:
+    """
+    Return whether the pseudo documents of a manifest are those of the database: true if one of those still
+    existing carries the watermark of the manifest in its cover field or, for visible watermarks, if those
+    still existing all carry the visible label. A manifest of another database (or of a database since
+    restored from a snapshot, which reuses the ids) fails the check, as does one of which no document exists.
+    The ids are fetched in chunks, until one of them carries its watermark.
+
+    :param dict manifest: the manifest, as returned by read_manifest
+    :param backend: the graph backend holding the database
+    :param int chunk_size: the number of documents fetched at once
+    """
+    expected = dict(zip(manifest["pseudo_ids"].tolist(), manifest["hashes"].tolist()))
+    ids = list(expected)
+    existing = []
+    for start in range(0, len(ids), chunk_size):
+        rows = backend.get_documents_with_ids(ids=ids[start:start + chunk_size])
+        if any(document.get(manifest["cover_field"]) == expected[id] for (id, document) in rows):
+            return True
+        existing += [id for (id, _) in rows]
+    if len(existing) == 0:
+        return False
+    if manifest["visible"]:
+        return set(existing).issubset(backend.get_label_ids(manifest["document_type"] + "W"))
+    return False
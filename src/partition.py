@@ -0,0 +1,125 @@
+from typing import Any, Iterator, List, Sequence, Tuple
+import numpy as np
+
+# NumPy only draws multivariate hypergeometric samples over fewer items than this
+HYPERGEOMETRIC_LIMIT = 10**9 - 1
+
+
+def _distribute(total: int, capacity: int, k: int, rng: np.random.Generator) -> np.ndarray:
+    # Spread total units over k bins holding at most capacity units each, as if the units were
+    # drawn without replacement from all k * capacity slots
+    if k == 0 or capacity == 0:
+        return np.zeros(k, dtype=np.int64)
+    block = max(1, HYPERGEOMETRIC_LIMIT // capacity)
+    if k <= block:
+        return rng.multivariate_hypergeometric(np.full(k, capacity), total, method="marginals")
+    # Too many slots for a single draw, the units are split over blocks of bins in proportion to their size first
+    lengths = np.minimum(block, k - np.arange(0, k, block))
+    shares = lengths * total // k
+    shares[rng.choice(len(lengths), size=total - int(shares.sum()), replace=False)] += 1
+    return np.concatenate([rng.multivariate_hypergeometric(np.full(length, capacity), share, method="marginals")
+                           for length, share in zip(lengths.tolist(), shares.tolist())])
+
+
+def sample_group_sizes(n: int, min_size: int, max_size: int, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Pick the sizes of the groups n items are divided into. Every size is within [min_size, max_size]
+    and the sizes sum up to n exactly. Raises a ValueError if no such groups exist.
+
+    :param int n: the number of items
+    :param int min_size: the minimum size of a group (inclusive)
+    :param int max_size: the maximum size of a group (inclusive)
+    :param rng: Optional. The random generator used to pick the sizes
+    """
+    if min_size < 1 or min_size > max_size:
+        raise ValueError("Invalid group size bounds {min} and {max}".format(min=min_size, max=max_size))
+    if rng is None:
+        rng = np.random.default_rng()
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    fewest = -(-n // max_size)
+    most = n // min_size
+    if fewest > most:
+        raise ValueError("{n} items cannot be divided into groups of {min} to {max} items".format(
+            n=n, min=min_size, max=max_size))
+    # The number of groups of the average size (halfway between the bounds), as far as it is feasible
+    k = min(max(round(2 * n / (min_size + max_size)), fewest), most)
+    return min_size + _distribute(n - k * min_size, max_size - min_size, k, rng)
+
+
+def assign_groups(n: int, group_sizes: np.ndarray, rng: np.random.Generator = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Assign n items to groups of the given sizes at random, using a single permutation.
+    Returns the groups as index arrays in CSR form: group i holds the items order[offsets[i]:offsets[i+1]].
+
+    :param int n: the number of items
+    :param np.ndarray group_sizes: the size of every group, summing up to n
+    :param rng: Optional. The random generator used for the permutation
+    """
+    if int(np.sum(group_sizes)) != n:
+        raise ValueError("The group sizes sum up to {sum} instead of {n}".format(sum=int(np.sum(group_sizes)), n=n))
+    if rng is None:
+        rng = np.random.default_rng()
+    order = rng.permutation(n)
+    offsets = np.zeros(len(group_sizes) + 1, dtype=np.int64)
+    np.cumsum(group_sizes, out=offsets[1:])
+    return order, offsets
+
+
+def partition_indices(n: int, min_size: int, max_size: int, rng: np.random.Generator = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Divide n items into random groups of min_size to max_size items, returns the groups
+    as index arrays in CSR form (see assign_groups)
+
+    :param int n: the number of items
+    :param int min_size: the minimum size of a group (inclusive)
+    :param int max_size: the maximum size of a group (inclusive)
+    :param rng: Optional. The random generator used
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    return assign_groups(n, sample_group_sizes(n, min_size, max_size, rng), rng)
+
+
+def _take(items: Sequence[Any], indices: np.ndarray, offsets: np.ndarray) -> List[Any]:
+    # Split the items at the given indices into groups, at offsets relative to the indices
+    if isinstance(items, np.ndarray):
+        return np.split(items[indices], offsets[1:-1])
+    indices = indices.tolist()
+    offsets = offsets.tolist()
+    return [[items[index] for index in indices[start:end]] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def partition(items: Sequence[Any], min_size: int, max_size: int, rng: np.random.Generator = None) -> List[Any]:
+    """
+    Divide items into random groups of min_size to max_size items. Groups of a list are lists,
+    groups of a NumPy array are arrays.
+
+    :param items: the items (list, NumPy array or any indexable sequence)
+    :param int min_size: the minimum size of a group (inclusive)
+    :param int max_size: the maximum size of a group (inclusive)
+    :param rng: Optional. The random generator used
+    """
+    order, offsets = partition_indices(len(items), min_size, max_size, rng)
+    return _take(items, order, offsets)
+
+
+def iter_partition(items: Sequence[Any], min_size: int, max_size: int, chunk_size: int, rng: np.random.Generator = None) -> Iterator[List[Any]]:
+    """
+    Divide items into random groups of min_size to max_size items, yielding the groups in chunks
+    of at most chunk_size items (or a single group, if it is bigger). Only the permutation is kept
+    in memory, the items of a chunk are looked up when it is yielded.
+
+    :param items: the items (list, NumPy array or any indexable sequence, e.g. a range)
+    :param int min_size: the minimum size of a group (inclusive)
+    :param int max_size: the maximum size of a group (inclusive)
+    :param int chunk_size: the maximum number of items per chunk
+    :param rng: Optional. The random generator used
+    """
+    order, offsets = partition_indices(len(items), min_size, max_size, rng)
+    first = 0
+    while first < len(offsets) - 1:
+        # The groups which fit in the chunk, at least one
+        last = max(first + 1, int(np.searchsorted(offsets, offsets[first] + chunk_size, side="right")) - 1)
+        yield _take(items, order[offsets[first]:offsets[last]], offsets[first:last + 1] - offsets[first])
+        first = last
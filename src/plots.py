@@ -1,124 +1,187 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import logging
+import os
+import pickle
+import matplotlib
+# Render without a display, so figures can be drawn in worker processes
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
-import json
-import os
+import results
+
+# The results log written by main.py
+RESULTS_PATH = 'logs/results.json'
+# The fields of the records, which the plots use, per action
+PLOT_FIELDS = {
+    "watermark": ["documents_introduced", "duration", "min_group_size", "max_group_size"],
+    "deletion_attack": ["num_watermarked_nodes", "nodes_before", "nodes_after"],
+    "modification_attack": ["num_watermarked_nodes", "iteration"]
+}
+
+
+def cache_path(path: str) -> str:
+    """
+    The path of the cached aggregates of a results log
+
+    :param str path: the path of the results log
+    """
+    return path + ".plots"
+
+
+def load_aggregates(path: str = RESULTS_PATH) -> dict:
+    """
+    Load the plotted fields of a results log as NumPy columns per action. The records of the plotted actions
+    are read through the index of the log (see results.iter_records), the columns are cached next to the log
+    together with its size and modification time. When the log only grew since, just the new records are read.
 
-def plot_documents_vs_time():
-    data = ""
-    with open('logs/results.json', 'r') as file:
-        data = "[" + file.read().rstrip().replace('\n', ',') + "]"
-        data = json.loads(data)
-    watermark_data = [datapoint for datapoint in data if datapoint["action"] == "watermark"]
-    watermark_data.sort(key=lambda x: x["documents_introduced"])
+    :param str path: the path of the results log
+    """
+    columns = {action: {field: [] for field in fields} for action, fields in PLOT_FIELDS.items()}
+    if not os.path.exists(path):
+        return {action: {field: np.array(values, dtype=float) for field, values in action_columns.items()}
+                for action, action_columns in columns.items()}
+    stat = os.stat(path)
+    offset = 0
+    cache = None
+    if os.path.exists(cache_path(path)):
+        with open(cache_path(path), 'rb') as file:
+            cache = pickle.load(file)
+        # The log is append-only, a smaller log (or other fields) means it was replaced
+        if cache["fields"] != PLOT_FIELDS or cache["size"] > stat.st_size:
+            cache = None
+    if cache is not None:
+        if cache["size"] == stat.st_size and cache["mtime"] == stat.st_mtime:
+            return cache["aggregates"]
+        columns = {action: {field: values.tolist() for field, values in action_columns.items()}
+                   for action, action_columns in cache["aggregates"].items()}
+        offset = cache["size"]
+    for record in results.iter_records(path, actions=list(PLOT_FIELDS.keys()), start=offset):
+        action_columns = columns[record["action"]]
+        for field in PLOT_FIELDS[record["action"]]:
+            value = record.get(field)
+            action_columns[field].append(np.nan if value is None else value)
+    aggregates = {action: {field: np.array(values, dtype=float) for field, values in action_columns.items()}
+                  for action, action_columns in columns.items()}
+    with open(cache_path(path), 'wb') as file:
+        pickle.dump({
+            "fields": PLOT_FIELDS,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "aggregates": aggregates
+        }, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return aggregates
+
+
+def _sorted_by(columns: dict, field: str) -> dict:
+    order = np.argsort(columns[field], kind="stable")
+    return {name: values[order] for name, values in columns.items()}
+
+
+def plot_documents_vs_time(data: dict = None):
+    if data is None:
+        data = load_aggregates()
+    watermark_data = _sorted_by(data["watermark"], "documents_introduced")
     # Generate points
-    x1 = [datapoint["documents_introduced"] for datapoint in watermark_data]
-    y1 = [datapoint["duration"] for datapoint in watermark_data]
+    x1 = watermark_data["documents_introduced"]
+    y1 = watermark_data["duration"]
 
-    print("Documents per second: ", sum(x1)/sum(y1))
+    if len(x1) > 0:
+        logging.info("Documents per second: {rate}".format(rate=np.sum(x1)/np.sum(y1)))
+
+    fig, ax = plt.subplots()
+    # plotting the line 1 points
+    ax.plot(x1, y1)
 
-    # plotting the line 1 points 
-    plt.plot(x1, y1)
-    
     # naming the x axis
-    plt.xlim(left=0)
-    plt.xlabel('Number of pseudo documents')
+    ax.set_xlim(left=0)
+    ax.set_xlabel('Number of pseudo documents')
     # naming the y axis
-    plt.ylim(bottom=0)
-    plt.ylabel('Time for watermark')
+    ax.set_ylim(bottom=0)
+    ax.set_ylabel('Time for watermark')
     # giving a title to my graph
-    plt.title('Time to watermark')
-    plt.legend()
-
-    return plt
-
-def plot_robustness():
-    data = ""
-    with open('logs/results.json', 'r') as file:
-        data = "[" + file.read().rstrip().replace('\n', ',') + "]"
-        data = json.loads(data)
-    deletion_data = [datapoint for datapoint in data if datapoint["action"] == "deletion_attack"]
-    deletion_data.sort(key=lambda x: x["num_watermarked_nodes"])
+    ax.set_title('Time to watermark')
+
+    return fig
+
+def plot_robustness(data: dict = None):
+    if data is None:
+        data = load_aggregates()
+    deletion_data = _sorted_by(data["deletion_attack"], "num_watermarked_nodes")
     # Generate points
-    x1 = [datapoint["num_watermarked_nodes"] for datapoint in deletion_data]
-    y1 = [datapoint["nodes_after"]*100/datapoint["nodes_before"] for datapoint in deletion_data]
+    x1 = deletion_data["num_watermarked_nodes"]
+    y1 = deletion_data["nodes_after"]*100/deletion_data["nodes_before"]
 
-    # plotting the line 1 points 
-    plt.plot(x1, y1)
+    fig, ax = plt.subplots()
+    # plotting the line 1 points
+    ax.plot(x1, y1)
     # naming the x axis
-    # plt.xlim(left=0)
-    plt.xlabel('Number of watermarked documents')
+    ax.set_xlabel('Number of watermarked documents')
     # naming the y axis
-    plt.ylim([0,100])
-    plt.ylabel('$\%$ of nodes deleted')
+    ax.set_ylim([0,100])
+    ax.set_ylabel('$\\%$ of nodes deleted')
     # giving a title to my graph
-    plt.title('Watermark robustness')
-    plt.legend()
-
-    return plt
-
-def plot_usability():
-    data = ""
-    with open('logs/results.json', 'r') as file:
-        data = "[" + file.read().rstrip().replace('\n', ',') + "]"
-        data = json.loads(data)
-    deletion_data = [datapoint for datapoint in data if datapoint["action"] == "deletion_attack"]
-    deletion_data.sort(key=lambda x: x["num_watermarked_nodes"])
+    ax.set_title('Watermark robustness')
+
+    return fig
+
+def plot_usability(data: dict = None):
+    if data is None:
+        data = load_aggregates()
+    deletion_data = _sorted_by(data["deletion_attack"], "num_watermarked_nodes")
     # Generate points
-    x1 = [datapoint["num_watermarked_nodes"]*100/datapoint["nodes_before"] for datapoint in deletion_data]
-    y1 = [datapoint["nodes_after"]*100/datapoint["nodes_before"] for datapoint in deletion_data]
+    x1 = deletion_data["num_watermarked_nodes"]*100/deletion_data["nodes_before"]
+    y1 = deletion_data["nodes_after"]*100/deletion_data["nodes_before"]
+
+    fig, ax = plt.subplots()
+    # plotting the line 1 points
+    ax.plot(x1, y1)
 
-    # plotting the line 1 points 
-    plt.plot(x1, y1)
-    
     # naming the x axis
-    plt.xlim(left=0)
-    plt.xlabel('$\%$ of pseudo nodes')
+    ax.set_xlim(left=0)
+    ax.set_xlabel('$\\%$ of pseudo nodes')
     # naming the y axis
-    plt.ylim([0,100])
-    plt.ylabel('$\%$ of nodes deleted')
+    ax.set_ylim([0,100])
+    ax.set_ylabel('$\\%$ of nodes deleted')
     # giving a title to my graph
-    plt.title('Watermark robustness')
-    plt.legend()
-
-    return plt
-
-def plot_parameter_diff():
-    data = ""
-    with open('logs/results.json', 'r') as file:
-        data = "[" + file.read().rstrip().replace('\n', ',') + "]"
-        data = json.loads(data)
-    deletion_data = [datapoint for datapoint in data if datapoint["action"] == "watermark"]
-    deletion_data.sort(key=lambda x: x["max_group_size"]-x["min_group_size"])
+    ax.set_title('Watermark robustness')
+
+    return fig
+
+def plot_parameter_diff(data: dict = None):
+    if data is None:
+        data = load_aggregates()
+    watermark_data = data["watermark"]
+    difference = watermark_data["max_group_size"] - watermark_data["min_group_size"]
+    order = np.argsort(difference, kind="stable")
     # Generate points
-    x1 = [datapoint["max_group_size"]-datapoint["min_group_size"] for datapoint in deletion_data]
-    y1 = [datapoint["documents_introduced"] for datapoint in deletion_data]
+    x1 = difference[order]
+    y1 = watermark_data["documents_introduced"][order]
+
+    fig, ax = plt.subplots()
+    # plotting the line 1 points
+    ax.plot(x1, y1)
 
-    # plotting the line 1 points 
-    plt.plot(x1, y1)
-    
     # naming the x axis
-    plt.xlabel('Difference between min and max parameter')
+    ax.set_xlabel('Difference between min and max parameter')
     # naming the y axis
-    plt.ylabel('Documents introduced')
+    ax.set_ylabel('Documents introduced')
     # giving a title to my graph
-    plt.title('Parameter Impact')
-    plt.legend()
+    ax.set_title('Parameter Impact')
 
-    return plt
+    return fig
 
-def maybe_3d():
-    data = ""
-    with open('logs/results.json', 'r') as file:
-        data = "[" + file.read().rstrip().replace('\n', ',') + "]"
-        data = json.loads(data)
-    deletion_data = [datapoint for datapoint in data if datapoint["action"] == "watermark"]
+def maybe_3d(data: dict = None):
+    if data is None:
+        data = load_aggregates()
+    watermark_data = data["watermark"]
     # setup the figure and axes
     fig = plt.figure()
     ax1 = fig.add_subplot(121, projection='3d')
 
     # data
-    _x = np.array([datapoint["min_group_size"] for datapoint in deletion_data])
-    _y = np.arange([datapoint["max_group_size"] for datapoint in deletion_data])
+    _x = watermark_data["min_group_size"]
+    _y = watermark_data["max_group_size"]
     _xx, _yy = np.meshgrid(_x, _y)
     x, y = _xx.ravel(), _yy.ravel()
 
@@ -129,30 +192,26 @@ def maybe_3d():
     ax1.bar3d(x, y, bottom, width, depth, top, shade=True)
     ax1.set_title('Shaded')
 
-    plt.show()
-
-def plot_security():
-    data = ""
-    with open('logs/results.json', 'r') as file:
-        data = "[" + file.read().rstrip().replace('\n', ',') + "]"
-        data = json.loads(data)
-    deletion_data = [datapoint for datapoint in data if datapoint["action"] == "deletion_attack"]
-    deletion_data.sort(key=lambda x: x["num_watermarked_nodes"])
-    modification_data = [datapoint for datapoint in data if datapoint["action"] == "modification_attack"]
-    modification_data.sort(key=lambda x: x["num_watermarked_nodes"])
+    return fig
+
+def plot_security(data: dict = None):
+    if data is None:
+        data = load_aggregates()
+    deletion_data = _sorted_by(data["deletion_attack"], "num_watermarked_nodes")
+    modification_data = _sorted_by(data["modification_attack"], "num_watermarked_nodes")
     # Generate points
-    x1 = [datapoint["num_watermarked_nodes"] for datapoint in deletion_data]
-    y1 = [datapoint["nodes_after"]*100/datapoint["nodes_before"] for datapoint in deletion_data]
+    x1 = deletion_data["num_watermarked_nodes"]
+    y1 = deletion_data["nodes_after"]*100/deletion_data["nodes_before"]
     NUM_OF_FIELDS = 324760
-    x2 = [datapoint["num_watermarked_nodes"] for datapoint in modification_data]
-    y2 = [datapoint["iteration"]/NUM_OF_FIELDS for datapoint in modification_data]
+    x2 = modification_data["num_watermarked_nodes"]
+    y2 = modification_data["iteration"]/NUM_OF_FIELDS
 
     fig, ax1 = plt.subplots()
 
     color = 'tab:red'
     ax1.set_xlabel('Number of watermarked documents')
     ax1.set_ylim([0,100])
-    ax1.set_ylabel('$\%$ of nodes deleted', color=color)
+    ax1.set_ylabel('$\\%$ of nodes deleted', color=color)
     ax1.plot(x1, y1, color=color)
     ax1.tick_params(axis='y', labelcolor=color)
 
@@ -166,33 +225,50 @@ def plot_security():
 
     fig.tight_layout()  # otherwise the right y-label is slightly clipped
     # giving a title to my graph
-    plt.title('Watermark robustness')
-    plt.legend()
+    ax1.set_title('Watermark robustness')
 
-    return plt
+    return fig
 
 
-# Run if you only want to generate the plots
-if __name__ == "__main__":
-    plot_dir = "plots/"
+# The figures generated by generate_plots and their file names
+PLOTS = {
+    "time_to_watermark.png": plot_documents_vs_time,
+    "robustness.png": plot_robustness,
+    "usability.png": plot_usability,
+    "param_diff.png": plot_parameter_diff,
+    "security.png": plot_security
+}
+
+
+def _render(name: str, data: dict, plot_dir: str) -> str:
+    fig = PLOTS[name](data)
+    path = os.path.join(plot_dir, name)
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+
+def generate_plots(plot_dir: str = "plots/", results_path: str = RESULTS_PATH, names: List[str] = None, workers: int = None) -> List[str]:
+    """
+    Generate and save the plots. The results log is read once (see load_aggregates)
+    and the figures are rendered in parallel, returns the paths of the saved plots.
+
+    :param str plot_dir: the directory the plots are saved to
+    :param str results_path: the path of the results log
+    :param List[str] names: Optional. The file names of the plots to generate (keys of PLOTS), all by default
+    :param int workers: Optional. The number of processes rendering figures
+    """
     if not os.path.exists(plot_dir):
         os.makedirs(plot_dir)
-    plot1 = plot_documents_vs_time()
-    plot1.savefig(os.path.join(plot_dir, "time_to_watermark.png"))
-    plt.cla()
-    plt.clf()
-    plot2 = plot_robustness()
-    plot2.savefig(os.path.join(plot_dir, "robustness.png"))
-    plt.cla()
-    plt.clf()
-    plot3 = plot_usability()
-    plot3.savefig(os.path.join(plot_dir, "usability.png"))
-    plt.cla()
-    plt.clf()
-    plot4 = plot_parameter_diff()
-    plot4.savefig(os.path.join(plot_dir, "param_diff.png"))
-    plt.cla()
-    plt.clf()
-    plot5 = plot_security()
-    plot5.savefig(os.path.join(plot_dir, "security.png"))
+    if names is None:
+        names = list(PLOTS.keys())
+    data = load_aggregates(results_path)
+    if workers == 1 or len(names) == 1:
+        return [_render(name, data, plot_dir) for name in names]
+    with ProcessPoolExecutor(max_workers=workers or min(len(names), os.cpu_count())) as executor:
+        return list(executor.map(_render, names, [data] * len(names), [plot_dir] * len(names)))
+
 
+# Run if you only want to generate the plots
+if __name__ == "__main__":
+    generate_plots()
@@ -1,11 +1,61 @@
 from random import choice, choices, randint
 from typing import List
+import sys
+import time
+import numpy as np
 
 
-def create_pseudo_document(link, type: str, fields: List[str], optional_fields: List[str]):
+class DomainCache:
+    """
+    Cache for the value domains of the fields of a document type. Each (type, field) domain is
+    loaded from the database once and kept as a NumPy object array, so values can be picked in bulk.
+
+    :param float ttl: Optional. The number of seconds after which a domain is loaded again, if None domains are kept until invalidated
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl
+        self.domains = {}
+
+    def get(self, backend, type: str, field: str) -> np.ndarray:
+        """
+        Return the domain of a field, loading it from the database if it is missing or expired
+
+        :param backend: the graph backend, used to load missing domains
+        :param str type: the type of the documents
+        :param str field: the field, whose domain should be returned
+        """
+        entry = self.domains.get((type, field))
+        if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+            return entry[0]
+        values = backend.get_distinct_values(type, field)
+        # Strings are interned, so repeated values across domains share memory
+        domain = np.empty(len(values), dtype=object)
+        domain[:] = [sys.intern(value) if isinstance(value, str) else value for value in values]
+        self.domains[(type, field)] = (domain, time.monotonic())
+        return domain
+
+    def invalidate(self, type: str = None, field: str = None):
+        """
+        Drop cached domains, all of them or only the ones matching the type and/or field
+
+        :param str type: Optional. Only drop domains of this document type
+        :param str field: Optional. Only drop domains of this field
+        """
+        for key in list(self.domains.keys()):
+            if (type is None or key[0] == type) and (field is None or key[1] == field):
+                del self.domains[key]
+
+
+# The cache used when no other cache is specified
+domain_cache = DomainCache()
+
+
+def create_pseudo_document(backend, type: str, fields: List[str], optional_fields: List[str]):
     """
     Create a pseudo (fake) document, given the document type and its fields
-    
+
+    :param backend: the graph backend
     :param List[str] fields: the fields, which the resulting pseudo document should have
     :param str type: the type of the resulting document
     :param List[str] optional_fields: fields, which are optional and might not be present in the end result
@@ -14,20 +64,66 @@ def create_pseudo_document(link, type: str, fields: List[str], optional_fields:
     new_object = {}
     for field in fields:
         # Retrieve all values
-        values = link.run("Match (n:{type}) return collect(distinct n.{field})".format(field=field, type=type)).value()[0]
+        values = backend.get_distinct_values(type, field)
         # Pick a random value for the field
         new_object[field] = choice(values)
-    
+
     # Return if no optional fields were specified
     if len(optional_fields) == 0:
         return new_object
-    
+
     # Add optional fields
     op_fields_chosen = choices(optional_fields, k=randint(0, len(optional_fields)))
     for op_field in op_fields_chosen:
         # Retrieve all values
-        values = link.run("Match (n:{type}) return collect(distinct n.{field})".format(field=op_field, type=type)).value()[0]
+        values = backend.get_distinct_values(type, op_field)
         # Pick a random value for the field
         new_object[op_field] = choice(values)
 
-    return new_object
\ No newline at end of file
+    return new_object
+
+
+def create_pseudo_documents(backend, n: int, type: str, fields: List[str], optional_fields: List[str], cache: DomainCache = None, rng: np.random.Generator = None):
+    """
+    Create n pseudo (fake) documents at once, given the document type and its fields.
+    The documents follow the same distribution as the ones from create_pseudo_document.
+
+    :param backend: the graph backend
+    :param int n: the number of pseudo documents to create
+    :param str type: the type of the resulting documents
+    :param List[str] fields: the fields, which the resulting pseudo documents should have
+    :param List[str] optional_fields: fields, which are optional and might not be present in the end result
+    :param DomainCache cache: Optional. The cache of field domains, the module cache is used if not specified
+    :param rng: Optional. The random generator used to pick the values
+    """
+    if cache is None:
+        cache = domain_cache
+    if rng is None:
+        rng = np.random.default_rng()
+    documents = [{} for _ in range(n)]
+    # Pick all values of a field at once
+    for field in fields:
+        domain = cache.get(backend, type, field)
+        for document, value in zip(documents, domain[rng.integers(len(domain), size=n)]):
+            document[field] = value
+
+    # Return if no optional fields were specified
+    if len(optional_fields) == 0:
+        return documents
+
+    # Each document picks (with replacement) between 0 and len(optional_fields) optional fields
+    m = len(optional_fields)
+    picks_count = rng.integers(m + 1, size=n)
+    picks = rng.integers(m, size=(n, m))
+    picked = np.arange(m) < picks_count[:, None]
+    chosen = np.zeros((n, m), dtype=bool)
+    chosen[np.nonzero(picked)[0], picks[picked]] = True
+    for index, op_field in enumerate(optional_fields):
+        rows = np.flatnonzero(chosen[:, index])
+        if len(rows) == 0:
+            continue
+        domain = cache.get(backend, type, op_field)
+        for row, value in zip(rows, domain[rng.integers(len(domain), size=len(rows))]):
+            documents[row][op_field] = value
+
+    return documents
@@ -0,0 +1,83 @@
+from typing import List
+import gzip
+import logging
+import pickle
+import time
+
+# The labels of the visible pseudo documents
+WATERMARK_LABELS = ["CompanyW", "PropertyW"]
+
+
+def remove_watermark(backend, watermarked_ids: List[int] = None, labels: List[str] = WATERMARK_LABELS) -> int:
+    """
+    Remove only the watermark artifacts (pseudo documents and their edges) from the database.
+    Pseudo documents are found by their ids if given (e.g. the ids returned by watermark_database),
+    otherwise by the labels of visible pseudo documents.
+
+    :param backend: the graph backend holding the database
+    :param List[int] watermarked_ids: Optional. The ids of the pseudo documents
+    :param List[str] labels: the labels of the visible pseudo documents, used when no ids are given
+    """
+    if watermarked_ids is not None:
+        deleted = backend.delete_documents_detach(list(watermarked_ids))
+    else:
+        deleted = sum(backend.delete_label(label) for label in labels)
+    logging.info("{number} pseudo documents removed".format(number=deleted))
+    return deleted
+
+
+def take_snapshot(backend) -> dict:
+    """
+    Read all nodes and relations of the database
+
+    :param backend: the graph backend holding the database
+    """
+    return {
+        "nodes": backend.get_all_nodes(),
+        "relations": backend.get_all_relations()
+    }
+
+
+def save_snapshot(backend, path: str) -> dict:
+    """
+    Save all nodes and relations of the database into a local (compressed) snapshot file
+
+    :param backend: the graph backend holding the database
+    :param str path: the path of the snapshot file
+    """
+    snapshot = take_snapshot(backend)
+    with gzip.open(path, 'wb', compresslevel=1) as file:
+        pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+    logging.info("Snapshot of {nodes} nodes and {relations} relations saved to {path}".format(
+        nodes=len(snapshot["nodes"]), relations=len(snapshot["relations"]), path=path))
+    return snapshot
+
+
+def load_snapshot(path: str) -> dict:
+    """
+    Load a snapshot file
+
+    :param str path: the path of the snapshot file
+    """
+    with gzip.open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def restore_snapshot(backend, snapshot, batch_size: int = None) -> dict:
+    """
+    Replace the contents of the database with a snapshot. The database is emptied in bounded
+    transactions and the snapshot is re-imported in batches. Returns the mapping from the node ids
+    of the snapshot to the new node ids.
+
+    :param backend: the graph backend holding the database
+    :param snapshot: the snapshot (as returned by take_snapshot or load_snapshot) or the path of a snapshot file
+    :param int batch_size: Optional. The number of nodes or relations imported per transaction
+    """
+    start_time = time.time()
+    if isinstance(snapshot, str):
+        snapshot = load_snapshot(snapshot)
+    backend.delete_everything()
+    new_ids = backend.import_graph(snapshot["nodes"], snapshot["relations"], batch_size=batch_size)
+    logging.info("Snapshot of {nodes} nodes restored in {duration} seconds".format(
+        nodes=len(snapshot["nodes"]), duration=time.time() - start_time))
+    return new_ids
@@ -0,0 +1,191 @@
+from typing import Iterator, List
+import atexit
+import json
+import os
+import queue
+import threading
+import instrumentation
+
+
+def index_path(path: str) -> str:
+    """
+    The path of the index of a results log. Every line of the index holds the action, offset
+    and length of one record of the log, so readers can seek to the records of an action.
+
+    :param str path: the path of the results log
+    """
+    return path + ".idx"
+
+
+class ResultWriter:
+    """
+    Buffered writer for the results log. Records are queued and written by a background thread
+    in batches, each batch with a single append to the log and one to its index. Appends are
+    atomic, so several processes can write to the same log.
+
+    :param str path: the path of the results log (JSON lines)
+    :param int batch_size: the maximum number of records written at once
+    :param float flush_interval: the maximum number of seconds a record waits in the queue
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000, flush_interval: float = 1.0):
+        self.name = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pid = None
+        atexit.register(self.close)
+
+    def _start(self):
+        # The thread does not survive a fork, so every process starts its own
+        self.pid = os.getpid()
+        self.error = None
+        # Opened by the caller, so a log which cannot be opened raises here
+        self.log = os.open(self.name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.index = os.open(index_path(self.name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record: dict):
+        """
+        Queue a record to be written
+
+        :param dict record: the record, it needs to contain an "action". With instrumentation enabled,
+            the summary of the queries made since the previous record is added as "queries"
+        """
+        if instrumentation.enabled:
+            # The queries made since the previous record, i.e. by the action of this record
+            record = {**record, "queries": instrumentation.take_summary()}
+        # Serialized by the caller, so a record which cannot be written raises here
+        line = (json.dumps(record) + "\n").encode('utf-8')
+        if self.pid != os.getpid():
+            self._start()
+        self.queue.put((record.get("action"), line))
+
+    def flush(self):
+        """
+        Wait until all queued records are written
+        """
+        if self.pid == os.getpid():
+            self.queue.join()
+            self._raise_error()
+
+    def _raise_error(self):
+        # An error of the background thread is raised in the caller, once
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        """
+        Write the remaining records and stop the background thread
+        """
+        if self.pid == os.getpid():
+            self.queue.put(None)
+            self.thread.join()
+            self.pid = None
+            self._raise_error()
+
+    def _run(self):
+        log = self.log
+        index = self.index
+        try:
+            stop = False
+            while not stop:
+                # Wait for a record, then take everything queued up to the batch size
+                records = [self.queue.get()]
+                try:
+                    while len(records) < self.batch_size:
+                        records.append(self.queue.get(timeout=self.flush_interval))
+                except queue.Empty:
+                    pass
+                if None in records:
+                    stop = True
+                records = [record for record in records if record is not None]
+                try:
+                    if len(records) > 0:
+                        data = b"".join(line for (_, line) in records)
+                        os.write(log, data)
+                        # After an append the offset points to the end of the written data
+                        offset = os.lseek(log, 0, os.SEEK_CUR) - len(data)
+                        entries = []
+                        for (action, line) in records:
+                            entries.append("{action}\t{offset}\t{length}\n".format(
+                                action=action, offset=offset, length=len(line)))
+                            offset += len(line)
+                        os.write(index, "".join(entries).encode('utf-8'))
+                except Exception as err:
+                    # Kept for the next flush or close, the thread goes on with the next records
+                    self.error = err
+                finally:
+                    for _ in range(len(records) + (1 if stop else 0)):
+                        self.queue.task_done()
+        finally:
+            os.close(log)
+            os.close(index)
+
+
+def build_index(path: str) -> dict:
+    """
+    Scan a results log and (re)write its index, returns the offsets and lengths of the records per action
+
+    :param str path: the path of the results log
+    """
+    entries = {}
+    lines = []
+    offset = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            # Empty lines are indexed without an action, so the index covers the whole log
+            action = json.loads(line).get("action") if line.strip() else ""
+            entries.setdefault(action, []).append((offset, len(line)))
+            lines.append("{action}\t{offset}\t{length}\n".format(action=action, offset=offset, length=len(line)))
+            offset += len(line)
+    with open(index_path(path), 'w') as file:
+        file.write("".join(lines))
+    return entries
+
+
+def read_index(path: str) -> dict:
+    """
+    Read the index of a results log, rebuilding it if it does not cover the whole log
+
+    :param str path: the path of the results log
+    """
+    entries = {}
+    covered = 0
+    if os.path.exists(index_path(path)):
+        with open(index_path(path), 'r') as file:
+            for line in file:
+                action, offset, length = line.rstrip("\n").split("\t")
+                entries.setdefault(action, []).append((int(offset), int(length)))
+                covered += int(length)
+    if covered != os.path.getsize(path):
+        entries = build_index(path)
+    return entries
+
+
+def iter_records(path: str, actions: List[str] = None, start: int = 0) -> Iterator[dict]:
+    """
+    Stream the records of a results log, in the order they were written
+
+    :param str path: the path of the results log
+    :param List[str] actions: Optional. Only read the records of these actions, using the index
+    :param int start: Optional. Only read the records from this byte offset of the log on
+    """
+    if not os.path.exists(path):
+        return
+    if actions is None:
+        with open(path, 'rb') as file:
+            file.seek(start)
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    index = read_index(path)
+    positions = sorted(position for action in actions for position in index.get(action, []) if position[0] >= start)
+    with open(path, 'rb') as file:
+        for (offset, length) in positions:
+            file.seek(offset)
+            yield json.loads(file.read(length))
+
@@ -0,0 +1,216 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from typing import List
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from multiprocessing import Manager
+import numpy as np
+from neo4j import GraphDatabase
+from backend import MemoryBackend, Neo4jBackend
+import attack
+import config
+import main
+import pseudo as ps
+import restore
+import results
+
+# The parameters a trial can take and their values if the sweep does not specify them
+DEFAULT_PARAMETERS = {
+    "min_group_size": [10],
+    "max_group_size": [100],
+    "step": [150],
+    "watermark_visible": [True],
+    "attack": ["deletion"],
+    "modification_mode": ["delete"]
+}
+# The graph every trial of a worker starts from (in-memory sweeps)
+_graph = None
+# The database of the worker and the snapshot it is restored to after every trial (Neo4j sweeps)
+_driver = None
+_database = None
+_snapshot = None
+
+
+def get_sweep_id(spec: dict) -> str:
+    """
+    Identify a sweep by its specification, so an interrupted sweep can be resumed
+
+    :param dict spec: the sweep specification
+    """
+    # The number of workers does not change the results, so it can differ when resuming
+    spec = {name: value for name, value in spec.items() if name != "workers"}
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def get_trials(spec: dict) -> List[dict]:
+    """
+    Expand a sweep specification into its list of trials.
+    A "grid" search runs every combination of the parameter values "trials" times,
+    a "random" search runs "trials" trials, each parameter being picked from its list of values
+    or uniformly from a {"min": .., "max": ..} range.
+
+    :param dict spec: the sweep specification
+    """
+    parameters = dict(DEFAULT_PARAMETERS)
+    parameters.update(spec.get("parameters", {}))
+    names = list(parameters.keys())
+    rng = random.Random(spec.get("seed", 0))
+    if spec.get("search", "grid") == "grid":
+        # A new dict per repetition, every trial gets its own id and seed
+        combinations = [dict(zip(names, values)) for _ in range(spec.get("trials", 1))
+                        for values in product(*parameters.values())]
+    elif spec["search"] == "random":
+        combinations = []
+        for _ in range(spec.get("trials", 1)):
+            combinations.append({name: rng.randint(values["min"], values["max"]) if isinstance(values, dict) else rng.choice(values)
+                                 for name, values in parameters.items()})
+    else:
+        raise ValueError("Unknown search {search}, expected grid or random".format(search=spec["search"]))
+    trials = []
+    for combination in combinations:
+        # Skip the combinations for which no groups can be formed
+        if combination["min_group_size"] > combination["max_group_size"]:
+            continue
+        combination["trial"] = len(trials)
+        combination["seed"] = rng.getrandbits(32)
+        trials.append(combination)
+    return trials
+
+
+def get_completed_trials(results_path: str, sweep_id: str) -> set:
+    """
+    Read the trials of a sweep, which already completed, from the results log
+
+    :param str results_path: the path of the results log
+    :param str sweep_id: the id of the sweep
+    """
+    return set(record["trial"] for record in results.iter_records(results_path, actions=["sweep_trial"])
+               if record.get("sweep") == sweep_id and record.get("status") == "done")
+
+
+def _init_worker(graph: MemoryBackend):
+    global _graph
+    _graph = graph
+
+
+def _init_neo4j_worker(databases, snapshot_path: str):
+    global _driver, _database, _snapshot
+    _driver = GraphDatabase.driver(config.get_database_uri(), auth=config.get_database_auth())
+    _database = databases.get()
+    _snapshot = restore.load_snapshot(snapshot_path)
+    with _driver.session(database=_database) as session:
+        restore.restore_snapshot(Neo4jBackend(session), _snapshot)
+
+
+def _run_trial_on(graph, trial: dict):
+    settings = config.get_settings()
+    # Every random choice of the trial follows from its seed
+    random.seed(trial["seed"])
+    ps.domain_cache.invalidate()
+    watermarked = main.watermark_uk_companies(graph, settings["key"], settings["watermark_identity"],
+                                              trial["watermark_visible"],
+                                              min_group_size=trial["min_group_size"],
+                                              max_group_size=trial["max_group_size"],
+                                              batch_size=settings.get("watermark_batch_size", 0),
+                                              randomize_group_sizes=False,
+                                              rng=np.random.default_rng(trial["seed"]))
+    verification = main.uk_companies_verifier(graph, watermarked, settings["key"], settings["watermark_identity"])
+    match trial["attack"]:
+        case "deletion":
+            result = attack.deletion_attack(graph, trial["step"], verification, seed=trial["seed"])
+        case "modification":
+            result = attack.modification_attack(graph, trial["step"], verification,
+                                                mode=trial["modification_mode"], seed=trial["seed"])
+        case "insertion":
+            result = attack.insertion_attack(graph, trial["step"], verification, seed=trial["seed"],
+                                             optional_fields=settings["watermarkFields_optional"])
+        case "simulation":
+            result = attack.deletion_simulation(graph, [0.1, 0.3, 0.5, 0.6, 0.75, 0.8, 0.9, 0.95, 0.98],
+                                                seed=trial["seed"], watermarked_ids=watermarked[0])["survival_probability"]
+        case _:
+            result = None
+    return result
+
+
+def run_trial(trial: dict) -> dict:
+    """
+    Run a single trial (watermark and attack) on a fresh copy of the worker's graph,
+    or on the worker's database, which is restored afterwards
+
+    :param dict trial: the parameters of the trial
+    """
+    start_time = time.time()
+    try:
+        if _graph is not None:
+            result = _run_trial_on(_graph.copy(), trial)
+        else:
+            with _driver.session(database=_database) as session:
+                graph = Neo4jBackend(session, driver=_driver, database=_database)
+                try:
+                    result = _run_trial_on(graph, trial)
+                finally:
+                    restore.restore_snapshot(graph, _snapshot)
+        status = "done"
+    except (Exception, SystemExit) as err:
+        logging.error("Trial {trial} failed: {err}".format(trial=trial["trial"], err=err))
+        result = str(err)
+        status = "error"
+    # Pool workers exit without running exit handlers, so the records of the trial are written now
+    config.get_result_log().flush()
+    return {
+        "action": "sweep_trial",
+        "status": status,
+        "duration": time.time() - start_time,
+        "result": result,
+        **trial
+    }
+
+
+def run_sweep(backend, spec: dict):
+    """
+    Run a sweep of watermark and attack trials on a process pool, every finished trial is written
+    to the results log. With the "memory" backend each worker runs its trials on in-memory copies
+    of the graph, with the "neo4j" backend each worker owns one of the "databases" and restores it
+    from a snapshot of the graph after every trial. Trials of the same sweep, which are already in
+    the log, are skipped.
+
+    :param backend: the graph backend holding the database to experiment on
+    :param dict spec: the sweep specification ("search", "trials", "workers", "seed", "backend", "databases" and "parameters")
+    """
+    sweep_id = get_sweep_id(spec)
+    trials = get_trials(spec)
+    completed = get_completed_trials(config.get_result_log().name, sweep_id)
+    trials = [trial for trial in trials if trial["trial"] not in completed]
+    logging.info("Sweep {sweep}: {remaining} trials to run, {completed} already completed".format(
+        sweep=sweep_id, remaining=len(trials), completed=len(completed)))
+    if len(trials) == 0:
+        return []
+    if spec.get("backend", "memory") == "neo4j":
+        # Every worker owns a database, restored from the snapshot file
+        databases = Manager().Queue()
+        for database in spec["databases"]:
+            databases.put(database)
+        snapshot_path = os.path.join(os.path.dirname(config.get_result_log().name), "sweep-{sweep}.snapshot".format(sweep=sweep_id))
+        restore.save_snapshot(backend, snapshot_path)
+        executor = ProcessPoolExecutor(max_workers=len(spec["databases"]),
+                                       initializer=_init_neo4j_worker, initargs=(databases, snapshot_path))
+    else:
+        # Every worker receives its own copy of the graph once
+        graph = backend if isinstance(backend, MemoryBackend) else MemoryBackend.from_backend(backend)
+        executor = ProcessPoolExecutor(max_workers=spec.get("workers", os.cpu_count()),
+                                       initializer=_init_worker, initargs=(graph,))
+    records = []
+    with executor:
+        futures = [executor.submit(run_trial, trial) for trial in trials]
+        for future in as_completed(futures):
+            record = future.result()
+            record["sweep"] = sweep_id
+            config.get_result_log().write(record)
+            records.append(record)
+            logging.info("Sweep {sweep}: {done}/{total} trials finished".format(
+                sweep=sweep_id, done=len(records), total=len(trials)))
+    return records
@@ -0,0 +1,400 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+from math import exp, lgamma, log, log1p
+from typing import Any, List
+import json
+import logging
+import queue
+import random
+import time
+import numpy as np
+import watermark as wk
+
+# The defaults of the sequential verification: the accepted probability of finding a watermark
+# which is not there, and the number of documents fetched at once
+SPRT_ALPHA = 1e-6
+SEQUENTIAL_CHUNK_SIZE = 100
+# The span of ids scanned at once by the blind detection
+BLIND_PAGE_SIZE = 50000
+
+
+class IncrementalVerifier:
+    """
+    Verifies a watermark during an attack. The watermarked documents are loaded and checked once,
+    afterwards only the documents touched by the attack are fetched and checked again.
+    The watermark is verified while at least one pseudo document still carries it.
+
+    :param backend: the graph backend holding the database
+    :param List[int] watermarked_ids: the ids of the pseudo documents
+    :param key: the key used for the embedding process
+    :param str identity: the identity, which the watermark carries
+    :param List[str] fields: the fields, which were used to generate the watermark
+    :param str cover_field: the field, which contains the watermark
+    :param str scheme: the hash function used, one of watermark.HASH_SCHEMES
+    """
+
+    def __init__(self, backend, watermarked_ids: List[int], key: int, identity: str, fields: List[str], cover_field: str, scheme: str = "sha256"):
+        self.key = key
+        self.identity = identity
+        self.fields = fields
+        self.cover_field = cover_field
+        self.scheme = scheme
+        self.watermarked = set(watermarked_ids)
+        self.verified = set()
+        self.check(backend, watermarked_ids)
+        logging.debug("{verified}/{total} documents carry the watermark".format(
+            verified=len(self.verified), total=len(self.watermarked)))
+
+    def __call__(self, backend=None) -> bool:
+        """
+        Return whether the watermark is still present (at least one pseudo document verifies)
+        """
+        return len(self.verified) > 0
+
+    def check(self, backend, ids: List[int]):
+        """
+        Fetch and check the given pseudo documents again, documents which no longer exist stop verifying
+
+        :param backend: the graph backend holding the database
+        :param List[int] ids: the ids of the pseudo documents to check
+        """
+        if len(ids) == 0:
+            return
+        rows = backend.get_documents_with_ids(ids=list(ids))
+        mask = wk.detect_many((document for (_, document) in rows), key=self.key, identity=self.identity,
+                              field=self.cover_field, fields=self.fields, scheme=self.scheme)
+        self.verified.difference_update(ids)
+        self.verified.update(id for (id, _), verified in zip(rows, mask) if verified)
+
+    def update(self, backend, ids: List[int]):
+        """
+        Notify the verifier that the given documents were deleted or modified
+
+        :param backend: the graph backend holding the database
+        :param List[int] ids: the ids of all documents deleted or modified by the last step of the attack
+        """
+        self.check(backend, [id for id in set(ids) if id in self.watermarked])
+
+
+def _binomial_log_pmf(i: int, n: int, p: float) -> float:
+    return lgamma(n + 1) - lgamma(i + 1) - lgamma(n - i + 1) + i * log(p) + (n - i) * log1p(-p)
+
+
+def binomial_sf(k: int, n: int, p: float) -> float:
+    """
+    The probability of at least k successes out of n trials, each successful with probability p
+
+    :param int k: the number of successes
+    :param int n: the number of trials
+    :param float p: the probability of success of a trial
+    """
+    if k <= 0:
+        return 1.0
+    if k > n:
+        return 0.0
+
+    def log_pmf(i):
+        return _binomial_log_pmf(i, n, p)
+
+    if k <= n * p:
+        # The tail is large, the complement is summed instead
+        return max(0.0, 1.0 - sum(exp(log_pmf(i)) for i in range(k)))
+    # Above the mean the terms decrease, the sum stops once they no longer matter
+    total = 0.0
+    for i in range(k, n + 1):
+        term = exp(log_pmf(i))
+        total += term
+        if term <= total * 1e-16:
+            break
+    return min(total, 1.0)
+
+
+def sequential_verify(backend, watermarked_ids: List[int], key: int, identity: str, fields: List[str], cover_field: str, scheme: str = "sha256", alpha: float = SPRT_ALPHA, chunk_size: int = SEQUENTIAL_CHUNK_SIZE, seed: int = None) -> dict:
+    """
+    Verify a watermark, stopping early once its presence is established. The pseudo documents are fetched
+    in chunks (in random order) and checked one after the other. Without a watermark a document matches
+    by chance (with probability 1/WATERMARK_MODULO), the p-value of k matches is the probability of at least
+    k chance matches out of all pseudo documents.
+    The verification stops as soon as the matches so far give a p-value below alpha: further documents can only
+    add matches, so the decision is the one of checking all of them. The absence of the watermark is only
+    declared after every pseudo document was checked.
+
+    Returns the decision ("verified"), the p-value, the number of documents checked and matched
+    and the total number of documents.
+
+    :param backend: the graph backend holding the database
+    :param List[int] watermarked_ids: the ids of the pseudo documents
+    :param key: the key used for the embedding process
+    :param str identity: the identity, which the watermark carries
+    :param List[str] fields: the fields, which were used to generate the watermark
+    :param str cover_field: the field, which contains the watermark
+    :param str scheme: the hash function used, one of watermark.HASH_SCHEMES
+    :param float alpha: the accepted probability of finding a watermark which is not there
+    :param int chunk_size: the number of documents fetched at once
+    :param int seed: Optional. The seed of the order in which the documents are checked
+    """
+    p0 = 1 / wk.WATERMARK_MODULO
+    ids = list(watermarked_ids)
+    random.Random(seed).shuffle(ids)
+    checked = 0
+    matched = 0
+    # The number of matches from which the p-value over all documents is below alpha
+    required = 1
+    while required <= len(ids) and binomial_sf(required, len(ids), p0) >= alpha:
+        required += 1
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        rows = backend.get_documents_with_ids(ids=chunk)
+        mask = wk.detect_many((document for (_, document) in rows), key=key, identity=identity,
+                              field=cover_field, fields=fields, scheme=scheme)
+        # Deleted documents are not returned, they count as misses
+        verified_ids = set(id for (id, _), verified in zip(rows, mask) if verified)
+        for id in chunk:
+            checked += 1
+            if id in verified_ids:
+                matched += 1
+                if matched >= required:
+                    break
+        if matched >= required:
+            break
+    p_value = binomial_sf(matched, len(ids), p0)
+    logging.debug("{matched}/{checked} documents carry the watermark (p-value: {p_value})".format(
+        matched=matched, checked=checked, p_value=p_value))
+    return {
+        "verified": p_value < alpha,
+        "decided_early": checked < len(ids),
+        "p_value": p_value,
+        "documents_checked": checked,
+        "documents_matched": matched,
+        "documents_total": len(ids)
+    }
+
+
+def significance(k: int, n: int, p: float) -> float:
+    """
+    The significance of k successes out of n trials, each successful with probability p,
+    as -log10 of the p-value. Where the p-value is too small for a float, its largest term is used.
+
+    :param int k: the number of successes
+    :param int n: the number of trials
+    :param float p: the probability of success of a trial
+    """
+    p_value = binomial_sf(k, n, p)
+    if p_value > 0:
+        return max(0.0, -log(p_value) / log(10))
+    return -_binomial_log_pmf(k, n, p) / log(10)
+
+
+def _fetch_page(backends: queue.Queue, label: str, fields: List[str], start: int, end: int):
+    # Fetch a page on one of the idle backends
+    backend = backends.get()
+    try:
+        return backend.get_field_values_in_range(label, fields, start, end)
+    finally:
+        backends.put(backend)
+
+
+def scan_pages(backend, label: str, fields: List[str], process, page_size: int = BLIND_PAGE_SIZE, workers: int = 4, hash_workers: int = 1):
+    """
+    Scan every node with a label in one pass, yielding the number of nodes and the result of process for
+    every page (in the order the pages finish). The ids of the label are split into pages (ranges of page_size ids),
+    which are fetched concurrently, each on its own session (see GraphBackend.pool), with only the given fields.
+    Pages are processed while the next ones are fetched, on hash_workers processes if more than one.
+
+    :param backend: the graph backend holding the database
+    :param str label: the label of the nodes to scan
+    :param List[str] fields: the fields to fetch
+    :param process: the picklable function processing the [id, [values of the fields]] rows of a page
+    :param int page_size: the number of ids per page
+    :param int workers: the number of pages fetched concurrently
+    :param int hash_workers: the number of processes processing pages
+    """
+    id_range = backend.get_id_range(label)
+    pages = iter(range(id_range[0], id_range[1] + 1, page_size) if id_range is not None else [])
+    hasher = ProcessPoolExecutor(max_workers=hash_workers) if hash_workers > 1 else None
+    try:
+        with backend.pool(workers) as backends, ThreadPoolExecutor(max_workers=len(backends)) as fetcher:
+            backend_queue = queue.Queue()
+            for worker_backend in backends:
+                backend_queue.put(worker_backend)
+            fetching = set()
+            hashing = {}
+            while True:
+                # Keep every session busy, without holding more pages in memory than needed
+                for start in pages:
+                    fetching.add(fetcher.submit(_fetch_page, backend_queue, label, fields, start, start + page_size))
+                    if len(fetching) >= 2 * len(backends):
+                        break
+                if not fetching and not hashing:
+                    break
+                done, _ = wait(fetching | hashing.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in hashing:
+                        yield hashing.pop(future), future.result()
+                        continue
+                    fetching.discard(future)
+                    rows = future.result()
+                    if hasher is not None:
+                        hashing[hasher.submit(process, rows)] = len(rows)
+                    else:
+                        yield len(rows), process(rows)
+    finally:
+        if hasher is not None:
+            hasher.shutdown(cancel_futures=True)
+
+
+def _matching_ids(detect, rows: List[List[Any]]) -> List[int]:
+    # A node missing one of the fields cannot carry the watermark
+    mask = detect([None if None in values else tuple(values) for (_, values) in rows])
+    return [id for (id, _), verified in zip(rows, mask.tolist()) if verified]
+
+
+def blind_detection(backend, label: str, key: int, identity: str, fields: List[str], cover_field: str, scheme: str = "sha256", alpha: float = SPRT_ALPHA, page_size: int = BLIND_PAGE_SIZE, workers: int = 4, hash_workers: int = 1) -> dict:
+    """
+    Detect a watermark without knowing the pseudo documents, by checking every node with a label
+    (see scan_pages, only the fields and the cover field are fetched and the pages are hashed in batches).
+
+    Returns the ids of the matching nodes, the number of nodes scanned, the p-value of that many chance matches
+    (without a watermark a node matches with probability 1/WATERMARK_MODULO) and its significance (-log10 of
+    the p-value). The watermark is detected if the p-value is below alpha.
+
+    :param backend: the graph backend holding the database
+    :param str label: the label of the nodes to scan (e.g. the type of the pseudo documents)
+    :param key: the key used for the embedding process
+    :param str identity: the identity, which the watermark carries
+    :param List[str] fields: the fields, which were used to generate the watermark
+    :param str cover_field: the field, which contains the watermark
+    :param str scheme: the hash function used, one of watermark.HASH_SCHEMES
+    :param float alpha: the accepted probability of detecting a watermark which is not there
+    :param int page_size: the number of ids per page
+    :param int workers: the number of pages fetched concurrently
+    :param int hash_workers: the number of processes hashing pages
+    """
+    start_time = time.time()
+    detect = partial(wk.detect_rows, key=key, identity=identity, scheme=scheme)
+    matching_ids = []
+    scanned = 0
+    for rows, page_matches in scan_pages(backend, label, fields + [cover_field], partial(_matching_ids, detect),
+                                         page_size=page_size, workers=workers, hash_workers=hash_workers):
+        scanned += rows
+        matching_ids += page_matches
+    matching_ids.sort()
+    p0 = 1 / wk.WATERMARK_MODULO
+    p_value = binomial_sf(len(matching_ids), scanned, p0)
+    result = {
+        "detected": p_value < alpha,
+        "label": label,
+        "documents_scanned": scanned,
+        "documents_matched": len(matching_ids),
+        "p_value": p_value,
+        "significance": significance(len(matching_ids), scanned, p0),
+        "duration": time.time() - start_time,
+        "matching_ids": matching_ids
+    }
+    logging.info("{matched}/{scanned} {label} nodes carry the watermark (p-value: {p_value})".format(
+        matched=len(matching_ids), scanned=scanned, label=label, p_value=p_value))
+    return result
+
+
+def load_registry(path: str) -> List[List[Any]]:
+    """
+    Load a registry of recipients from a JSON file, a list of {"identity": ..., "key": ...} objects
+    or of [identity, key] pairs. Returns the [identity, key] pairs.
+
+    :param str path: the path of the registry
+    """
+    with open(path) as file:
+        registry = json.load(file)
+    return [[entry["identity"], entry["key"]] if isinstance(entry, dict) else list(entry) for entry in registry]
+
+
+def _trace_rows(registry: List[List[Any]], scheme: str, rows: List[List[Any]]):
+    # Watermarks are numbers below WATERMARK_MODULO, nodes with other cover values carry none of them and
+    # are left out once. The watermarks of the other nodes are computed identity by identity and compared
+    # with their covers at once. Returns the matches per identity, the (identity index, id) matches and the
+    # number of nodes left out for their cover value.
+    ids = []
+    values = []
+    covers = []
+    skipped = 0
+    for (id, row) in rows:
+        cover = row[-1]
+        if None in row:
+            continue
+        if isinstance(cover, bool) or not isinstance(cover, (int, float)) or not 0 <= cover < wk.WATERMARK_MODULO:
+            skipped += 1
+            continue
+        ids.append(id)
+        values.append(tuple(row[:-1]))
+        covers.append(cover)
+    ids = np.asarray(ids, dtype=np.int64)
+    covers = np.asarray(covers, dtype=np.float64)
+    counts = np.zeros(len(registry), dtype=np.int64)
+    matches = []
+    for index, (identity, key) in enumerate(registry):
+        matching = np.flatnonzero(wk.compute_watermarks(values, key, identity, scheme) == covers)
+        counts[index] = len(matching)
+        matches += [(index, id) for id in ids[matching].tolist()]
+    return counts, matches, skipped
+
+
+def trace_leak(backend, label: str, registry: List[List[Any]], fields: List[str], cover_field: str, scheme: str = "sha256", alpha: float = SPRT_ALPHA, page_size: int = BLIND_PAGE_SIZE, workers: int = 4, hash_workers: int = 1) -> dict:
+    """
+    Find out whose watermark a database carries, out of many recipients with their own identity and key.
+    Every node with a label is checked against all identities in a single pass (see scan_pages).
+
+    Recipients are told apart by their position in the registry, so recipients sharing an identity (with different
+    keys) are reported separately. Returns the number of matches of every recipient (in the order of the registry),
+    the number of nodes whose cover value cannot be a watermark, the recipients with matches ("index", "identity",
+    "count", "p_value" and "matching_ids", most matches first) and the traced ones among them: those whose p-value
+    is below alpha divided by the number of recipients (so that alpha bounds the chance of tracing any innocent one).
+
+    :param backend: the graph backend holding the database
+    :param str label: the label of the nodes to scan (e.g. the type of the pseudo documents)
+    :param registry: the [identity, key] pair of every recipient (see load_registry)
+    :param List[str] fields: the fields, which were used to generate the watermark
+    :param str cover_field: the field, which contains the watermark
+    :param str scheme: the hash function used, one of watermark.HASH_SCHEMES
+    :param float alpha: the accepted probability of tracing a recipient whose watermark is not there
+    :param int page_size: the number of ids per page
+    :param int workers: the number of pages fetched concurrently
+    :param int hash_workers: the number of processes hashing pages
+    """
+    start_time = time.time()
+    counts = np.zeros(len(registry), dtype=np.int64)
+    matching_ids = {}
+    scanned = 0
+    skipped = 0
+    for rows, (page_counts, page_matches, page_skipped) in scan_pages(backend, label, fields + [cover_field],
+                                                        partial(_trace_rows, registry, scheme),
+                                                        page_size=page_size, workers=workers, hash_workers=hash_workers):
+        scanned += rows
+        skipped += page_skipped
+        counts += page_counts
+        for (index, id) in page_matches:
+            matching_ids.setdefault(index, []).append(id)
+    if skipped > 0:
+        logging.info("{skipped}/{scanned} {label} nodes have a {field} which is not a number below {modulo}, they carry no watermark".format(
+            skipped=skipped, scanned=scanned, label=label, field=cover_field, modulo=wk.WATERMARK_MODULO))
+    p0 = 1 / wk.WATERMARK_MODULO
+    # Recipients are told apart by their position in the registry, several may share an identity
+    matches = sorted(({
+        "index": index,
+        "identity": registry[index][0],
+        "count": count,
+        "p_value": binomial_sf(count, scanned, p0),
+        "matching_ids": sorted(matching_ids[index])
+    } for index, count in enumerate(counts.tolist()) if count > 0), key=lambda match: -match["count"])
+    traced = [match for match in matches if match["p_value"] < alpha / max(len(registry), 1)]
+    logging.info("{scanned} {label} nodes traced against {identities} identities, traced: {traced}".format(
+        scanned=scanned, label=label, identities=len(registry), traced=[match["identity"] for match in traced]))
+    return {
+        "label": label,
+        "identities": len(registry),
+        "documents_scanned": scanned,
+        "documents_skipped": skipped,
+        "counts": counts.tolist(),
+        "matches": matches,
+        "traced": traced,
+        "duration": time.time() - start_time
+    }
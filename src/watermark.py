@@ -1,12 +1,60 @@
 from typing import Any, List
-from random import randint, randrange
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import hashlib
-import database as db
+import os
+import numpy as np
+import manifest
+from catalog import NodeCatalog
 import pseudo as ps
-import sys
 import logging
+import queue
+import time
 
-def embed_watermark(document, key: int, identity: str, field: str, fields: List[str]):
+# The watermark is the hash of the document, reduced modulo this number
+WATERMARK_MODULO = 11706361
+# The hash functions a watermark can be computed with
+HASH_SCHEMES = ["sha256", "blake2b"]
+
+
+def watermark_hasher(key: int, identity: str, scheme: str = "sha256"):
+    """
+    Prepare the keyed hasher state shared by all documents of a watermark.
+    Returns the hasher, already fed with the identity, and the bytes to append after the fields.
+
+    :param key the key used for the embedding process
+    :param str identity the identity, which the watermark will carry
+    :param str scheme the hash function, "sha256" hashes identity + fields + key, "blake2b" is keyed with the key and hashes identity + fields
+    """
+    key_bytes = str(key).encode('utf-8')
+    if scheme == "sha256":
+        return hashlib.sha256(identity.encode('utf-8')), key_bytes
+    if scheme == "blake2b":
+        # BLAKE2b keys are limited to 64 bytes
+        if len(key_bytes) > hashlib.blake2b.MAX_KEY_SIZE:
+            key_bytes = hashlib.sha512(key_bytes).digest()
+        return hashlib.blake2b(identity.encode('utf-8'), key=key_bytes), b""
+    raise ValueError("Unknown hash scheme {scheme}, expected one of {schemes}".format(
+        scheme=scheme, schemes=HASH_SCHEMES))
+
+
+def compute_watermark(hasher, suffix: bytes, document, fields) -> int:
+    """
+    Compute the watermark of a document from a prepared hasher (see watermark_hasher)
+
+    :param hasher the hasher, fed with the identity
+    :param bytes suffix the bytes fed after the fields
+    :param document the document (or a tuple of values, with fields being the indices)
+    :param fields the fields, which will be used to generate the watermark
+    """
+    hasher = hasher.copy()
+    for field in fields:
+        hasher.update(str(document[field]).encode('utf-8'))
+    hasher.update(suffix)
+    return int.from_bytes(hasher.digest(), 'big') % WATERMARK_MODULO
+
+
+def embed_watermark(document, key: int, identity: str, field: str, fields: List[str], scheme: str = "sha256"):
     """
     Embed the watermark inside the document
 
@@ -15,15 +63,14 @@ def embed_watermark(document, key: int, identity: str, field: str, fields: List[
     :param str indetity the indetity, which the watermark will carry
     :param str field the field, into which the watermark will be embedded
     :param List[str] fields the fields, which will be used to generate the watermark
+    :param str scheme the hash function used, one of HASH_SCHEMES
     """
-    concatinated_fields = [str(document[field]) for field in fields]
-    watermark_string = identity + "".join(concatinated_fields) + str(key)
-    watermark_hash = hashlib.sha256(watermark_string.encode('utf-8'))
-    watermark = int.from_bytes(watermark_hash.digest(), 'big') % 11706361
+    hasher, suffix = watermark_hasher(key, identity, scheme)
+    watermark = compute_watermark(hasher, suffix, document, fields)
     document[field] = watermark
     return watermark
 
-def detect_watermark(document, key: int, identity: str, field: str, fields: List[str]):
+def detect_watermark(document, key: int, identity: str, field: str, fields: List[str], scheme: str = "sha256"):
     """
     Detect if a watermark is present inside the document
 
@@ -32,62 +79,152 @@ def detect_watermark(document, key: int, identity: str, field: str, fields: List
     :param str indetity the indetity, which the watermark will carry
     :param str field the field, into which the watermark will be embedded
     :param List[str] fields the fields, which will be used to generate the watermark
+    :param str scheme the hash function used, one of HASH_SCHEMES
     """
-    concatinated_fields = [str(document[field]) for field in fields]
-    watermark_string = identity + "".join(concatinated_fields) + str(key)
-    watermark_hash = hashlib.sha256(watermark_string.encode('utf-8'))
-    watermark = int.from_bytes(watermark_hash.digest(), 'big') % 11706361
+    hasher, suffix = watermark_hasher(key, identity, scheme)
+    watermark = compute_watermark(hasher, suffix, document, fields)
     return document[field] == watermark
 
 
-def get_random_set(target_sum: int, lower_range: int, upper_range: int, max_tries: int):
+def _detect(hasher, suffix: bytes, document, field, fields) -> bool:
+    # A document missing one of the fields cannot carry the watermark
+    try:
+        return document[field] == compute_watermark(hasher, suffix, document, fields)
+    except KeyError:
+        return False
+
+
+def _document_row(document, field: str, fields: List[str]):
+    # The values needed for detection, as a picklable tuple (None if a field is missing)
+    try:
+        return tuple(document[name] for name in fields) + (document[field],)
+    except KeyError:
+        return None
+
+
+def compute_watermarks(rows, key: int, identity: str, scheme: str = "sha256") -> np.ndarray:
+    """
+    Compute the watermarks of many rows, returns them as a NumPy array. A row holds the values of the fields.
+    Rows are picklable, so they can be hashed on other processes.
+
+    :param rows the rows, of which the watermarks should be computed
+    :param key the key used for the embedding process
+    :param str identity the identity, which the watermark will carry
+    :param str scheme the hash function used, one of HASH_SCHEMES
+    """
+    hasher, suffix = watermark_hasher(key, identity, scheme)
+    return np.fromiter((compute_watermark(hasher, suffix, row, range(len(row))) for row in rows),
+                       dtype=np.int64, count=len(rows))
+
+
+def detect_rows(rows, key: int, identity: str, scheme: str = "sha256") -> np.ndarray:
+    """
+    Detect which rows carry the watermark, returns a boolean NumPy mask. A row holds the values of
+    the fields followed by the value of the cover field, rows which are None do not carry it.
+    Rows are picklable, so they can be checked on other processes.
+
+    :param rows the rows, which should be checked
+    :param key the key used for the embedding process
+    :param str identity the identity, which the watermark will carry
+    :param str scheme the hash function used, one of HASH_SCHEMES
     """
-    Generate a set of random numbers, all summing up to a target sum
+    hasher, suffix = watermark_hasher(key, identity, scheme)
+    return np.fromiter((row is not None and _detect(hasher, suffix, row, len(row) - 1, range(len(row) - 1)) for row in rows),
+                       dtype=bool, count=len(rows))
+
+
+def _map_chunks(function, rows, workers: int, chunk_size: int, **kwargs):
+    # Run the function over chunks of rows on a process pool and join the results in order
+    chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(partial(function, **kwargs), chunks)))
+
 
-    :param int target_sum the target sum when you sum up all the numbers from the list
-    :param int lower_range the lower bound (inclusive) of the range
-    :param int upper_range the upper bound (excluside) of the range
-    :param int max_tries the number of tries it takes before the algorithm gives up
+def embed_many(documents, key: int, identity: str, field: str, fields: List[str], scheme: str = "sha256", workers: int = 1, chunk_size: int = 50000) -> np.ndarray:
     """
-    # While the algorithm has not exeeded the maximum tries
-    if max_tries <= 0:
-        print("No groups were found satisfying the bounds {lower} and {upper} after {tries} tries"
-            .format(upper=upper_range, lower=lower_range, tries=max_tries))
-        sys.exit(1)
+    Embed the watermark inside many documents, returns the watermarks as a NumPy array
 
-    random_list = []
-    # Fill the list with random ints, untill you hit the upper bound of the range
-    while target_sum - sum(random_list) > upper_range:
-        random_list.append(randint(lower_range, upper_range))
-    # Then check if the number is in the range
-    remainder = target_sum - sum(random_list)
-    if remainder < lower_range:
-        # If the number is not in the range, run the algorithm again
-        return get_random_set(target_sum, upper_range, lower_range, max_tries - 1)
-    # else append the remainder and return the array
+    :param documents the documents (list or iterable), where the watermark should be embedded
+    :param key the key used for the embedding process
+    :param str identity the identity, which the watermark will carry
+    :param str field the field, into which the watermark will be embedded
+    :param List[str] fields the fields, which will be used to generate the watermark
+    :param str scheme the hash function used, one of HASH_SCHEMES
+    :param int workers the number of processes used, batches bigger than chunk_size are split over them
+    :param int chunk_size the number of documents hashed per process task
+    """
+    documents = list(documents)
+    if workers > 1 and len(documents) > chunk_size:
+        rows = [tuple(document[name] for name in fields) for document in documents]
+        watermarks = _map_chunks(compute_watermarks, rows, workers, chunk_size,
+                                 key=key, identity=identity, scheme=scheme)
     else:
-        random_list.append(remainder)
-        return random_list
+        hasher, suffix = watermark_hasher(key, identity, scheme)
+        watermarks = np.fromiter((compute_watermark(hasher, suffix, document, fields) for document in documents),
+                                 dtype=np.int64, count=len(documents))
+    for document, watermark in zip(documents, watermarks.tolist()):
+        document[field] = watermark
+    return watermarks
 
-def divide_groups(group: List[Any], group_sizes: List[int]):
+
+def detect_many(documents, key: int, identity: str, field: str, fields: List[str], scheme: str = "sha256", workers: int = 1, chunk_size: int = 50000) -> np.ndarray:
+    """
+    Detect which documents carry the watermark, returns a boolean NumPy mask.
+    Documents missing any of the fields do not carry it.
+
+    :param documents the documents (list or iterable), which should be checked
+    :param key the key used for the embedding process
+    :param str identity the identity, which the watermark will carry
+    :param str field the field, into which the watermark will be embedded
+    :param List[str] fields the fields, which will be used to generate the watermark
+    :param str scheme the hash function used, one of HASH_SCHEMES
+    :param int workers the number of processes used, batches bigger than chunk_size are split over them
+    :param int chunk_size the number of documents hashed per process task
     """
-    Divide a list of objects into groups with a given size
+    if workers > 1:
+        rows = [_document_row(document, field, fields) for document in documents]
+        if len(rows) > chunk_size:
+            return _map_chunks(detect_rows, rows, workers, chunk_size,
+                               key=key, identity=identity, scheme=scheme)
+        return detect_rows(rows, key=key, identity=identity, scheme=scheme)
+    hasher, suffix = watermark_hasher(key, identity, scheme)
+    return np.fromiter((_detect(hasher, suffix, document, field, fields) for document in documents),
+                       dtype=bool)
+
 
-    :param List[Any] group the whole group of objects
-    :param List[int] group_sizes a list of sizes for each group
+def get_visible_watermark_ids(backend):
     """
-    # Check if the sum of group_sizes is equal to the size of group
-    assert len(group) == sum(group_sizes)
-    # Create a new list
-    new_groups = []
-    # for each size
-    for group_size in group_sizes:
-        # pick random elements from the list and create a new array from them
-        new_group = [group.pop(randrange(len(group))) for _ in range(group_size)]
-        # append the new array to the return of the function
-        new_groups.append(new_group)
+    Retrieve the ids of the visible pseudo documents, for the Company and Property types
 
-    return new_groups
+    :param backend: The graph backend holding the database
+    """
+    return [backend.get_label_ids("CompanyW"), backend.get_label_ids("PropertyW")]
+
+
+def get_watermark_ids(backend, manifest_path: str = None, key: int = None, identity: str = None):
+    """
+    Retrieve the ids of the pseudo documents, in the format of get_visible_watermark_ids.
+    If there is a manifest (see watermark_database), the ids are read from it, which needs no label scans
+    and also works for invisible watermarks; otherwise the visible pseudo documents are looked up.
+    A manifest is only used if it belongs to the key and identity (when given), otherwise a ValueError is raised,
+    and if it belongs to the database (see manifest.check_documents), otherwise the visible pseudo documents
+    are looked up instead.
+
+    :param backend: The graph backend holding the database
+    :param str manifest_path: Optional. The path of the manifest
+    :param key: Optional. The key the watermark is expected to be embedded with
+    :param str identity: Optional. The identity the watermark is expected to carry
+    """
+    if manifest_path is not None and os.path.exists(manifest_path):
+        watermark_manifest = manifest.read_manifest(manifest_path)
+        if key is not None and not manifest.check_key(watermark_manifest, key, identity):
+            raise ValueError("The watermark manifest {path} was not written with the key and identity {identity}".format(
+                path=manifest_path, identity=identity))
+        if manifest.check_documents(watermark_manifest, backend):
+            return [watermark_manifest["pseudo_ids"].tolist(), []]
+        logging.warning("The pseudo documents of the watermark manifest {path} are not in the database, "
+                        "looking up the visible pseudo documents instead".format(path=manifest_path))
+    return get_visible_watermark_ids(backend)
 
 
 RELATIONS = {
@@ -97,7 +234,7 @@ RELATIONS = {
     "Company": {"type": "HAS_CONTROL", "dir": "out"}
 }
 
-def watermark_database(session,
+def watermark_database(backend,
                        ids: List[int],
                        min_group_size: int,
                        max_group_size: int,
@@ -105,15 +242,21 @@ def watermark_database(session,
                        watermark_cover_field: str,
                        watermarked_document_fields: List[str],
                        watermark_key: int,
-                       group_find_max_tries: int = 50,
                        watermarked_document_optional_fields: List[str] = [],
                        watermark_identity: str = "",
                        watermark_edge_direction_randomized: bool = False,
-                       watermark_visibility: bool = False):
+                       watermark_visibility: bool = False,
+                       watermark_batch_size: int = 0,
+                       watermark_hash_scheme: str = "sha256",
+                       watermark_workers: int = 1,
+                       watermark_manifest_path: str = None,
+                       rng: np.random.Generator = None):
     """
-    Watermarks a database
+    Watermarks a database. The groups are found at once, a ValueError is raised if the ids cannot be
+    divided into groups within the size bounds.
 
-    :param ids: The ids of the documents, which need to be watermarked
+    :param backend: The graph backend holding the database
+    :param ids: The documents, which need to be watermarked, as a NodeCatalog or as [id, label] pairs
     :param min_group_size: The minimum size of each group
     :param max_group_size: The maximum size of each group
     :param watermarked_document_type: The type of the document, which contains the watermark
@@ -121,45 +264,171 @@ def watermark_database(session,
     :param watermarked_document_fields: The fields, which are included inside the watermarked document
     :param watermarked_document_optional_fields: The fielDs, which are optionally included inside the watermarked document
     :param watermark_key: The private key for the watermark
-    :param group_find_max_tries: The amount of tries it will take for the algorithm to give up on partitioning groups
     :param watermark_identity: An optional identity for the watermark, this can be the name of the person the information was leased or any other identifiable string
     :param watermark_edge_direction_randomized: If the edge direction should be randomized. If true, the algorithm will treat the graph as undirected and not take the direction of the edges into account when creating the watermark.
     :param watermark_visibility: Optional. If selected, the letter W will be added on  the back of the type of the watermark document and edges, indicating that it is watermarked.
+    :param watermark_batch_size: Optional. If bigger than 0, the pseudo documents and their edges are written in chunks of this many documents, each chunk in a single transaction.
+    :param watermark_hash_scheme: Optional. The hash function used for the watermark, one of HASH_SCHEMES
+    :param watermark_workers: Optional. If bigger than 1, the chunks of pseudo documents are written concurrently on this many sessions (groups of one document per chunk, if watermark_batch_size is 0)
+    :param watermark_manifest_path: Optional. If given, the manifest of the watermark (see manifest.write_manifest) is written to this path, for verification without label scans
+    :param rng: Optional. The random generator used for the groups and the pseudo documents, for reproducible watermarks
     """
-    # Determine the size of each group
-    group_sizes = get_random_set(
-        len(ids), min_group_size, max_group_size, group_find_max_tries)
-    # Pick the groups, based on the predetermined size
-    groups = divide_groups(ids, group_sizes)
+    # Divide the ids into random groups within the size bounds
+    if not isinstance(ids, NodeCatalog):
+        ids = NodeCatalog.from_pairs(ids)
+    groups = ids.groups(min_group_size, max_group_size, rng)
+    if watermark_batch_size > 0 or watermark_workers > 1:
+        return watermark_groups_batched(backend,
+                                        groups=groups,
+                                        batch_size=max(watermark_batch_size, 1),
+                                        watermarked_document_type=watermarked_document_type,
+                                        watermark_cover_field=watermark_cover_field,
+                                        watermarked_document_fields=watermarked_document_fields,
+                                        watermark_key=watermark_key,
+                                        watermarked_document_optional_fields=watermarked_document_optional_fields,
+                                        watermark_identity=watermark_identity,
+                                        watermark_visibility=watermark_visibility,
+                                        watermark_hash_scheme=watermark_hash_scheme,
+                                        workers=watermark_workers,
+                                        manifest_path=watermark_manifest_path,
+                                        rng=rng)
     # Generate pseudo document for each group
+    pseudo_documents = ps.create_pseudo_documents(
+        backend,
+        n=len(groups),
+        type=watermarked_document_type,
+        fields=watermarked_document_fields,
+        optional_fields=watermarked_document_optional_fields,
+        rng=rng)
     document_ids = []
-    for index, group in enumerate(groups):
-        pseudo_document = session.execute_read(
-            ps.create_pseudo_document,
-            type=watermarked_document_type,
-            fields=watermarked_document_fields,
-            optional_fields=watermarked_document_optional_fields)
+    hashes = []
+    for index, (group, pseudo_document) in enumerate(zip(groups, pseudo_documents)):
         # Embed watermark in each pseudo document
-        embed_watermark(pseudo_document, key=watermark_key, identity=watermark_identity,
-                           field=watermark_cover_field, fields=watermarked_document_fields)
+        watermark = embed_watermark(pseudo_document, key=watermark_key, identity=watermark_identity,
+                           field=watermark_cover_field, fields=watermarked_document_fields,
+                           scheme=watermark_hash_scheme)
         # Insert the pseudo documents inside the database
-        pseudo_node = session.execute_write(db.create_node,
-                                            document=pseudo_document,
-                                            visible=watermark_visibility,
-                                            node_type=watermarked_document_type
-                                            )
+        pseudo_node = backend.create_node(document=pseudo_document,
+                                          visible=watermark_visibility,
+                                          node_type=watermarked_document_type
+                                          )
 
         document_ids.append(pseudo_node)
+        hashes.append(watermark)
         # Create relations
         for (node, label) in group:
             relation = RELATIONS[label]
-            session.execute_write(db.create_relation,
-                                  source_id=pseudo_node,
-                                  dest_id=node,
-                                  edge_type=relation["type"],
-                                  reversed=(relation["dir"] == "in"),
-                                  visible=watermark_visibility
-                                  )
+            backend.create_relation(source_id=pseudo_node,
+                                    dest_id=node,
+                                    edge_type=relation["type"],
+                                    reversed=(relation["dir"] == "in"),
+                                    visible=watermark_visibility
+                                    )
         if index % 10 == 0:
             logging.info("Watermarked {index}/{total} groups".format(index=index, total=len(groups)))
+    if watermark_manifest_path is not None:
+        manifest.write_manifest(watermark_manifest_path, document_ids, groups, hashes, key=watermark_key,
+                                identity=watermark_identity, document_type=watermarked_document_type,
+                                cover_field=watermark_cover_field, fields=watermarked_document_fields,
+                                scheme=watermark_hash_scheme, visible=watermark_visibility)
     return document_ids
+
+
+def watermark_groups_batched(backend,
+                             groups: List[List[Any]],
+                             batch_size: int,
+                             watermarked_document_type: str,
+                             watermark_cover_field: str,
+                             watermarked_document_fields: List[str],
+                             watermark_key: int,
+                             watermarked_document_optional_fields: List[str] = [],
+                             watermark_identity: str = "",
+                             watermark_visibility: bool = False,
+                             watermark_hash_scheme: str = "sha256",
+                             workers: int = 1,
+                             retries: int = 3,
+                             manifest_path: str = None,
+                             rng: np.random.Generator = None):
+    """
+    Watermarks already partitioned groups, writing the pseudo documents and their edges in chunks.
+    The groups are disjoint, so chunks can be written concurrently on a pool of sessions without
+    contending for the same nodes; the ids are returned in the order of the groups either way.
+
+    :param backend: The graph backend holding the database
+    :param groups: The groups of [id, label] pairs, one pseudo document is created per group
+    :param batch_size: The number of pseudo documents (with their edges) written per transaction
+    :param watermarked_document_type: The type of the document, which contains the watermark
+    :param watermark_cover_field: The name of the field, which contains the watermark
+    :param watermarked_document_fields: The fields, which are included inside the watermarked document
+    :param watermark_key: The private key for the watermark
+    :param watermarked_document_optional_fields: The fields, which are optionally included inside the watermarked document
+    :param watermark_identity: An optional identity for the watermark
+    :param watermark_visibility: Optional. If selected, the letter W will be added on  the back of the type of the watermark document and edges, indicating that it is watermarked.
+    :param watermark_hash_scheme: Optional. The hash function used for the watermark, one of HASH_SCHEMES
+    :param workers: Optional. The number of sessions writing chunks concurrently (see GraphBackend.pool)
+    :param retries: Optional. The number of times a chunk is written again after a transient error
+    :param manifest_path: Optional. If given, the manifest of the watermark is written to this path
+    :param rng: Optional. The random generator used for the pseudo documents
+    """
+    # Build all pseudo documents and their edges in memory
+    pseudo_documents = ps.create_pseudo_documents(
+        backend,
+        n=len(groups),
+        type=watermarked_document_type,
+        fields=watermarked_document_fields,
+        optional_fields=watermarked_document_optional_fields,
+        rng=rng)
+    hashes = embed_many(pseudo_documents, key=watermark_key, identity=watermark_identity,
+               field=watermark_cover_field, fields=watermarked_document_fields,
+               scheme=watermark_hash_scheme)
+    connections = [[(node, RELATIONS[label]["type"], RELATIONS[label]["dir"] == "in") for (node, label) in group]
+                   for group in groups]
+    # Write them chunk by chunk, each chunk in a single transaction
+    with backend.pool(workers) as backends:
+        backend_queue = queue.Queue()
+        for worker_backend in backends:
+            backend_queue.put(worker_backend)
+        with ThreadPoolExecutor(max_workers=len(backends)) as executor:
+            futures = [executor.submit(_write_chunk, backend_queue, retries,
+                                       documents=pseudo_documents[start:start + batch_size],
+                                       connections=connections[start:start + batch_size],
+                                       document_type=watermarked_document_type,
+                                       visible=watermark_visibility)
+                       for start in range(0, len(pseudo_documents), batch_size)]
+            document_ids = []
+            for future in futures:
+                document_ids += future.result()
+                logging.info("Watermarked {index}/{total} groups".format(
+                    index=len(document_ids), total=len(groups)))
+    if manifest_path is not None:
+        manifest.write_manifest(manifest_path, document_ids, groups, hashes, key=watermark_key,
+                                identity=watermark_identity, document_type=watermarked_document_type,
+                                cover_field=watermark_cover_field, fields=watermarked_document_fields,
+                                scheme=watermark_hash_scheme, visible=watermark_visibility)
+    return document_ids
+
+
+# The seconds waited before writing a chunk again, doubled after every retry
+RETRY_DELAY = 0.5
+
+
+def _is_transient(err: Exception) -> bool:
+    # Errors of the neo4j driver tell whether retrying can succeed
+    is_retryable = getattr(err, "is_retryable", None)
+    return is_retryable is not None and is_retryable()
+
+
+def _write_chunk(backends: queue.Queue, retries: int, **chunk):
+    # Write a chunk on one of the idle backends, retrying after transient errors
+    backend = backends.get()
+    try:
+        for attempt in range(retries + 1):
+            try:
+                return backend.add_documents(**chunk)
+            except Exception as err:
+                if attempt == retries or not _is_transient(err):
+                    raise
+                logging.warning("Writing a chunk failed ({err}), retrying".format(err=err))
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+    finally:
+        backends.put(backend)
@@ -0,0 +1,26 @@
+import os
+import benchmark
+import manifest
+import pseudo as ps
+import watermark as wk
+
+
+def _watermarked_graph(path: str):
+    graph = benchmark.get_graph(2000, 0).copy()
+    ps.domain_cache.invalidate()
+    wk.watermark_database(graph, graph.get_ids_with_labels(label="Company"), 5, 10, "Company",
+                          benchmark.COVER_FIELD, benchmark.FIELDS, benchmark.KEY,
+                          watermark_identity=benchmark.IDENTITY, watermark_visibility=True,
+                          watermark_batch_size=1000, watermark_manifest_path=path)
+    return graph
+
+
+def test_manifest_without_existing_documents_falls_back_to_visible_ids(tmp_path):
+    path = os.path.join(str(tmp_path), "manifest.npz")
+    graph = _watermarked_graph(path)
+    watermark_manifest = manifest.read_manifest(path)
+    assert manifest.check_documents(watermark_manifest, graph)
+    graph.delete_documents_detach(watermark_manifest["pseudo_ids"].tolist())
+    assert not manifest.check_documents(watermark_manifest, graph)
+    ids = wk.get_watermark_ids(graph, path, benchmark.KEY, benchmark.IDENTITY)
+    assert ids == wk.get_visible_watermark_ids(graph)
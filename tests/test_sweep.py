@@ -0,0 +1,12 @@
+import json
+import os
+import sweep
+
+
+def test_grid_trials_have_unique_ids_and_seeds():
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "settings.json")) as file:
+        spec = json.load(file)["sweep"]
+    trials = sweep.get_trials(spec)
+    assert len(trials) == 3 * 3 * 2 * 2
+    assert sorted(trial["trial"] for trial in trials) == list(range(len(trials)))
+    assert len(set(trial["seed"] for trial in trials)) == len(trials)
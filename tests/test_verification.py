@@ -0,0 +1,24 @@
+import benchmark
+import pseudo as ps
+import verification
+import watermark as wk
+
+
+def _watermarked_graph(identity: str, key: int):
+    graph = benchmark.get_graph(2000, 0).copy()
+    ps.domain_cache.invalidate()
+    wk.watermark_database(graph, graph.get_ids_with_labels(label="Company"), 5, 10, "Company",
+                          benchmark.COVER_FIELD, benchmark.FIELDS, key, watermark_identity=identity,
+                          watermark_batch_size=1000)
+    return graph
+
+
+def test_trace_leak_tells_apart_recipients_sharing_an_identity():
+    graph = _watermarked_graph("RP", 2)
+    registry = [["RP", 1], ["X", 2], ["RP", 2]]
+    result = verification.trace_leak(graph, "Company", registry, benchmark.FIELDS, benchmark.COVER_FIELD, workers=1)
+    assert result["counts"][0] == 0
+    assert result["counts"][1] == 0
+    assert result["counts"][2] > 0
+    assert [match["index"] for match in result["traced"]] == [2]
+    assert result["traced"][0]["count"] == result["counts"][2]